@@ -759,6 +759,13 @@ ALTER TABLE ONLY public.takeoffs
 CREATE INDEX idx_flights_first_seen ON public.flights USING btree (first_seen DESC NULLS LAST);
 
 
+--
+-- Name: idx_flights_last_seen; Type: INDEX; Schema: public; Owner: dump1090
+--
+
+CREATE INDEX idx_flights_last_seen ON public.flights USING btree (last_seen DESC NULLS LAST);
+
+
 --
 -- TOC entry 4654 (class 1259 OID 41119)
 -- Name: idx_flights_id; Type: INDEX; Schema: public; Owner: dump1090
@@ -13,4 +13,8 @@ DELETE FROM
         USING takeoff b
 WHERE
     a.id < b.id
-    AND a.flight_id = b.flight_id;
\ No newline at end of file
+    AND a.flight_id = b.flight_id;
+
+-- Index of the query of recently seen flights by the logger on startup (see REATTACH_GAP), for databases created
+-- before it
+CREATE INDEX IF NOT EXISTS idx_flights_last_seen ON public.flights USING btree (last_seen DESC NULLS LAST);
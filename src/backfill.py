@@ -0,0 +1,53 @@
+"""
+Backfill recorded BaseStation logs (optionally gzip or zstd compressed) into the database.
+
+Example:
+    python backfill.py --checkpoint backfill.json logs/2019-10-*.txt.gz
+"""
+import argparse
+import logging
+import sys
+
+from db import engine
+from dump1090_postgis.adsb_parser import AdsbMessageFilter
+from dump1090_postgis.airports import RUNWAYS_CSV, load_airports
+from dump1090_postgis.backfill import ArchiveSource, Backfill, BulkFlightWriter, Checkpoint
+from dump1090_postgis.flights import LandingAndTakeoffManager
+
+log = logging.getLogger()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Backfill recorded BaseStation logs into the database.")
+    parser.add_argument('files', nargs='+', help="Log files in chronological order (.gz and .zst are decompressed)")
+    parser.add_argument('--checkpoint', help="JSON file to resume an interrupted backfill from")
+    parser.add_argument('--chunk-size', type=int, default=ArchiveSource.CHUNK_SIZE, help="Bytes to read at once")
+    parser.add_argument('--airports', help="Comma-separated ICAO identifiers of the airports to attribute landings "
+                                           "and takeoffs to (default: LFRS)")
+    parser.add_argument('--runways', default=RUNWAYS_CSV, help="Runways CSV file of the airports")
+    args = parser.parse_args(argv)
+
+    if args.airports:
+        airports = load_airports(args.runways, idents=args.airports.split(','))
+        if airports:
+            LandingAndTakeoffManager.use_airports(airports)
+        else:
+            log.warning("None of the airports {} found in {}, attributing landings and takeoffs to LFRS only".format(
+                args.airports, args.runways))
+
+    log.info(">>> BACKFILLING {} LOG FILES <<<".format(len(args.files)))
+
+    connection = engine.raw_connection()
+    try:
+        Backfill(args.files, BulkFlightWriter(connection), adsb_filter=AdsbMessageFilter(below=10000),
+                 checkpoint=Checkpoint(args.checkpoint) if args.checkpoint else None,
+                 chunk_size=args.chunk_size).run()
+    except KeyboardInterrupt:
+        log.info("Backfill interrupted, resume it with the same checkpoint")
+        connection.rollback()
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
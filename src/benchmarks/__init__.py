@@ -0,0 +1,26 @@
+"""Micro benchmarks of the logger hot path. Run from the src directory, e.g. 'python -m benchmarks.bench_parser'."""
+import os
+import tempfile
+import time
+
+TESTS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'tests')
+MESSAGE_STREAM = os.path.join(TESTS_DIR, 'adsb_message_stream.txt')
+
+
+def replicated_stream(repeat: int) -> str:
+    """Write the recorded message stream 'repeat' times into a temporary file and return its path."""
+    with open(MESSAGE_STREAM, 'r') as f:
+        messages = f.read().rstrip('\n') + '\n'
+
+    fd, path = tempfile.mkstemp(suffix='.txt')
+    with os.fdopen(fd, 'w') as f:
+        for _ in range(repeat):
+            f.write(messages)
+    return path
+
+
+def timed(fnc, *args, **kwargs):
+    """Call fnc and return a tuple of its return value and the elapsed time in seconds."""
+    start = time.perf_counter()
+    result = fnc(*args, **kwargs)
+    return result, time.perf_counter() - start
@@ -0,0 +1,45 @@
+"""Throughput of decoding the Beast binary format, to compare with the BaseStation parsers of bench_parser."""
+import logging
+import os
+import tempfile
+
+from benchmarks import timed
+from dump1090_postgis.adsb_parser import AdsbMessage
+from dump1090_postgis.beast import BeastFileSource
+
+log = logging.getLogger(__name__)
+
+REPEAT = 50000
+
+# Identification, airborne position (even and odd) and velocity messages of https://mode-s.org/decode/
+MESSAGES = ('8D4840D6202CC371C32CE0576098', '8D40621D58C382D690C8AC2863A7', '8D40621D58C386435CC412692AD6',
+            '8D485020994409940838175B284F')
+
+
+def beast_stream(repeat: int) -> str:
+    """Write the messages 'repeat' times as Beast frames into a temporary file and return its path."""
+    frames = b''.join(b'\x1a3' + (12000000).to_bytes(6, 'big') + b'\x80' + bytes.fromhex(message)
+                      for message in MESSAGES)
+
+    fd, path = tempfile.mkstemp(suffix='.bin')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(frames * repeat)
+    return path
+
+
+def count_records(path: str) -> int:
+    return sum(1 for _ in AdsbMessage(BeastFileSource(path)))
+
+
+def main():
+    path = beast_stream(REPEAT)
+    try:
+        n, duration = timed(count_records, path)
+        log.info("beast decoder: {} messages in {:.2f}sec ({:.0f} msg/sec)".format(n, duration, n / duration))
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
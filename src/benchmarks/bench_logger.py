@@ -0,0 +1,51 @@
+"""Compare the throughput of the AdsbLogger thread pair handing over single messages and micro-batches."""
+import logging
+import os
+
+from benchmarks import replicated_stream, timed
+from dump1090_postgis.adsb_logger import AdsbLogger
+from dump1090_postgis.adsb_parser import AdsbMessageFilter, FileSource
+
+log = logging.getLogger(__name__)
+
+REPEAT = 20
+
+
+class CountingPool:
+    """Flights pool stub counting the messages."""
+    rejection_cache = None
+
+    def __init__(self):
+        self.messages = 0
+
+    def update(self, adsb_message):
+        self.messages += 1
+
+    def update_batch(self, batch):
+        self.messages += len(batch)
+
+
+def log_messages(path: str, batch_size: int) -> int:
+    pool = CountingPool()
+    logger_class = type('AdsbLogger{}'.format(batch_size), (AdsbLogger,), {'BATCH_SIZE': batch_size})
+    adsb_logger = logger_class(FileSource(path), pool, message_filter=AdsbMessageFilter(radius=200000,
+                                                                                       center=(-1.61, 47.15),
+                                                                                       strict=False))
+    adsb_logger.log()
+    return pool.messages
+
+
+def main():
+    path = replicated_stream(REPEAT)
+    try:
+        for batch_size in (1, AdsbLogger.BATCH_SIZE):
+            n, duration = timed(log_messages, path, batch_size)
+            log.info("Batch size {:>4}: {} messages in {:.2f}sec ({:.0f} msg/sec)".format(batch_size, n, duration,
+                                                                                        n / duration))
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
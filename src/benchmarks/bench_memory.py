@@ -0,0 +1,79 @@
+"""
+Compare the memory of a flights pool keeping all positions of its flights and releasing them to a writer stage.
+
+The recorded message stream is replayed several times into a CurrentFlights pool with a writer stub, so that the
+flights collect many positions. The memory retained after the replay is measured with tracemalloc.
+"""
+import logging
+import os
+import tracemalloc
+from unittest.mock import patch
+
+import sqlalchemy.orm
+
+from benchmarks import replicated_stream, timed
+from dump1090_postgis.adsb_parser import AdsbMessage, AdsbMessageFilter, FileSource
+from dump1090_postgis.clock import StreamClock
+from dump1090_postgis.flights import CurrentFlights
+from dump1090_postgis.models import Flight
+
+log = logging.getLogger(__name__)
+
+REPEAT = 50
+
+
+class WriterStub:
+    """Writer stage stub discarding the intents."""
+
+    def __init__(self):
+        self._keys = 0
+
+    def new_flight(self, flight):
+        self._keys += 1
+        return self._keys
+
+    def update_flight(self, key, flight):
+        pass
+
+    def new_positions(self, key, positions):
+        pass
+
+    def close_flight(self, key):
+        pass
+
+    def close(self):
+        pass
+
+
+def replay(path: str):
+    """Replay the messages into a pool and return it with the retained memory [bytes]."""
+    messages = list(AdsbMessage(FileSource(path)))
+    tracemalloc.start()
+    pool = CurrentFlights(sqlalchemy.orm.Session(), adsb_filter=AdsbMessageFilter(), clock=StreamClock(),
+                          writer=WriterStub())
+    pool.update_batch(messages)
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return pool, retained
+
+
+def main():
+    logging.getLogger('dump1090_postgis').setLevel(logging.WARNING)
+    path = replicated_stream(REPEAT)
+    try:
+        for release in (False, True):
+            if release:
+                (pool, retained), duration = timed(replay, path)
+            else:
+                with patch.object(Flight, 'release_positions', lambda flight: 0):
+                    (pool, retained), duration = timed(replay, path)
+            held = sum(len(flight.positions) for flight in pool)
+            log.info("{:<8}: {} flights holding {} positions, {:.1f} MiB retained ({:.2f}sec)".format(
+                'released' if release else 'kept', len(pool), held, retained / 2 ** 20, duration))
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,30 @@
+"""Compare the throughput of the fast and the strict (regex) AdsbMessage parser."""
+import logging
+import os
+
+from benchmarks import replicated_stream, timed
+from dump1090_postgis.adsb_parser import AdsbMessage, FileSource
+
+log = logging.getLogger(__name__)
+
+REPEAT = 20
+
+
+def count_messages(path: str, strict: bool) -> int:
+    return sum(1 for _ in AdsbMessage(FileSource(path), strict=strict))
+
+
+def main():
+    path = replicated_stream(REPEAT)
+    try:
+        for strict in (True, False):
+            n, duration = timed(count_messages, path, strict)
+            log.info("{:<6} parser: {} messages in {:.2f}sec ({:.0f} msg/sec)".format('strict' if strict else 'fast',
+                                                                                    n, duration, n / duration))
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,63 @@
+"""
+Compare inserting positions with executemany and with COPY, as done by the writer stage.
+
+Needs the database configured by the environment (see config.py). The positions are written to a temporary copy of the
+positions table, which is dropped with the connection.
+"""
+import datetime
+import logging
+
+from geoalchemy2.shape import from_shape
+from shapely.geometry import Point
+from sqlalchemy import Table, text
+
+from benchmarks import timed
+from dump1090_postgis import bulk, models
+
+log = logging.getLogger(__name__)
+
+ROWS = 50000
+T0 = datetime.datetime(2019, 10, 20, 11, 33, 40, tzinfo=datetime.timezone.utc)
+TABLE = 'bench_positions'
+
+
+def positions(n: int) -> list:
+    """Tuples (time, lon, lat, alt, onground) of a climbing flight."""
+    return [(T0 + datetime.timedelta(seconds=i), -1.6 + i * 1e-5, 47.15 + i * 1e-5, 100.0 + i, False)
+            for i in range(n)]
+
+
+def insert_executemany(connection, rows: list):
+    table = Table(TABLE, models.Position.metadata, *[c.copy() for c in models.Position.__table__.columns
+                                                     if c.name != 'id'], extend_existing=True)
+    with connection.begin():
+        connection.execute(table.insert(), [{'flight_id': 1, 'time': t, 'onground': onground,
+                                             'coordinates': from_shape(Point(lon, lat, alt), srid=models.SRID)}
+                                            for t, lon, lat, alt, onground in rows])
+
+
+def insert_copy(connection, rows: list):
+    with connection.begin():
+        with connection.connection.cursor() as cursor:
+            bulk.copy_rows(cursor, TABLE, ('flight_id', 'time', 'coordinates', 'onground'),
+                           ((1, t, bulk.ewkt_point(lon, lat, alt, srid=models.SRID), onground)
+                            for t, lon, lat, alt, onground in rows))
+
+
+def main():
+    from db import engine
+
+    rows = positions(ROWS)
+    with engine.connect() as connection:
+        connection.execute(text("CREATE TEMPORARY TABLE {} (LIKE {} INCLUDING DEFAULTS)".format(
+            TABLE, models.Position.__tablename__)))
+        for name, insert in (('executemany', insert_executemany), ('COPY', insert_copy)):
+            connection.execute(text("TRUNCATE {}".format(TABLE)))
+            _, duration = timed(insert, connection, rows)
+            log.info("{:>12}: {} positions in {:.2f}sec ({:.0f} rows/sec)".format(name, len(rows), duration,
+                                                                              len(rows) / duration))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,56 @@
+"""
+Compare the point-in-runway test on plain polygons (evaluated twice, as with the former debug log) to the prepared
+polygons (Runway.point_in) and to the local runway frame on raw coordinates (Runway.contains_xy).
+
+The points are the positions of the recorded message stream, and touchdown points scattered about the runways of
+Nantes Atlantique.
+"""
+import logging
+import random
+
+from shapely.geometry import Point
+
+from benchmarks import MESSAGE_STREAM, timed
+from dump1090_postgis.adsb_parser import AdsbMessage, FileSource
+from dump1090_postgis.airports import nte_airport
+
+log = logging.getLogger(__name__)
+
+REPEAT = 50
+TOUCHDOWNS = 2000
+
+
+def touchdown_points() -> list:
+    positions = [Point(msg.longitude, msg.latitude) for msg in AdsbMessage(FileSource(MESSAGE_STREAM))
+                 if msg.longitude is not None and msg.latitude is not None]
+    rng = random.Random(0)
+    min_x, min_y, max_x, max_y = nte_airport.boundingbox.bounds
+    touchdowns = [Point(rng.uniform(min_x, max_x), rng.uniform(min_y, max_y)) for _ in range(TOUCHDOWNS)]
+    return positions + touchdowns
+
+
+def plain_point_in(runway, point):
+    """The former Runway.point_in(): The debug log message is formatted also if not logged."""
+    "Testing point_in for runway {}: {} ".format(runway.name, runway.boundingbox.contains(point))
+    return runway.boundingbox.contains(point)
+
+
+def count_inside(point_in, points: list) -> int:
+    return sum(point_in(runway, point) for _ in range(REPEAT) for point in points for runway in nte_airport.runways)
+
+
+def main():
+    points = touchdown_points()
+    coordinates = [(point.x, point.y) for point in points]
+    tests = REPEAT * len(points) * len(nte_airport.runways)
+    for name, point_in, arguments in (('plain', plain_point_in, points),
+                                      ('prepared', lambda runway, point: runway.point_in(point), points),
+                                      ('frame', lambda runway, xy: runway.contains_xy(*xy), coordinates)):
+        inside, duration = timed(count_inside, point_in, arguments)
+        log.info("{:<8}: {} tests ({} inside) in {:.2f}sec ({:.0f} tests/sec)".format(name, tests, inside, duration,
+                                                                                    tests / duration))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
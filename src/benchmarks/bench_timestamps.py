@@ -0,0 +1,42 @@
+"""Compare decoding the SBS timestamps with dateutil's isoparse() and with the cached SbsTimestampDecoder."""
+import datetime
+import logging
+
+from dateutil.parser.isoparser import isoparser
+
+from benchmarks import MESSAGE_STREAM, timed
+from dump1090_postgis.adsb_parser import SbsTimestampDecoder
+
+log = logging.getLogger(__name__)
+
+REPEAT = 20
+
+_date_time_parser = isoparser(sep=',')
+
+
+def decode_dateutil(timestamps):
+    return [_date_time_parser.isoparse((date + ',' + time).replace('/', '-')).replace(tzinfo=datetime.timezone.utc)
+            for date, time in timestamps]
+
+
+def decode_cached(timestamps):
+    decoder = SbsTimestampDecoder()
+    return [decoder.decode(date, time) for date, time in timestamps]
+
+
+def main():
+    with open(MESSAGE_STREAM, 'r') as f:
+        timestamps = [tuple(line.split(',')[6:8]) for line in f] * REPEAT
+
+    reference, duration = timed(decode_dateutil, timestamps)
+    log.info("dateutil: {} timestamps in {:.3f}sec ({:.0f}/sec)".format(len(timestamps), duration,
+                                                                       len(timestamps) / duration))
+    result, duration = timed(decode_cached, timestamps)
+    log.info("cached:   {} timestamps in {:.3f}sec ({:.0f}/sec)".format(len(timestamps), duration,
+                                                                       len(timestamps) / duration))
+    assert result == reference, "Decoded timestamps differ"
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
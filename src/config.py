@@ -1,16 +1,73 @@
 import os
 
 
-def get_env_variable(name):
+def get_env_variable(name, default=None):
     try:
         return os.environ[name]
     except KeyError:
+        if default is not None:
+            return default
         message = "Expected environment variable '{}' not set.".format(name)
         raise Exception(message)
 
 
 DUMP1090_HOST = get_env_variable("DUMP1090_HOST")
 DUMP1090_PORT = get_env_variable("DUMP1090_PORT")
+
+
+def parse_receiver(receiver: str, default_port) -> tuple:
+    """Return (host, port) of a receiver 'host', 'host:port', '[IPv6 address]' or '[IPv6 address]:port'."""
+    receiver = receiver.strip()
+    if receiver.startswith('['):
+        host, _, port = receiver[1:].partition(']')
+        port = port[1:]
+    elif receiver.count(':') == 1:
+        host, _, port = receiver.partition(':')
+    else:  # Host name, IPv4 or IPv6 address without port
+        host, port = receiver, ''
+    return host, int(port or default_port)
+
+
+# DUMP1090_HOST may be a comma-separated list of receivers 'host[:port]' (IPv6 addresses in brackets: '[::1]:30003'),
+# the port defaults to DUMP1090_PORT
+DUMP1090_RECEIVERS = [parse_receiver(receiver, DUMP1090_PORT) for receiver in DUMP1090_HOST.split(',')]
+# Format of the dump1090 output: 'sbs' (BaseStation text, port 30003) or 'beast' (Beast binary, port 30005)
+DUMP1090_FORMAT = get_env_variable("DUMP1090_FORMAT", "sbs")
+# Optional receiver position 'lon,lat', required to decode surface positions of the Beast format
+RECEIVER_POSITION = tuple(float(deg) for deg in get_env_variable("RECEIVER_POSITION", "").split(',') if deg) or None
+# Messages of several receivers are duplicates if they have the same hexident, transmission type and generation time
+# (compared to DEDUP_TIME_DIGITS decimals of the seconds) and are received within DEDUP_WINDOW seconds. Decoded Beast
+# records are compared by content instead, as each receiver stamps them with its own clock
+DEDUP_WINDOW = float(get_env_variable("DEDUP_WINDOW", "2.0"))
+DEDUP_TIME_DIGITS = int(get_env_variable("DEDUP_TIME_DIGITS", "3"))
+# Ingestion engine: 'thread' (AdsbLogger) or 'asyncio' (AsyncAdsbLogger)
+LOGGER_MODE = get_env_variable("LOGGER_MODE", "thread")
+# Optional region filter: Drop messages with a position farther than FILTER_RADIUS [m] about FILTER_CENTER 'lon,lat'
+FILTER_CENTER = tuple(float(deg) for deg in get_env_variable("FILTER_CENTER", "").split(',') if deg) or None
+FILTER_RADIUS = float(get_env_variable("FILTER_RADIUS", "0")) or None
+# Database writes: 'inline' (the flights pool commits its session) or 'stage' (writer thread with group commits)
+DB_WRITER = get_env_variable("DB_WRITER", "inline")
+# Number of worker processes tracking the flights in 'thread' mode, sharded by hexident (1: single process)
+SHARDS = int(get_env_variable("SHARDS", "1"))
+# Directory for messages spilled to disk while the flights pool falls behind (default: a temporary directory)
+SPILL_DIR = get_env_variable("SPILL_DIR", "") or None
+# Airports to attribute landings and takeoffs to: Comma-separated ICAO identifiers, or empty for all airports within
+# AIRPORTS_RADIUS [m] about RECEIVER_POSITION (or FILTER_CENTER). Runways are read from RUNWAYS_FILE (default: the
+# OurAirports data set database/data/runways.csv)
+AIRPORTS = [ident.strip() for ident in get_env_variable("AIRPORTS", "LFRS").split(',') if ident.strip()]
+AIRPORTS_RADIUS = float(get_env_variable("AIRPORTS_RADIUS", "100000"))
+RUNWAYS_FILE = get_env_variable("RUNWAYS_FILE", "") or None
+# An aircraft reappearing within REATTACH_GAP seconds after it was last seen continues its flight (e.g. 900; 0, the
+# default: new flight)
+REATTACH_GAP = float(get_env_variable("REATTACH_GAP", "0")) or None
+# Optional snapshot file of the flights pool, saved every SNAPSHOT_PERIOD seconds and on shutdown, and restored on
+# startup so that flights continue on their rows across restarts (single flights pool only, i.e. SHARDS = 1)
+SNAPSHOT_FILE = get_env_variable("SNAPSHOT_FILE", "") or None
+SNAPSHOT_PERIOD = float(get_env_variable("SNAPSHOT_PERIOD", "60"))
+# Optional replay of a recorded BaseStation file instead of the receivers, flights are aged in the recorded time.
+# REPLAY_SPEED multiplies the recorded speed (1 = real time), 0 replays as fast as possible
+REPLAY_FILE = get_env_variable("REPLAY_FILE", "") or None
+REPLAY_SPEED = float(get_env_variable("REPLAY_SPEED", "1")) or None
 POSTGRES_HOST = get_env_variable("POSTGRES_HOST")
 POSTGRES_PORT = get_env_variable("POSTGRES_PORT")
 POSTGRES_USER = get_env_variable("POSTGRES_USER")
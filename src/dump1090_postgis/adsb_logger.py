@@ -1,9 +1,12 @@
+import asyncio
 import logging
 import queue
 import threading
+import time
 
-from dump1090_postgis.adsb_parser import AdsbMessage, MessageStream
+from dump1090_postgis.adsb_parser import AdsbMessage, AdsbMessageFilter, AsyncMessageStream, MessageStream
 from dump1090_postgis.flights import CurrentFlights
+from dump1090_postgis.spill_queue import SpillQueue
 
 log = logging.getLogger()
 
@@ -11,82 +14,249 @@ log = logging.getLogger()
 class AdsbLogger:
     """Multi-thread logger which directs ADSB messages from the socket to the flights pool.
 
-    Main thread: Pops ADSB messages from the queue and feeds them to the flights pool.
-    Thread-1: Retrieves ADSB messages from the socket and adds them to the queue.
+    Main thread: Pops batches of ADSB messages from the queue and feeds them to the flights pool.
+    Thread-1: Retrieves ADSB messages from the socket and adds them to the queue in batches.
 
-    Start the main loop by calling log(), stop by calling shutdown(). The worker thread always initiates stopping by
-    putting a special message into the queue. There are two stop messages possible:
-    1. _SENTINEL:  When shutdown() was called from outside.
-    2. queue.Full instance: When the queue overfilled.
+    A batch is handed over when it holds BATCH_SIZE messages, or with the first message arriving more than BATCH_TIME
+    seconds after the first message of the batch. This saves the synchronization of the queue per message. When the
+    queue stayed empty for BATCH_TIME, the main loop takes over the pending messages itself, so that the latency added
+    is at most about BATCH_TIME, also while the source is idle.
 
-    In both cases the threads are joined in a controlled manner.
+    Start the main loop by calling log(), stop by calling shutdown(), e.g. from a signal handler. The worker thread
+    initiates stopping by closing the queue, when shutdown() was called or the message source is exhausted. While the
+    source is idle, the worker thread is blocked reading from it: After shutdown(), the main loop then takes over the
+    pending messages and closes the queue itself. The main loop processes the remaining messages and joins the worker
+    thread, or leaves it behind (a daemon thread) if it's still blocked after JOIN_TIMEOUT seconds.
+
+    The queue (spill_queue.SpillQueue) holds about QSIZE messages in memory and spills further messages to disk (into
+    'spill_dir', or a temporary directory), e.g. while the database stalls. They are processed in order once the main
+    loop catches up, so that an overload costs latency instead of messages.
+
+    An optional message filter (AdsbMessageFilter instance) is applied to each batch by the receiver thread: Messages
+    which do not pass it never reach the queue and the flights pool.
     """
-    _SENTINEL = object()
+    _SENTINEL = SpillQueue.CLOSED
     QSIZE = 100000
+    BATCH_SIZE = 500
+    BATCH_TIME = 0.05
+    FILTER_BATCH_SIZE = 16
+    JOIN_TIMEOUT = 1.0
 
-    def __init__(self, message_source: MessageStream, flights_pool: CurrentFlights):
+    def __init__(self, message_source: MessageStream, flights_pool: CurrentFlights,
+                 message_filter: AdsbMessageFilter = None, spill_dir: str = None):
         """Construct from message source (MessageStream instance) and message target (Flights instance)."""
         self._shutdown = False
         self._qsize_max = 0
         self._message_source = message_source
         self._flights_pool = flights_pool
-        self._message_queue = queue.Queue(maxsize=AdsbLogger.QSIZE)
-        self._receiver_thread = threading.Thread(target=self._message_receiver)
+        self._message_filter = message_filter
+        self._message_queue = SpillQueue(maxsize=max(1, self.QSIZE // self.BATCH_SIZE), spill_dir=spill_dir)
+        self._batch = []  # Pending messages of the receiver thread, guarded by _batch_lock
+        self._batch_start = 0.0
+        self._batch_lock = threading.Lock()
+        self._receiver_thread = threading.Thread(target=self._message_receiver, daemon=True)
 
     @property
     def qsize_max(self):
+        """Maximum number of batches in the queue."""
         return self._qsize_max
 
+    @property
+    def message_queue(self) -> SpillQueue:
+        """The queue, e.g. for its spill metrics."""
+        return self._message_queue
+
     def log(self):
-        """Main loop of the logger, pops messages from the queue."""
+        """Main loop of the logger, pops batches of messages from the queue.
+
+        After shutdown(), the loop keeps running until the queue is closed, so that the batches in memory and on disk
+        are processed.
+        """
         self._receiver_thread.start()
 
-        while True:
-            # Remember maximum queue size (for debugging)
-            qsize = self._message_queue.qsize()
-            if qsize > self._qsize_max:
-                self._qsize_max = qsize
-                log.info("New max Qsize: {}".format(qsize))
-            log.debug("Current queue size: {} (max: {})".format(qsize, self._qsize_max))
-
-            msg = self._message_queue.get()  # Queue.get() is blocking
-
-            if isinstance(msg, AdsbMessage):
-                self._flights_pool.update(msg)
-            elif isinstance(msg, queue.Full):
-                raise msg
-            elif msg is AdsbLogger._SENTINEL:
-                log.info("Termination of main logger loop demanded")
-                # Put sentinel back into queue for other threads to receive
-                self._message_queue.put_nowait(AdsbLogger._SENTINEL)
-                log.info("Joining threads...")
-                self._receiver_thread.join()
-                break
+        try:
+            while self._process_batch():
+                pass
+        finally:
+            # Nothing left after a regular end; If the loop failed (e.g. a dead shard worker), the receiver thread
+            # stops too and the spilled batches are lost
+            self.shutdown()
+            self._message_queue.cleanup()
 
         log.info("Logging loop finished")
 
+    def _process_batch(self) -> bool:
+        """Pop one batch of messages and feed it to the flights pool; Return False when the queue is closed."""
+        # Remember maximum queue size (for debugging), sampled once per batch
+        qsize = self._message_queue.qsize()
+        if qsize > self._qsize_max:
+            self._qsize_max = qsize
+            log.info("New max Qsize: {} batches".format(qsize))
+        log.debug("Current queue size: {} batches (max: {})".format(qsize, self._qsize_max))
+
+        try:
+            batch = self._message_queue.get(timeout=self.BATCH_TIME)
+        except queue.Empty:
+            # Hand over the messages of an idle source, which the receiver thread would keep until the next message
+            with self._batch_lock:
+                self._put_batch()
+                if self._shutdown:
+                    # The receiver thread may be blocked on its source; It puts no further messages after shutdown()
+                    self._message_queue.close()
+            return True
+
+        if batch is AdsbLogger._SENTINEL:
+            log.info("Termination of main logger loop demanded")
+            log.info("Joining threads...")
+            self._receiver_thread.join(timeout=self.JOIN_TIMEOUT)
+            if self._receiver_thread.is_alive():
+                log.warning("Message receiver thread blocked on its idle source, leaving it behind")
+            return False
+
+        self._flights_pool.update_batch(batch)
+        return True
+
     def _message_receiver(self):
         """Thread-1 worker which pushes ADSB messages into the queue."""
 
         log.info("Message receiver thread started")
 
-        for msg in AdsbMessage(self._message_source):
-            try:
-                self._message_queue.put_nowait(msg)
-            except queue.Full as err:
-                log.error("Max Queue size reached ({}). Dropping all ADSB messages!".format(AdsbLogger.QSIZE))
-                with self._message_queue.mutex:
-                    self._message_queue.queue.clear()  # Clear
-                self._message_queue.put_nowait(err)
-                break
+        for msg in AdsbMessage(self._message_source, rejection_cache=self._flights_pool.rejection_cache):
+            with self._batch_lock:
+                if self._shutdown:
+                    break  # The queue may be closed already
+                if not self._batch:
+                    self._batch_start = time.monotonic()
+                self._batch.append(msg)
 
-            if self._shutdown:
-                break
+                if len(self._batch) >= self.BATCH_SIZE or time.monotonic() - self._batch_start >= self.BATCH_TIME:
+                    self._put_batch()
 
+        with self._batch_lock:
+            self._put_batch()
+            self._message_queue.close()
         log.info("Message receiver thread shutting down")
-        self._message_queue.put_nowait(AdsbLogger._SENTINEL)
         # Here the socket should be closed!
 
+    def _put_batch(self):
+        """Filter the pending batch of messages and put the remaining messages into the queue.
+
+        The caller holds _batch_lock, which keeps the batches in order when the main loop hands over a batch.
+        """
+        batch, self._batch = self._batch, []
+        if self._message_filter is not None and batch:
+            # Small batches (low traffic) are cheaper to filter message by message than as arrays
+            if len(batch) < self.FILTER_BATCH_SIZE:
+                batch = [msg for msg in batch if self._message_filter.filter(msg)]
+            else:
+                passed = self._message_filter.filter_batch(AdsbMessageFilter.columns(batch))
+                batch = [msg for msg, ok in zip(batch, passed) if ok]
+
+        if batch:
+            self._message_queue.put(batch)
+
     def shutdown(self):
-        """Trigger graceful shutdown of the logger."""
+        """Trigger graceful shutdown of the logger; Only sets a flag, so that it may be called from a signal handler."""
         self._shutdown = True
+
+
+class AsyncAdsbLogger:
+    """Single-thread logger on an asyncio event loop; Alternative to the AdsbLogger thread pair.
+
+    Receiver tasks: One per message source (AsyncMessageStream instance), parse ADSB messages and put them into the
+    queue. When all sources are exhausted, a _SENTINEL is put into the queue.
+    Consumer: Pops ADSB messages from the queue and feeds them to the flights pool.
+
+    The flights pool must be constructed with autocommit=False: The consumer commits the pool every DB_COMMIT_PERIOD
+    seconds in an executor thread, so that the receivers keep reading from their sources while the database is busy.
+    No messages are processed during a commit, so the session is never used by two threads at the same time.
+
+    Start by awaiting log(), stop by cancelling the task running log() (e.g. on SIGTERM). The pending commit is
+    completed and the pool committed a last time before the cancellation is propagated.
+
+    The optional message filter is applied by the receiver tasks, like in AdsbLogger.
+    """
+    _SENTINEL = object()
+    QSIZE = AdsbLogger.QSIZE
+
+    def __init__(self, message_sources: list, flights_pool: CurrentFlights, message_filter: AdsbMessageFilter = None):
+        """Construct from message sources (list of AsyncMessageStream) and message target (Flights instance)."""
+        assert all(isinstance(source, AsyncMessageStream) for source in message_sources)
+        self._qsize_max = 0
+        self._message_sources = message_sources
+        self._flights_pool = flights_pool
+        self._message_filter = message_filter
+        self._message_queue = None
+        self._pending_commit = None
+
+    @property
+    def qsize_max(self):
+        return self._qsize_max
+
+    async def log(self):
+        """Main coroutine of the logger, runs until all sources are exhausted or the task gets cancelled."""
+        # The queue must be created on the running event loop
+        self._message_queue = asyncio.Queue(maxsize=self.QSIZE)
+        receivers = asyncio.ensure_future(self._message_receivers())
+
+        try:
+            await self._message_consumer()
+        except asyncio.CancelledError:
+            log.info("Termination of asyncio logger loop demanded")
+            raise
+        finally:
+            receivers.cancel()
+            await asyncio.gather(receivers, return_exceptions=True)
+            await self._commit()
+
+        log.info("Logging loop finished")
+
+    async def _message_receivers(self):
+        """Run one receiver per message source and signal the consumer when all are exhausted."""
+        await asyncio.gather(*[self._message_receiver(source) for source in self._message_sources])
+        await self._message_queue.put(self._SENTINEL)
+
+    async def _message_receiver(self, message_source: AsyncMessageStream):
+        """Receiver task which pushes ADSB messages of one source into the queue."""
+        log.info("Message receiver task started")
+
+        async for msg in AdsbMessage(message_source, rejection_cache=self._flights_pool.rejection_cache):
+            if self._message_filter is not None and not self._message_filter.filter(msg):
+                continue
+            await self._message_queue.put(msg)  # Waits if the queue is full, which throttles the source
+
+        log.info("Message receiver task shutting down")
+
+    async def _message_consumer(self):
+        """Pop messages from the queue, feed them to the flights pool and commit periodically."""
+        loop = asyncio.get_running_loop()
+        last_commit = loop.time()
+
+        while True:
+            qsize = self._message_queue.qsize()
+            if qsize > self._qsize_max:
+                self._qsize_max = qsize
+                log.info("New max Qsize: {}".format(qsize))
+
+            msg = await self._message_queue.get()
+
+            if msg is self._SENTINEL:
+                log.info("All message sources exhausted")
+                break
+
+            self._flights_pool.update(msg)
+
+            if loop.time() - last_commit > self._flights_pool.DB_COMMIT_PERIOD:
+                await self._commit()
+                last_commit = loop.time()
+
+    async def _commit(self):
+        """Commit the flights pool in an executor thread without blocking the event loop.
+
+        The commit is shielded from cancellation: A cancelled caller leaves it running and the next call waits for
+        it to finish, instead of starting a second commit in parallel.
+        """
+        if self._pending_commit is not None and not self._pending_commit.done():
+            await asyncio.shield(self._pending_commit)
+        self._pending_commit = asyncio.get_running_loop().run_in_executor(None, self._flights_pool.commit)
+        await asyncio.shield(self._pending_commit)
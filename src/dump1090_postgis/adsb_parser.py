@@ -1,23 +1,30 @@
 """
 Parser for ADSB message streams.
-Creates an instance of AdsbMessage class for each string message coming from a message source.
+Creates an AdsbRecord for each string message coming from a message source, using the AdsbMessage parser.
 A message source must inherit from the template abstract base class MessageStream;
 a concrete stream generator Dump1090Socket is implemented, which connects to the dump1090 port 30003.
+For the asyncio ingestion engine, the counterparts AsyncMessageStream and AsyncDump1090Socket are provided.
 
 Inspired by:
 https://github.com/bzamecnik/dump1090-archive
 https://github.com/slintak/adsb2influx
 """
 import abc
-import copy
+import asyncio
 import logging
+import math
 import re
 import socket
 import string
+from typing import NamedTuple, Optional
+import numpy as np
+import shapely.geometry
+import shapely.prepared
 from dateutil.parser.isoparser import isoparser
 import datetime
 from config import DUMP1090_HOST, DUMP1090_PORT
-from time import sleep
+from dump1090_postgis.clock import ReplayPacer
+from time import monotonic, sleep
 
 dump1090_host = DUMP1090_HOST
 dump1090_port = DUMP1090_PORT
@@ -27,6 +34,64 @@ log = logging.getLogger(__name__)
 _date_time_parser = isoparser(sep=',')
 
 
+class SbsTimestampDecoder:
+    """
+    Decoder of the date and time fields of SBS messages ('2019/10/20' and '11:33:40.311') to UTC-aware datetimes.
+
+    Produces the same datetimes as dateutil's isoparse(), but caches the datetime of the last decoded second:
+    The date is the same for hours and consecutive messages mostly share the same second, so usually only the
+    fraction of the second has to be cast. Fields may be strings or bytes.
+
+    The cache is a single tuple which is replaced at once, so an instance may be shared between threads.
+    """
+
+    # Factor to scale a fraction of a second with n digits to microseconds
+    _FRACTION_SCALE = (None, 100000, 10000, 1000, 100, 10, 1)
+
+    def __init__(self):
+        self._cached = (None, None, None)  # Date field, time field up to the seconds, datetime of that second
+        self._cached_date = (None, None)  # Date field, datetime of midnight of that date
+
+    def __call__(self, value):
+        """Decode a combined 'date,time' field."""
+        date, _, time = value.partition(b',' if isinstance(value, bytes) else ',')
+        return self.decode(date, time)
+
+    def decode(self, date, time) -> datetime.datetime:
+        """
+        Decode the date and time fields of a message.
+
+        :param date: Date 'YYYY/MM/DD' (or 'YYYY-MM-DD')
+        :param time: Time 'HH:MM:SS' with optional fraction of a second '.ffffff' (truncated to microseconds)
+        :raises ValueError: If the fields cannot be decoded
+        """
+        cached_date, cached_second, second = self._cached
+        if date != cached_date or not time.startswith(cached_second):
+            second = self._decode_second(date, time[:8])
+            self._cached = (date, time[:8], second)
+
+        if len(time) == 8:
+            return second
+        fraction = time[9:15]
+        return second.replace(microsecond=int(fraction) * self._FRACTION_SCALE[len(fraction)])
+
+    def _decode_second(self, date, time) -> datetime.datetime:
+        """Decode date and time (without fraction), using the cached date if possible."""
+        cached_date, midnight = self._cached_date
+        if date != cached_date:
+            midnight = datetime.datetime.strptime(
+                (date.decode('ascii') if isinstance(date, bytes) else date).replace('-', '/'), '%Y/%m/%d').replace(
+                tzinfo=datetime.timezone.utc)
+            self._cached_date = (date, midnight)
+
+        if isinstance(time, bytes):
+            time = time.decode('ascii')
+        if len(time) != 8 or time[2] != ':' or time[5] != ':':
+            raise ValueError("Invalid time: {}".format(time))
+
+        return midnight.replace(hour=int(time[0:2]), minute=int(time[3:5]), second=int(time[6:8]))
+
+
 class MessageStream(abc.ABC):
     """
     Abstract Base Class to be used as template for ADSB message stream generators.
@@ -34,6 +99,10 @@ class MessageStream(abc.ABC):
 
     # Number of attempts to reconnect to the ADSb message source (e.g. socket).
     RECONNECTIONS = 5
+    # If False, the iterator stops when the message source is exhausted instead of reconnecting (e.g. for files)
+    RECONNECT_ON_EOF = True
+    # If True, the stream yields decoded AdsbRecords instead of message strings (e.g. beast.BeastSocket)
+    YIELDS_RECORDS = False
 
     def __init__(self):
         pass
@@ -57,19 +126,33 @@ class MessageStream(abc.ABC):
             try:
                 with self._initiate_stream() as _message_iterator:
                     for msg in _message_iterator:
-                        if AdsbMessage.length_ok(msg):
-                            yield msg.strip()
-                        else:
-                            # If a wrong message length is received, most likely the socket is dead already.
-                            # Best bet is to close it and to try to reconnect
-                            log.error("Received wrong message length. Reconnecting to message source!")
-                            continue
+                        msg = self._accept(msg)
+                        if msg is not None:
+                            yield msg
+                if not self.RECONNECT_ON_EOF:
+                    log.info("Message source exhausted")
+                    break
             except self.exception as err:
                 log.error("Connection to socket failed: {}".format(str(err)))
             except ConnectionError as err:
                 log.critical("Connection to socket lost permanently:{}".format(str(err)))
                 break
 
+    def _accept(self, msg):
+        """
+        Checks each item of the message iterator before it is yielded.
+
+        Returns the message string stripped, or None to skip it if it does not consist of 22 comma-separated elements.
+        Streams yielding other items than message strings override this method.
+        """
+        if AdsbMessage.length_ok(msg):
+            return msg.strip()
+
+        # If a wrong message length is received, most likely the socket is dead already.
+        # Best bet is to close it and to try to reconnect
+        log.error("Received wrong message length. Reconnecting to message source!")
+        return None
+
     @property
     @abc.abstractmethod
     def exception(self):
@@ -79,7 +162,7 @@ class MessageStream(abc.ABC):
     def _initiate_stream(self) -> iter:
         """
         Generator for ADSB messages.
-        Must return an iterator of ADSB messages. Each message is a string of 22 comma-separated elements,
+        Must return an iterator of ADSB messages. Each message is a string (or bytes) of 22 comma-separated elements,
         according to format on http://woodair.net/sbs/article/barebones42_socket_data.htm
 
         Example string:
@@ -87,7 +170,7 @@ class MessageStream(abc.ABC):
 
         Must raise ConnectionError if RECONNECTIONS attempts to connect to message source fail.
 
-        :return: Iterator of ADSB message strings (file object like)
+        :return: Iterator of ADSB message strings or bytes (file object like, or SocketLineReader)
         """
 
 
@@ -107,6 +190,9 @@ class Dump1090Socket(MessageStream):
         self.hostname = hostname
         super(Dump1090Socket, self).__init__()
 
+    def __str__(self):
+        return "{}:{}".format(self.hostname, self.port)
+
     def _initiate_stream(self):
         """
         Returns generator for ADSB message strings received from port on hostname.
@@ -124,7 +210,7 @@ class Dump1090Socket(MessageStream):
             try:
                 sock.connect((self.hostname, int(self.port)))
                 log.info("Connection successful")
-                return sock.makefile()
+                return self._reader(sock)
             except (socket.error, socket.timeout) as err:
                 log.error("Attempt {i}/{i_max} failed connecting to {host}:{port}: {error}.".format(i=attempt + 1,
                                                                                             i_max=self.RECONNECTIONS,
@@ -140,20 +226,111 @@ class Dump1090Socket(MessageStream):
         log.critical("Port {}:{} unreachable".format(self.hostname, int(self.port)))
         raise ConnectionError("Port {}:{} unreachable".format(self.hostname, int(self.port)))
 
+    def _reader(self, sock: socket.socket):
+        """Return the iterator over the messages received on the connected socket."""
+        return SocketLineReader(sock)
+
     @property
     def exception(self):
         return socket.error
 
 
+class SocketLineReader:
+    """
+    Iterator over the lines received on a socket, yielding each line as bytes without line terminator.
+
+    Lines are framed directly in a reusable receive buffer which is filled by socket.recv_into(), instead of
+    decoding and buffering the stream in a text-mode file object. A line split across two reads is completed
+    by the following read. The buffer grows if a single line exceeds its size.
+
+    The socket is closed when leaving the context manager.
+    """
+
+    BUFFER_SIZE = 65536
+
+    def __init__(self, sock: socket.socket, buffer_size: int = BUFFER_SIZE):
+        self._sock = sock
+        self._buffer = bytearray(buffer_size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._sock.close()
+
+    def __iter__(self) -> bytes:
+        """Yields the received lines; Stops when the peer closes the connection."""
+        buffer = self._buffer
+        view = memoryview(buffer)
+        start = 0  # Start of the first incomplete line in the buffer
+        end = 0  # End of the received data in the buffer
+
+        try:
+            while True:
+                if end == len(buffer):
+                    if start == 0:
+                        # A single line fills the whole buffer: Grow the buffer
+                        view.release()
+                        buffer.extend(bytes(len(buffer)))
+                        view = memoryview(buffer)
+                    else:
+                        # Move the incomplete line to the front of the buffer
+                        buffer[:end - start] = view[start:end]
+                        end -= start
+                        start = 0
+
+                n = self._sock.recv_into(view[end:])
+                if n == 0:
+                    return
+                end += n
+
+                newline = buffer.find(b'\n', start, end)
+                while newline >= 0:
+                    stop = newline - 1 if newline > start and buffer[newline - 1] == 13 else newline  # Strip \r
+                    yield bytes(view[start:stop])
+                    start = newline + 1
+                    newline = buffer.find(b'\n', start, end)
+
+                if start == end:
+                    start = end = 0
+        finally:
+            view.release()
+
+
 class FileSource(MessageStream):
+    """
+    Generator for ADSB messages read from a recorded text file, one message per line.
+
+    :param file_path: Path of the recorded file
+    :param speed: Replay speed multiplier relative to the recorded generation times (e.g. 1.0 real time, 10.0 ten
+        times faster); None (default) reads the file as fast as possible
+    """
+
+    RECONNECT_ON_EOF = False
 
-    def __init__(self, file_path: string):
+    def __init__(self, file_path: string, speed: float = None):
         self._file_path = file_path
+        self._pacer = ReplayPacer(speed) if speed is not None else None
+        self._timestamp_decoder = SbsTimestampDecoder()
         super(FileSource, self).__init__()
 
+    def __str__(self):
+        return self._file_path
+
+    def _accept(self, msg):
+        """Checks the message and delays it until it is due, if a replay speed was given."""
+        msg = super(FileSource, self)._accept(msg)
+        if msg is not None and self._pacer is not None:
+            fields = msg.split(b',' if isinstance(msg, bytes) else ',', 8)
+            try:
+                self._pacer.wait(self._timestamp_decoder.decode(fields[6], fields[7]))
+            except ValueError:
+                pass  # Rejected later by the parser
+        return msg
+
     def _initiate_stream(self) -> iter:
         try:
-            return open(self._file_path, 'r')
+            return open(self._file_path, 'rb')
         except FileNotFoundError as err:
             raise ConnectionError("File {} was not found: {}".format(self._file_path, str(err)))
 
@@ -162,11 +339,195 @@ class FileSource(MessageStream):
         return IOError
 
 
-class AdsbMessage:
+class AsyncMessageStream(abc.ABC):
     """
-    ADSb message instance created from a string in Base Station format.
+    Abstract Base Class for ADSB message stream generators running on an asyncio event loop.
 
-    @Note: Instance attributes will be created dynamically in _update_attributes() from keys of NORMALIZE_MSG dict.
+    Counterpart of MessageStream with the same reconnect semantics, to be iterated with 'async for'.
+    """
+
+    # Number of attempts to reconnect to the ADSb message source (e.g. socket).
+    RECONNECTIONS = 5
+    # If False, the iterator stops when the message source is exhausted instead of reconnecting
+    RECONNECT_ON_EOF = True
+    # If True, the stream yields decoded AdsbRecords instead of message strings
+    YIELDS_RECORDS = False
+
+    async def __aiter__(self):
+        """
+        Connects to message source and yields new ADSB message strings (bytes).
+
+        See MessageStream.__iter__(), which this method mirrors.
+        :return: ADSB message bytes
+        """
+
+        # Loop to try socket reconnections
+        while True:
+            try:
+                async with await self._initiate_stream() as _message_iterator:
+                    async for msg in _message_iterator:
+                        msg = self._accept(msg)
+                        if msg is not None:
+                            yield msg
+                if not self.RECONNECT_ON_EOF:
+                    log.info("Message source exhausted")
+                    break
+            except self.exception as err:
+                log.error("Connection to socket failed: {}".format(str(err)))
+            except ConnectionError as err:
+                log.critical("Connection to socket lost permanently:{}".format(str(err)))
+                break
+
+    _accept = MessageStream._accept
+
+    @property
+    @abc.abstractmethod
+    def exception(self):
+        """Defines the exception raised if socket connection is lost. """
+
+    @abc.abstractmethod
+    async def _initiate_stream(self):
+        """
+        Coroutine connecting to the message source.
+
+        Must return an async context manager which is an async iterator of ADSB message strings or bytes
+        (see MessageStream._initiate_stream()), e.g. an AsyncLineReader.
+
+        Must raise ConnectionError if RECONNECTIONS attempts to connect to message source fail.
+        """
+
+
+class AsyncLineReader:
+    """
+    Async iterator over the lines received on an asyncio stream, yielding each line as bytes without terminator.
+
+    Reads the stream in chunks and frames the lines itself, which is cheaper than awaiting readline() with a timeout
+    for every single line. Raises socket.timeout if no data is received for 'timeout' seconds.
+
+    The stream is closed when leaving the async context manager.
+    """
+
+    BUFFER_SIZE = 65536
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, timeout: float = None):
+        self._reader = reader
+        self._writer = writer
+        self._timeout = timeout
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self._writer.close()
+        try:
+            await self._writer.wait_closed()
+        except OSError:
+            pass  # Connection reset by the peer, the stream is closed nevertheless
+
+    async def __aiter__(self):
+        """Yields the received lines; Stops when the peer closes the connection."""
+        pending = b''
+
+        while True:
+            try:
+                data = await asyncio.wait_for(self._reader.read(self.BUFFER_SIZE), self._timeout)
+            except asyncio.TimeoutError:
+                raise socket.timeout("No data received within {}sec".format(self._timeout))
+            if not data:
+                return
+
+            lines = (pending + data).split(b'\n')
+            pending = lines.pop()
+            for line in lines:
+                yield line[:-1] if line.endswith(b'\r') else line
+
+
+class AsyncDump1090Socket(AsyncMessageStream):
+    """
+    Async generator for ADSB messages received from port on hostname; Counterpart of Dump1090Socket.
+
+    :param hostname: Ip address of host
+    :param port: Port to listen to messages on
+    """
+
+    SOCKET_TIMEOUT = Dump1090Socket.SOCKET_TIMEOUT
+
+    def __init__(self, hostname: string = dump1090_host, port: int = dump1090_port):
+        self.port = port
+        self.hostname = hostname
+
+    def __str__(self):
+        return "{}:{}".format(self.hostname, self.port)
+
+    async def _initiate_stream(self):
+        """
+        Returns AsyncLineReader for ADSB messages received from port on hostname.
+
+        Tries to connect RECONNECTIONS times, raises ConnectionError if all attempts fail.
+        :return: AsyncLineReader instance
+        """
+
+        log.info("Connecting to Dump1090 source on {}:{}".format(self.hostname, self.port))
+
+        for attempt in range(self.RECONNECTIONS):
+            try:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection(self.hostname, int(self.port)),
+                                                        self.SOCKET_TIMEOUT)
+                log.info("Connection successful")
+                return self._reader(reader, writer)
+            except (socket.error, asyncio.TimeoutError) as err:
+                log.error("Attempt {i}/{i_max} failed connecting to {host}:{port}: {error}.".format(i=attempt + 1,
+                                                                                            i_max=self.RECONNECTIONS,
+                                                                                            host=self.hostname,
+                                                                                            port=int(self.port),
+                                                                                            error=str(err)
+                                                                                                    )
+                          )
+                await asyncio.sleep(1)  # Give the system time to close the socket
+                continue
+
+        log.critical("Port {}:{} unreachable".format(self.hostname, int(self.port)))
+        raise ConnectionError("Port {}:{} unreachable".format(self.hostname, int(self.port)))
+
+    def _reader(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Return the async iterator over the messages received on the connected stream."""
+        return AsyncLineReader(reader, writer, timeout=self.SOCKET_TIMEOUT)
+
+    @property
+    def exception(self):
+        return socket.error
+
+
+class AdsbRecord(NamedTuple):
+    """
+    Immutable record of the values of one ADSb message, as yielded by AdsbMessage.
+
+    Fields which are not transmitted by the message are None (the flags alert, emergency, spi and onground are False).
+    """
+    transmission_type: int
+    session: int
+    aircraft: int
+    hexident: str
+    flight: int
+    gen_date_time: datetime.datetime
+    log_date_time: datetime.datetime
+    callsign: Optional[str]
+    altitude: Optional[int]
+    speed: Optional[int]
+    track: Optional[int]
+    latitude: Optional[float]
+    longitude: Optional[float]
+    verticalrate: Optional[int]
+    squawk: Optional[int]
+    alert: bool
+    emergency: bool
+    spi: bool
+    onground: bool
+
+
+class AdsbMessage:
+    """
+    Parser which yields an AdsbRecord for each message string in Base Station format of a message stream.
 
     Message parsing inspired from:
     https://github.com/slintak/adsb2influx
@@ -218,17 +579,74 @@ class AdsbMessage:
         'onground': (lambda v: True if v == '-1' else False),
         }
 
-    def __init__(self, message_stream: MessageStream):
+    # Cast functions for messages received as bytes: Numbers are cast directly, only text fields are decoded
+    NORMALIZE_BYTES = dict(NORMALIZE_MSG,
+                           gen_date_time=SbsTimestampDecoder(),
+                           log_date_time=SbsTimestampDecoder(),
+                           callsign=(lambda v: v.decode('ascii', 'replace').strip()),
+                           alert=(lambda v: True if v == b'-1' else False),
+                           emergency=(lambda v: True if v == b'-1' else False),
+                           spi=(lambda v: True if v == b'-1' else False),
+                           onground=(lambda v: True if v == b'-1' else False),
+                           )
+
+    # Index of each field in the list of comma-separated elements of a message string
+    FIELD_INDEX = {'transmission_type': 1, 'session': 2, 'aircraft': 3, 'hexident': 4, 'flight': 5,
+                   'gen_date_time': 6, 'log_date_time': 8, 'callsign': 10, 'altitude': 11, 'speed': 12,
+                   'track': 13, 'latitude': 14, 'longitude': 15, 'verticalrate': 16, 'squawk': 17, 'alert': 18,
+                   'emergency': 19, 'spi': 20, 'onground': 21}
+
+    # Fields which are carried by each transmission type (BaseStation spec plus what dump1090 actually fills in).
+    # The fast parser casts only these fields; all others are set to None, or False for the flag fields.
+    TRANSMISSION_FIELDS = {
+        1: ('callsign', 'alert', 'emergency', 'spi', 'onground'),
+        2: ('altitude', 'speed', 'track', 'latitude', 'longitude', 'alert', 'emergency', 'spi', 'onground'),
+        3: ('altitude', 'latitude', 'longitude', 'alert', 'emergency', 'spi', 'onground'),
+        4: ('speed', 'track', 'verticalrate', 'alert', 'emergency', 'spi', 'onground'),
+        5: ('callsign', 'altitude', 'speed', 'track', 'verticalrate', 'alert', 'emergency', 'spi', 'onground'),
+        6: ('callsign', 'altitude', 'speed', 'track', 'verticalrate', 'squawk', 'alert', 'emergency', 'spi',
+            'onground'),
+        7: ('altitude', 'alert', 'emergency', 'spi', 'onground'),
+        8: ('alert', 'emergency', 'spi', 'onground'),
+        }
+
+    _FLAG_FIELDS = ('alert', 'emergency', 'spi', 'onground')
+
+    def __init__(self, message_stream: MessageStream, strict: bool = False, rejection_cache: 'RejectionCache' = None):
         """
+        Construct the parser from a message stream.
+
+        By default messages are decoded by the fast parser, which splits the message string once and casts only
+        the fields carried by its transmission type. In strict mode every message is validated against REGEXP_MSG
+        first and all fields are cast, which is considerably slower.
 
-        :param message_stream:
+        If a rejection cache is given, messages of aircraft declined by the flights pool are dropped right after
+        reading their transmission type and hexident, unless the transmission type may admit them to the pool.
+
+        Records of streams which decode the messages themselves (YIELDS_RECORDS) are passed through.
+
+        :param message_stream: Source of ADSB message strings; An AsyncMessageStream must be iterated with 'async for'
+        :param strict: Validate each message against the regular expression REGEXP_MSG
+        :param rejection_cache: Hexidents declined by the flights pool
         """
-        assert isinstance(message_stream, MessageStream)
+        assert isinstance(message_stream, (MessageStream, AsyncMessageStream))
         self.__message_stream = message_stream
         self.__re_msg = re.compile(self.REGEXP_MSG)
-
-    def __str__(self):
-        return str({k: self.__dict__[k] for k in self.NORMALIZE_MSG.keys()})
+        self.__strict = strict
+        self.__rejection_cache = rejection_cache
+
+        # Per transmission type: Tuple of (record position, field index, cast function) of all carried fields
+        self.__casts = self.__carried_field_casts(self.NORMALIZE_MSG)
+        self.__bytes_casts = self.__carried_field_casts(self.NORMALIZE_BYTES)
+        self.__empty_record = [False if field in self._FLAG_FIELDS else None for field in AdsbRecord._fields]
+        self.__gen_date_time = SbsTimestampDecoder()
+        self.__log_date_time = SbsTimestampDecoder()
+
+    def __carried_field_casts(self, normalize: dict) -> dict:
+        """Return the cast functions of the fields carried per transmission type, as used by __split_msg()."""
+        return {msg_type: tuple((AdsbRecord._fields.index(field), self.FIELD_INDEX[field], normalize[field])
+                                for field in fields)
+                for msg_type, fields in self.TRANSMISSION_FIELDS.items()}
 
     def __normalize_msg(self, msg: string):
         """
@@ -264,61 +682,338 @@ class AdsbMessage:
 
         return msg_dict
 
-    def __update_attributes(self, attributes: dict):
+    def __split_msg(self, msg: string):
         """
-        Creates or updates the attributes of this instance.
-        :param attributes: Dictionary of attribute names and values
+        Fast alternative to __normalize_msg(): Casts the fields of a message string in a single pass.
+
+        The message string is split once into its comma-separated elements. The mandatory header fields are always
+        cast, of the remaining fields only those carried by the transmission type (see TRANSMISSION_FIELDS) are cast.
+        Empty or malformed fields are set to None (flags to False). If the header can not be cast None is returned.
+
+        Messages may be given as bytes (as received from a socket), in which case only the text fields are decoded.
+
+        :param msg: ADSB message string or bytes
+        :return: AdsbRecord of the message fields cast to Python data types; Or None if casting failed
         """
-        for attr, value in attributes.items():
-            setattr(self, attr, value)
+        if isinstance(msg, bytes):
+            fields = msg.split(b',')
+            header, casts_by_type = b'MSG', self.__bytes_casts
+        else:
+            fields = msg.split(',')
+            header, casts_by_type = 'MSG', self.__casts
+
+        if len(fields) != 22 or fields[0] != header:
+            log.error("Could not identify all fields in '{}'. Skipping message.".format(msg))
+            return None
+
+        try:
+            transmission_type = int(fields[1])
+            hexident = fields[4] if header == 'MSG' else fields[4].decode('ascii')
+            if self.__rejection_cache is not None and self.__rejection_cache.drops(transmission_type, hexident):
+                return None
+
+            casts = casts_by_type[transmission_type]
+            values = self.__empty_record.copy()
+            values[0] = transmission_type
+            values[1] = int(fields[2])
+            values[2] = int(fields[3])
+            values[3] = hexident
+            values[4] = int(fields[5])
+            values[5] = self.__gen_date_time.decode(fields[6], fields[7])
+            values[6] = self.__log_date_time.decode(fields[8], fields[9])
+        except (ValueError, KeyError):
+            log.error("Could not cast message header of '{}'. Skipping message.".format(msg))
+            return None
+
+        for position, index, fnc in casts:
+            value = fields[index]
+            if value:
+                try:
+                    values[position] = fnc(value)
+                except ValueError:
+                    pass
+
+        return AdsbRecord._make(values)
+
+    def __pass_record(self, record: AdsbRecord):
+        """Alternative to __split_msg() for streams yielding AdsbRecords: Applies the rejection cache only."""
+        if self.__rejection_cache is not None and self.__rejection_cache.drops(record.transmission_type,
+                                                                               record.hexident):
+            return None
+        return record
+
+    def __parser(self):
+        """Return the parse method for the items of the message stream."""
+        if self.__message_stream.YIELDS_RECORDS:
+            return self.__pass_record
+        return self.__match_msg if self.__strict else self.__split_msg
+
+    def __match_msg(self, msg: string):
+        """Strict alternative to __split_msg(): Returns AdsbRecord from __normalize_msg(), or None if matching
+        failed."""
+        if isinstance(msg, bytes):
+            msg = msg.decode('ascii', 'replace')
+        msg_dict = self.__normalize_msg(msg)
+        if not msg_dict:
+            return None
+        if self.__rejection_cache is not None and self.__rejection_cache.drops(msg_dict['transmission_type'],
+                                                                               msg_dict['hexident']):
+            return None
+        return AdsbRecord(**msg_dict)
 
     def __iter__(self):
         """
-        Yields a copy of itself with dynamically created or updated instance attributes.
+        Yields an AdsbRecord for each message string of the message stream.
 
-        A copy of self is yielded to be threadsafe for use in a queue!
+        Message strings which cannot be parsed are skipped.
 
-        :param msg: ADSb message string
-        :return: Instance of itself updated with ADSb message values
+        :return: AdsbRecord instance holding the ADSb message values
         """
+        parse = self.__parser()
+
         for msg in self.__message_stream:
-            self.__update_attributes(self.__normalize_msg(msg))
-            yield copy.copy(self)
+            record = parse(msg)
+            if record is not None:
+                yield record
+
+    async def __aiter__(self):
+        """Yields an AdsbRecord for each message string of an AsyncMessageStream; See __iter__()."""
+        parse = self.__parser()
+
+        async for msg in self.__message_stream:
+            record = parse(msg)
+            if record is not None:
+                yield record
 
     @staticmethod
     def length_ok(message):
-        """Return True if message consists of 22 comma-separated elements."""
-        return len(message.split(",")) == 22
+        """Return True if message (string or bytes) consists of 22 comma-separated elements."""
+        return message.count(b',' if isinstance(message, bytes) else ',') == 21
+
+
+class RejectionCache:
+    """
+    TTL-bounded set of hexidents of aircraft which the flights pool declined to track.
+
+    The flights pool adds a hexident with reject() whenever it declines a message of an untracked aircraft, and removes
+    it with admit() when it starts tracking the aircraft. The parser drops all messages of cached hexidents except
+    those of the ADMITTING_TYPES, so that the pool can still admit e.g. a descending aircraft on a qualifying MSG 3.
+    A message arriving while the pool has not yet processed the admitting message of its aircraft may be dropped.
+
+    A hexident expires TTL seconds after the last decline, e.g. when the aircraft left the receiver range.
+    Apart from counting dropped messages, the parser only reads the cache and all modifications are done by the
+    flights pool, so an instance can be shared between the receiver thread and the main thread of the logger.
+    """
+
+    # Transmission types which may admit an aircraft to the flights pool (see flights.CurrentFlights.update())
+    ADMITTING_TYPES = (2, 3)
+    TTL = 300
+    MAX_SIZE = 10000
+
+    def __init__(self, ttl: float = TTL, max_size: int = MAX_SIZE):
+        self._ttl = ttl
+        self._max_size = max_size
+        self._expiry = {}  # Hexident -> expiry time (monotonic clock), in order of last decline
+        self.dropped = 0  # Number of messages dropped by the parser
+
+    def __len__(self):
+        return len(self._expiry)
+
+    def __contains__(self, hexident: str) -> bool:
+        expiry = self._expiry.get(hexident)
+        return expiry is not None and expiry > monotonic()
+
+    def drops(self, transmission_type: int, hexident: str) -> bool:
+        """Return True if the message shall be dropped: Non-admitting transmission type of a declined aircraft."""
+        if transmission_type not in self.ADMITTING_TYPES and hexident in self:
+            self.dropped += 1
+            return True
+        return False
+
+    def reject(self, hexident: str):
+        """Add or refresh the hexident of a declined aircraft."""
+        self._expiry.pop(hexident, None)  # Move to the end, to keep the dict ordered by expiry
+        self._expiry[hexident] = monotonic() + self._ttl
+
+        if len(self._expiry) > self._max_size:
+            self._prune()
+
+    def admit(self, hexident: str):
+        """Remove the hexident of an aircraft admitted to the flights pool."""
+        self._expiry.pop(hexident, None)
+
+    def _prune(self):
+        """Remove expired hexidents, and the oldest ones if still more than MAX_SIZE."""
+        now = monotonic()
+        for hexident in list(self._expiry):
+            if self._expiry[hexident] > now and len(self._expiry) <= self._max_size:
+                break
+            del self._expiry[hexident]
+
+
+class Geofence:
+    """
+    Polygon geofence with a grid prefilter.
+
+    The bounding box of the polygon is divided into GRID_SIZE x GRID_SIZE cells, each of which is classified once as
+    lying inside, outside or on the boundary of the polygon. Points outside the bounding box or in an inside/outside
+    cell are decided by a lookup; only points in boundary cells are tested against the exact geometry.
+
+    :param polygon: shapely Polygon or sequence of (lon, lat) vertices
+    :param grid_size: Number of cells per axis of the grid
+    """
+
+    GRID_SIZE = 32
+
+    _OUTSIDE, _INSIDE, _BOUNDARY = 0, 1, 2
+
+    def __init__(self, polygon, grid_size: int = GRID_SIZE):
+        if not isinstance(polygon, shapely.geometry.Polygon):
+            polygon = shapely.geometry.Polygon(polygon)
+        self.polygon = polygon
+        self._prepared = shapely.prepared.prep(polygon)
+        self._min_x, self._min_y, self._max_x, self._max_y = polygon.bounds
+        self._grid_size = grid_size
+        self._cell_x = (self._max_x - self._min_x) / grid_size
+        self._cell_y = (self._max_y - self._min_y) / grid_size
+
+        self._cells = np.empty((grid_size, grid_size), dtype=np.int8)
+        for i in range(grid_size):
+            for j in range(grid_size):
+                x, y = self._min_x + i * self._cell_x, self._min_y + j * self._cell_y
+                cell = shapely.geometry.box(x, y, x + self._cell_x, y + self._cell_y)
+                if self._prepared.contains(cell):
+                    self._cells[i, j] = self._INSIDE
+                elif self._prepared.intersects(cell):
+                    self._cells[i, j] = self._BOUNDARY
+                else:
+                    self._cells[i, j] = self._OUTSIDE
+
+        # Vertices of all rings (exterior and holes) for the vectorized point-in-polygon test
+        self._rings = [np.asarray(ring.coords) for ring in (polygon.exterior, *polygon.interiors)]
+
+    def contains(self, lon: float, lat: float) -> bool:
+        """Return True if the position is inside the polygon."""
+        if not (self._min_x <= lon <= self._max_x and self._min_y <= lat <= self._max_y):
+            return False
+
+        i = min(int((lon - self._min_x) / self._cell_x), self._grid_size - 1)
+        j = min(int((lat - self._min_y) / self._cell_y), self._grid_size - 1)
+        cell = self._cells[i, j]
+        if cell == self._BOUNDARY:
+            return self._prepared.contains(shapely.geometry.Point(lon, lat))
+        return cell == self._INSIDE
+
+    def contains_batch(self, lon: np.ndarray, lat: np.ndarray) -> np.ndarray:
+        """Return a boolean array, True for the positions inside the polygon; NaN positions are outside."""
+        inside = np.zeros(len(lon), dtype=bool)
+        candidates = np.flatnonzero((lon >= self._min_x) & (lon <= self._max_x) &
+                                    (lat >= self._min_y) & (lat <= self._max_y))
+
+        i = np.minimum(((lon[candidates] - self._min_x) / self._cell_x).astype(int), self._grid_size - 1)
+        j = np.minimum(((lat[candidates] - self._min_y) / self._cell_y).astype(int), self._grid_size - 1)
+        cells = self._cells[i, j]
+
+        inside[candidates] = cells == self._INSIDE
+        boundary = candidates[cells == self._BOUNDARY]
+        inside[boundary] = self._points_in_rings(lon[boundary], lat[boundary])
+        return inside
+
+    def _points_in_rings(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        """Even-odd ray casting test of the points against all rings, vectorized over the points."""
+        inside = np.zeros(len(x), dtype=bool)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for ring in self._rings:
+                for (x1, y1), (x2, y2) in zip(ring[:-1], ring[1:]):
+                    # Horizontal edges never straddle the ray, the NaN of their division is masked by the first term
+                    inside ^= ((y1 > y) != (y2 > y)) & (x < (x2 - x1) * (y - y1) / (y2 - y1) + x1)
+        return inside
 
 
 class AdsbMessageFilter:
+    """
+    Filter which returns True if all conditions are fulfilled, else False.
+
+    Every test works on single messages (AdsbRecord) and on batches of messages in columnar form (see columns()),
+    the batch counterpart of a test returns a boolean NumPy array.
+    """
 
-    def __init__(self, below: int = 100000, above=-1000, radius: int = 500000, faster: int = 0, slower: int = 30000,
-                 rising: bool = None, descending: bool = None, onground: bool = None):
+    EARTH_RADIUS = 6371000.0  # [m]
+
+    def __init__(self, below: int = 100000, above=-1000, radius: int = None, faster: int = None, slower: int = None,
+                 rising: bool = None, descending: bool = None, onground: bool = None, center: tuple = None,
+                 geofences: list = None, strict: bool = True):
         """
         Filter which returns True if all conditions are fulfilled, else False.
 
-        Defaults are chosen such that filter returns True by default. Currently, only altitude test is implemented.
-        todo Implement all filter tests.
+        Defaults are chosen such that filter returns True by default. Apart from the altitude test, a test is only
+        applied if its parameters are set.
 
         :param below: Altitude threshold in feet AGL [ft]
         :param above: Altitude threshold in feet AGL [ft]
-        :param radius: Radius about a reference point [m]
+        :param radius: Radius about the reference point 'center' [m]
         :param faster:  Speed threshold [knots]
         :param slower: Speed threshold [knots]
         :param rising:  True / False flag
         :param descending:  True / False flag
         :param onground: True / False flag
+        :param center: Reference point (lon, lat) of the radius test [deg]
+        :param geofences: List of polygons (Geofence, shapely Polygon or sequence of (lon, lat) vertices); The position
+            must be inside at least one of them
+        :param strict: If True, messages lacking a parameter to be tested are rejected
         :return:
         """
+        if radius is not None and center is None:
+            raise ValueError("'radius' condition requires a 'center' reference point")
 
         self.below = below
         self.above = above
+        self.radius = radius
+        self.center = center
+        self.faster = faster
+        self.slower = slower
+        self.rising = rising
+        self.descending = descending
+        self.onground = onground
+        self.geofences = [fence if isinstance(fence, Geofence) else Geofence(fence) for fence in geofences or ()]
 
         # If set to True, the message will be rejected, if parameter value to be tested is missing.
-        self.strict = True
+        self.strict = strict
+
+        # Tests applied by filter(), cheapest first, as pairs of single message and batch test
+        self._tests = [(self.altitude, self.altitude_batch)]
+        if faster is not None or slower is not None:
+            self._tests.append((self.speed, self.speed_batch))
+        if rising is not None or descending is not None:
+            self._tests.append((self.vertical, self.vertical_batch))
+        if onground is not None:
+            self._tests.append((self.ground, self.ground_batch))
+        if radius is not None:
+            self._tests.append((self.distance, self.distance_batch))
+        if self.geofences:
+            self._tests.append((self.geofence, self.geofence_batch))
+
+    @staticmethod
+    def columns(records: list) -> dict:
+        """
+        Return a batch of ADSb message records in columnar form.
+
+        The columns altitude, speed, verticalrate, latitude and longitude are float arrays with NaN for missing
+        values, onground is a boolean array.
+
+        :param records: List of AdsbRecord
+        :return: Dictionary of NumPy arrays by field name
+        """
+        columns = {field: np.array([getattr(adsb, field) for adsb in records], dtype=float)
+                   for field in ('altitude', 'speed', 'verticalrate', 'latitude', 'longitude')}
+        columns['onground'] = np.array([bool(adsb.onground) for adsb in records], dtype=bool)
+        return columns
+
+    def _missing(self, missing: np.ndarray, passed: np.ndarray) -> np.ndarray:
+        """Apply the 'strict' flag to the test results 'passed' of a batch, where values are missing."""
+        return np.where(missing, not self.strict, passed)
 
-    def altitude(self, adsb: AdsbMessage) -> bool:
+    def altitude(self, adsb: AdsbRecord) -> bool:
         """
         Checks if the reported altitude is within the requested limits.
 
@@ -326,7 +1021,7 @@ class AdsbMessageFilter:
         If the ADSb message does not contain an altitude value and the filter is set to 'strict' mode,
         False is returned, otherwise True.
 
-        :param adsb: ADSb message instance.
+        :param adsb: ADSb message record.
         :return: True/False
         """
         if self.below <= self.above:
@@ -343,7 +1038,105 @@ class AdsbMessageFilter:
             else:
                 return True
 
-    def filter(self, adsb: AdsbMessage):
+    def altitude_batch(self, columns: dict) -> np.ndarray:
+        """Batch counterpart of altitude()."""
+        if self.below <= self.above:
+            raise ValueError("'below' altitude condition must be higher than 'above' altitude")
+
+        altitude = columns['altitude']
+        return self._missing(np.isnan(altitude), (altitude < self.below) & (altitude > self.above))
+
+    def speed(self, adsb: AdsbRecord) -> bool:
+        """Checks if the reported ground speed is above 'faster' and below 'slower' (where set)."""
+        if adsb.speed is None:
+            return not self.strict
+
+        return ((self.faster is None or adsb.speed > self.faster) and
+                (self.slower is None or adsb.speed < self.slower))
+
+    def speed_batch(self, columns: dict) -> np.ndarray:
+        """Batch counterpart of speed()."""
+        speed = columns['speed']
+        passed = np.ones(len(speed), dtype=bool)
+        if self.faster is not None:
+            passed &= speed > self.faster
+        if self.slower is not None:
+            passed &= speed < self.slower
+        return self._missing(np.isnan(speed), passed)
+
+    def vertical(self, adsb: AdsbRecord) -> bool:
+        """Checks if the reported vertical rate matches the 'rising' and 'descending' flags (where set)."""
+        if adsb.verticalrate is None:
+            return not self.strict
+
+        return ((self.rising is None or (adsb.verticalrate > 0) == self.rising) and
+                (self.descending is None or (adsb.verticalrate < 0) == self.descending))
+
+    def vertical_batch(self, columns: dict) -> np.ndarray:
+        """Batch counterpart of vertical()."""
+        verticalrate = columns['verticalrate']
+        passed = np.ones(len(verticalrate), dtype=bool)
+        if self.rising is not None:
+            passed &= (verticalrate > 0) == self.rising
+        if self.descending is not None:
+            passed &= (verticalrate < 0) == self.descending
+        return self._missing(np.isnan(verticalrate), passed)
+
+    def ground(self, adsb: AdsbRecord) -> bool:
+        """Checks if the ground flag of the message matches the 'onground' flag."""
+        return bool(adsb.onground) == self.onground
+
+    def ground_batch(self, columns: dict) -> np.ndarray:
+        """Batch counterpart of ground()."""
+        return columns['onground'] == self.onground
+
+    def distance(self, adsb: AdsbRecord) -> bool:
+        """Checks if the reported position is within 'radius' about 'center' (great circle distance)."""
+        if adsb.latitude is None or adsb.longitude is None:
+            return not self.strict
+
+        lon0, lat0 = map(math.radians, self.center)
+        lon, lat = math.radians(adsb.longitude), math.radians(adsb.latitude)
+        a = math.sin((lat - lat0) / 2) ** 2 + math.cos(lat0) * math.cos(lat) * math.sin((lon - lon0) / 2) ** 2
+        return 2 * self.EARTH_RADIUS * math.asin(math.sqrt(a)) < self.radius
+
+    def distance_batch(self, columns: dict) -> np.ndarray:
+        """Batch counterpart of distance(); Positions outside the bounding box of the circle are rejected before
+        computing great circle distances."""
+        lon, lat = columns['longitude'], columns['latitude']
+        lon0, lat0 = self.center
+
+        # Half-widths of the bounding box [deg], the longitude span is unbounded close to the poles
+        d_lat = math.degrees(self.radius / self.EARTH_RADIUS)
+        cos_lat0 = math.cos(math.radians(lat0))
+        d_lon = d_lat / cos_lat0 if cos_lat0 > d_lat / 180 else 360
+
+        passed = np.zeros(len(lon), dtype=bool)
+        candidates = np.flatnonzero((np.abs(lat - lat0) <= d_lat) & (np.abs((lon - lon0 + 180) % 360 - 180) <= d_lon))
+
+        lon_c, lat_c = np.radians(lon[candidates]), np.radians(lat[candidates])
+        lon0, lat0 = math.radians(lon0), math.radians(lat0)
+        a = np.sin((lat_c - lat0) / 2) ** 2 + math.cos(lat0) * np.cos(lat_c) * np.sin((lon_c - lon0) / 2) ** 2
+        passed[candidates] = 2 * self.EARTH_RADIUS * np.arcsin(np.sqrt(a)) < self.radius
+
+        return self._missing(np.isnan(lon) | np.isnan(lat), passed)
+
+    def geofence(self, adsb: AdsbRecord) -> bool:
+        """Checks if the reported position is inside at least one of the geofences."""
+        if adsb.latitude is None or adsb.longitude is None:
+            return not self.strict
+
+        return any(fence.contains(adsb.longitude, adsb.latitude) for fence in self.geofences)
+
+    def geofence_batch(self, columns: dict) -> np.ndarray:
+        """Batch counterpart of geofence()."""
+        lon, lat = columns['longitude'], columns['latitude']
+        passed = np.zeros(len(lon), dtype=bool)
+        for fence in self.geofences:
+            passed |= fence.contains_batch(lon, lat)
+        return self._missing(np.isnan(lon) | np.isnan(lat), passed)
+
+    def filter(self, adsb: AdsbRecord):
         """
         Returns True if all sub-tests return True, else False.
 
@@ -353,8 +1146,20 @@ class AdsbMessageFilter:
         :param adsb:
         :return:
         """
-        assert isinstance(adsb, AdsbMessage)
-        return all((self.altitude(adsb),))
+        assert isinstance(adsb, AdsbRecord)
+        return all(test(adsb) for test, _ in self._tests)
+
+    def filter_batch(self, columns: dict) -> np.ndarray:
+        """
+        Batch counterpart of filter().
+
+        :param columns: Batch of messages in columnar form, see columns()
+        :return: Boolean array, True for the messages passing all sub-tests
+        """
+        passed = np.ones(len(columns['altitude']), dtype=bool)
+        for _, test in self._tests:
+            passed &= test(columns)
+        return passed
 
 
 if __name__ == "__main__":
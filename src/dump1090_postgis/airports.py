@@ -1,7 +1,17 @@
-"""Airport and Runway models."""
+"""Airport and Runway models, and the spatial index to attribute landings and takeoffs to runways."""
+import collections
+import csv
 import logging
+import math
+import os
 
+import shapely.affinity
 import shapely.geometry
+from shapely.geometry.base import BaseGeometry
+from shapely.prepared import prep
+from shapely.strtree import STRtree
+
+from dump1090_postgis.shared import feet2m, haversine, heading_difference
 
 log = logging.getLogger(__name__)
 
@@ -37,29 +47,80 @@ class Runway:
         self.direction = direction
         self.boundingbox = shapely.geometry.Polygon(bbox)
         self.length = length
+        self._prepared = prep(self.boundingbox)
+        self._frame = self._local_frame(list(self.boundingbox.exterior.coords)[:-1])
 
     def __str__(self):
         return self.name
 
+    @staticmethod
+    def _local_frame(corners: list):
+        """
+        Precompute the along-track/cross-track frame of a quadrilateral bounding box, or return None.
+
+        The frame maps a point to the coordinates (a, b) in the parallelogram spanned by the first corner and its two
+        neighbours, with a along the first edge and b along the last edge: The box spans 0 <= a, b <= 1. 'margin' is
+        the deviation of the opposite corner from (1, 1); Within it, contains_xy() falls back to the exact polygon test.
+
+        :return: Tuple (x0, y0, a_x, a_y, b_x, b_y, margin): a = a_x * (x - x0) + a_y * (y - y0), b likewise
+        """
+        if len(corners) != 4:
+            return None
+        (x0, y0), (x1, y1), (x2, y2), (x3, y3) = corners
+        ux, uy, vx, vy = x1 - x0, y1 - y0, x3 - x0, y3 - y0
+        det = ux * vy - uy * vx
+        if det == 0:
+            return None
+        a_x, a_y, b_x, b_y = vy / det, -vx / det, -uy / det, ux / det
+        a2 = a_x * (x2 - x0) + a_y * (y2 - y0)
+        b2 = b_x * (x2 - x0) + b_y * (y2 - y0)
+        margin = max(abs(a2 - 1.0), abs(b2 - 1.0)) + 1e-9
+        if margin > 0.1:
+            return None  # Not close to a parallelogram
+        return x0, y0, a_x, a_y, b_x, b_y, margin
+
     def point_in(self, point: shapely.geometry.point.Point):
         """Return True if point lies within the runway bounding box, otherwise False."""
         assert isinstance(point, shapely.geometry.point.Point)
-        log.debug("Testing point_in for runway {}: {} ".format(self.name, self.boundingbox.contains(point)))
+        inside = self._prepared.contains(point)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Testing point_in for runway {}: {} ".format(self.name, inside))
 
-        return self.boundingbox.contains(point)
+        return inside
+
+    def contains_xy(self, lon: float, lat: float) -> bool:
+        """Return True if the point (lon, lat) lies within the runway bounding box, otherwise False.
+
+        Points clearly inside or outside are decided with a few multiply-adds in the local frame of the runway (see
+        _local_frame()), points near the edges by the prepared bounding box.
+        """
+        if self._frame is None:
+            return self._prepared.contains(shapely.geometry.point.Point(lon, lat))
+
+        x0, y0, a_x, a_y, b_x, b_y, margin = self._frame
+        dx, dy = lon - x0, lat - y0
+        a = a_x * dx + a_y * dy
+        b = b_x * dx + b_y * dy
+        if a < 0.0 or b < 0.0 or a > 1.0 + margin or b > 1.0 + margin:
+            return False
+        if margin < a < 1.0 - margin and margin < b < 1.0 - margin:
+            return True
+        return self._prepared.contains(shapely.geometry.point.Point(lon, lat))
 
     def same_heading(self, heading: float, direction_tol: float = 20.0):
         """Return True if heading coincides (within bounds) with the runway direction, otherwise False.
 
-        :param heading: Aircraft heading
+        :param heading: Aircraft heading, None if unknown
         :type heading: float
         :param direction_tol: The maximum permitted difference between the aircraft heading
         and the runway direction to return a positive.
         :type direction_tol: float
         """
 
+        if heading is None:
+            return False
         log.debug("Testing aircraft heading {:.1f} relative to runway direction {}".format(heading, self.direction))
-        if abs(self.direction - heading) <= direction_tol:
+        if heading_difference(self.direction, heading) <= direction_tol:
             log.debug("Aircraft heading and runway direction coincide")
             return True
         else:
@@ -79,13 +140,16 @@ class Airport:
         self.altitude = altitude
         self.boundingbox = shapely.geometry.Polygon(bbox)
         self.runways = runways
+        self._prepared = prep(self.boundingbox)
 
     def point_in(self, point: shapely.geometry.point.Point):
         """Return True if point lies within the airport bounding box, otherwise False."""
         assert isinstance(point, shapely.geometry.point.Point)
-        log.debug("Testing point_in for airport {}: {} ".format(self.name_icao, self.boundingbox.contains(point)))
+        inside = self._prepared.contains(point)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Testing point_in for airport {}: {} ".format(self.name_icao, inside))
 
-        return self.boundingbox.contains(point)
+        return inside
 
     def get_runway(self, point: shapely.geometry.point.Point, heading: float) -> Runway:
         """Check if touchdown/takeoff point and heading fit any known runway.
@@ -125,6 +189,168 @@ class Airport:
         return None
 
 
+class RunwayIndex:
+    """
+    Spatial index of the runways of any number of airports, to attribute a touchdown or takeoff point to a runway.
+
+    The bounding boxes of the runways and of the airports are stored in STRtrees. A point is only tested against the
+    runways (and, as a fallback like in Airport.get_runway(), the airports) whose bounding box envelopes contain it,
+    so that the attribution takes logarithmic time in the number of airports.
+
+    :param airports: Airport instances
+    """
+
+    def __init__(self, airports: iter):
+        self.airports = list(airports)
+        self._runways = [runway for airport in self.airports for runway in airport.runways]
+        self._runway_tree = _SpatialIndex([runway.boundingbox for runway in self._runways])
+        self._airport_tree = _SpatialIndex([airport.boundingbox for airport in self.airports])
+
+    def __len__(self):
+        return len(self._runways)
+
+    def get_runway(self, point: shapely.geometry.point.Point, heading: float) -> Runway:
+        """Return the runway to which the touchdown/takeoff point and heading fit, otherwise None.
+
+        See Airport.get_runway(), of which this is the equivalent for all airports of the index.
+        """
+        lon, lat = point.x, point.y
+        for index in self._runway_tree.query(point):
+            runway = self._runways[index]
+            if runway.contains_xy(lon, lat) and runway.same_heading(heading):
+                return runway
+
+        # Fallback: Compare against airport bounding boxes and runway directions
+        for index in self._airport_tree.query(point):
+            airport = self.airports[index]
+            if airport.point_in(point):
+                for runway in airport.runways:
+                    if runway.same_heading(heading):
+                        log.warning("Landing outside of runway detected for runway {} of {}".format(
+                            runway.name, airport.name_icao))
+                        return runway
+        return None
+
+
+class _SpatialIndex:
+    """STRtree of geometries, whose queries return the indexes of the candidate geometries (Shapely 1.8 and 2)."""
+
+    def __init__(self, geometries: list):
+        self._tree = STRtree(geometries) if geometries else None
+        self._indexes = {id(geometry): index for index, geometry in enumerate(geometries)}
+
+    def query(self, geometry) -> list:
+        """Indexes of the geometries whose envelopes intersect the envelope of the geometry, in ascending order."""
+        if self._tree is None:
+            return []
+        hits = self._tree.query(geometry)
+        if len(hits) and isinstance(hits[0], BaseGeometry):  # Shapely < 2 returns the geometries
+            return sorted(self._indexes[id(hit)] for hit in hits)
+        return sorted(int(hit) for hit in hits)
+
+
+# Data set of runways of the OurAirports project (see database/data/attributions.txt)
+RUNWAYS_CSV = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                           'database', 'data', 'runways.csv')
+# Width [m] of runways without a width in the data set
+DEFAULT_RUNWAY_WIDTH = 45.0
+# Margin [m] about the runways of an airport, for the fallback bounding box of the airport
+AIRPORT_MARGIN = 300.0
+_METERS_PER_DEGREE = 111320.0
+
+
+def _runway_polygon(le: tuple, he: tuple, width: float) -> shapely.geometry.Polygon:
+    """Rectangle of a runway between its ends (lon, lat) with a width [m], counterclockwise."""
+    scale = math.cos(math.radians((le[1] + he[1]) / 2))
+    east, north = (he[0] - le[0]) * scale, he[1] - le[1]
+    norm = math.hypot(east, north)
+    # Half width perpendicular to the runway axis, in degrees
+    d_east, d_north = -north / norm * width / 2 / _METERS_PER_DEGREE, east / norm * width / 2 / _METERS_PER_DEGREE
+    d_lon = d_east / scale
+    return shapely.geometry.Polygon([(le[0] - d_lon, le[1] - d_north), (he[0] - d_lon, he[1] - d_north),
+                                     (he[0] + d_lon, he[1] + d_north), (le[0] + d_lon, le[1] + d_north)])
+
+
+def _bearing(start: tuple, end: tuple) -> float:
+    """Initial true bearing [deg] from start to end (lon, lat)."""
+    phi1, phi2 = math.radians(start[1]), math.radians(end[1])
+    d_lambda = math.radians(end[0] - start[0])
+    return math.degrees(math.atan2(math.sin(d_lambda) * math.cos(phi2),
+                                   math.cos(phi1) * math.sin(phi2) - math.sin(phi1) * math.cos(phi2) *
+                                   math.cos(d_lambda))) % 360.0
+
+
+def load_airports(path: str = RUNWAYS_CSV, idents: iter = None, center: tuple = None, radius: float = None) -> list:
+    """
+    Load airports and their runways from the runways data set (database/data/runways.csv).
+
+    Each open runway with known end coordinates yields two Runway instances, one per direction, sharing the rectangle
+    between the runway ends. The bounding box of an airport encloses its runways with a margin of AIRPORT_MARGIN.
+
+    :param path: Path of the CSV file
+    :param idents: ICAO identifiers of the airports to load, e.g. ['LFRS']; None selects by center and radius
+    :param center: Position (lon, lat) about which to load the airports within radius, e.g. the receiver position
+    :param radius: Radius [m] about center; An airport is loaded with all its runways if any runway end is within
+    :return: List of Airport instances
+    """
+    idents = {ident.upper() for ident in idents} if idents else None
+    rows = collections.defaultdict(list)  # Airport ident -> (row, le, he) of its runways
+
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            ident = row['airport_ident'].upper()
+            if idents is not None and ident not in idents or row['closed'] == '1':
+                continue
+            try:
+                le = (float(row['le_longitude_deg']), float(row['le_latitude_deg']))
+                he = (float(row['he_longitude_deg']), float(row['he_latitude_deg']))
+            except ValueError:
+                continue  # Runway without coordinates
+            if le != he:
+                rows[ident].append((row, le, he))
+
+    if idents is None:
+        # Whole airports, also if some of their runways are beyond the radius
+        rows = {ident: airport_rows for ident, airport_rows in rows.items()
+                if center is not None and radius is not None and
+                any(haversine(center[0], center[1], *end) <= radius for _, le, he in airport_rows for end in (le, he))}
+
+    airports = [_airport(ident, airport_rows) for ident, airport_rows in rows.items()]
+    log.info("Loaded {} runways of {} airports from {}".format(sum(len(a.runways) for a in airports), len(airports),
+                                                              path))
+    return airports
+
+
+def _airport(ident: str, rows: list) -> Airport:
+    """Airport with the runways of its rows (row, le, he) of the runways data set."""
+    runways = []
+    ends = []  # Runway end coordinates (lon, lat, elevation [m])
+    for row, le, he in rows:
+        width = feet2m(float(row['width_ft'])) if row['width_ft'] else DEFAULT_RUNWAY_WIDTH
+        length = feet2m(float(row['length_ft'])) if row['length_ft'] else haversine(*le, *he)
+        bbox = list(_runway_polygon(le, he, width).exterior.coords)[:-1]
+        for name, start, end, prefix in ((row['le_ident'], le, he, 'le_'), (row['he_ident'], he, le, 'he_')):
+            elevation = feet2m(float(row[prefix + 'elevation_ft'])) if row[prefix + 'elevation_ft'] else None
+            direction = float(row[prefix + 'heading_degT']) if row[prefix + 'heading_degT'] \
+                else _bearing(start, end)
+            runways.append(Runway(name, start[0], start[1], elevation, direction, bbox, length))
+            ends.append((start[0], start[1], elevation))
+
+    lon = sum(end[0] for end in ends) / len(ends)
+    lat = sum(end[1] for end in ends) / len(ends)
+    elevations = [elevation for _, _, elevation in ends if elevation is not None]
+
+    # Buffer the runways in a local frame with equal scales [deg of latitude], so that the margin is AIRPORT_MARGIN in
+    # all directions
+    scale = math.cos(math.radians(lat))
+    hull = shapely.geometry.MultiPoint([(end[0], end[1]) for end in ends]).convex_hull
+    bbox = shapely.affinity.scale(hull, xfact=scale, origin=(lon, lat)).buffer(AIRPORT_MARGIN / _METERS_PER_DEGREE)
+    bbox = shapely.affinity.scale(bbox, xfact=1 / scale, origin=(lon, lat))
+
+    return Airport(ident, '', lon, lat, sum(elevations) / len(elevations) if elevations else None,
+                   list(bbox.exterior.coords)[:-1], runways)
+
+
 # Instances of known airports and their runways
 _nte_runway_03 = Runway('03',
                         -1.617302,
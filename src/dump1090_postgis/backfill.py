@@ -0,0 +1,438 @@
+"""
+Offline backfill of recorded BaseStation logs into the database.
+
+Replaying archived logs with FileSource through the live path (one ORM commit per DB_COMMIT_PERIOD of wall-clock time)
+is far too slow for months of archives. The Backfill streams the log files (optionally gzip or zstd compressed) in
+chunks of complete lines, reconstructs flights and landing/takeoff events with the rules of CurrentFlights and Flight in
+stream time, and writes the completed flights with bulk COPY.
+
+A backfill is resumable: Its Checkpoint records the file offset from which the logs are replayed after an
+interruption, and up to which stream time the completed flights were already written.
+"""
+import contextlib
+import datetime
+import gzip
+import json
+import logging
+import os
+import time
+
+from dump1090_postgis import bulk, models
+from dump1090_postgis.adsb_parser import AdsbMessage, AdsbMessageFilter, AdsbRecord, MessageStream, RejectionCache
+from dump1090_postgis.flights import CurrentFlights, LandingAndTakeoffManager, admits
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+log = logging.getLogger(__name__)
+
+
+def open_log(path: str) -> tuple:
+    """
+    Open a log file for reading bytes, decompressing files ending on '.gz' or '.zst' on the fly.
+
+    :return: Tuple of the raw file object (to report the progress) and the decompressed stream
+    """
+    raw = open(path, 'rb')
+    if path.endswith('.gz'):
+        return raw, gzip.GzipFile(fileobj=raw, mode='rb')
+    if path.endswith('.zst'):
+        if zstandard is None:
+            raw.close()
+            raise ImportError("Reading {} requires the 'zstandard' package".format(path))
+        return raw, zstandard.ZstdDecompressor().stream_reader(raw)
+    return raw, raw
+
+
+class ArchiveSource(MessageStream):
+    """
+    Generator for ADSB messages of recorded log files, read in chunks of complete lines.
+
+    Reading starts at a position (file index, offset in the uncompressed file). While iterating, 'position' is the
+    position of the chunk of the message yielded last, a safe point to resume reading from, and 'progress' the
+    fraction of the current file read.
+
+    :param file_paths: List of log files, in chronological order
+    :param position: Tuple (file index, offset) to start reading from
+    :param chunk_size: Number of bytes to read at once
+    """
+
+    RECONNECT_ON_EOF = False
+    CHUNK_SIZE = 4 * 1024 * 1024
+
+    def __init__(self, file_paths: list, position: tuple = (0, 0), chunk_size: int = CHUNK_SIZE):
+        super(ArchiveSource, self).__init__()
+        self._file_paths = file_paths
+        self._start = position
+        self._chunk_size = chunk_size
+        self.position = position
+        self.progress = 0.0
+        self.malformed = 0
+
+    def __str__(self):
+        return ', '.join(self._file_paths)
+
+    def _initiate_stream(self):
+        return contextlib.closing(self._lines())
+
+    def _lines(self):
+        """Yields the lines of all files from the start position on."""
+        first, offset = self._start
+        for index in range(first, len(self._file_paths)):
+            path = self._file_paths[index]
+            log.info("Reading {} from offset {}".format(path, offset))
+            raw, stream = open_log(path)
+            size = os.fstat(raw.fileno()).st_size or 1
+
+            with raw, stream:
+                if offset:
+                    stream.seek(offset)
+
+                pending = b''
+                while True:
+                    data = stream.read(self._chunk_size)
+                    if not data:
+                        break
+                    data = pending + data
+                    end = data.rfind(b'\n') + 1
+                    if not end:
+                        pending = data
+                        continue
+
+                    self.position = (index, offset)
+                    self.progress = raw.tell() / size
+                    offset += end
+                    pending = data[end:]
+
+                    lines = data[:end].split(b'\n')
+                    lines.pop()
+                    yield from lines
+
+                if pending:  # Last line without line terminator
+                    self.position = (index, offset)
+                    yield pending
+
+            offset = 0
+
+        self.position = (len(self._file_paths), 0)
+
+    def _accept(self, msg):
+        """Skip malformed lines; Unlike on a socket, they don't indicate a broken connection."""
+        if AdsbMessage.length_ok(msg):
+            return msg.strip()
+        self.malformed += 1
+        return None
+
+    @property
+    def exception(self):
+        # Errors reading the archive are not retried
+        return ()
+
+
+class Checkpoint:
+    """
+    Resume state of a backfill, saved as JSON file.
+
+    - file, offset: Position from which the logs are replayed; No flight of the pool started before it
+    - written_until: Stream time up to which all completed flights were written. Replayed flights which were
+      completed before it (last seen more than MAX_AGE before) are skipped.
+    - complete: True when all files were processed
+
+    :param path: Path of the JSON file
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = None
+        self.offset = 0
+        self.written_until = None
+        self.complete = False
+
+    def load(self) -> bool:
+        """Load the state from the JSON file; Returns False if the file does not exist."""
+        if not os.path.exists(self.path):
+            return False
+
+        with open(self.path, 'r') as f:
+            state = json.load(f)
+        self.file = state['file']
+        self.offset = state['offset']
+        self.written_until = (datetime.datetime.fromisoformat(state['written_until'])
+                              if state['written_until'] is not None else None)
+        self.complete = state['complete']
+        return True
+
+    def save(self):
+        """Save the state; The file is replaced atomically, so that it's never left half written."""
+        state = {'file': self.file,
+                 'offset': self.offset,
+                 'written_until': self.written_until.isoformat() if self.written_until is not None else None,
+                 'complete': self.complete}
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(self.path + '.tmp', self.path)
+
+
+class BackfillFlight:
+    """A flight of the backfill: Flight instance, archive position of its first message and its events."""
+    __slots__ = ('flight', 'position', 'events')
+
+    def __init__(self, flight: models.Flight, position: tuple):
+        self.flight = flight
+        self.position = position
+        self.events = []  # Tuples (event model class, time, runway name)
+
+
+class FlightReconstructor:
+    """
+    Flights pool of the backfill, applying the rules of CurrentFlights to recorded messages in stream time.
+
+    Aircraft are admitted by flights.admits(), flights updated by models.Flight.update() which also detects landings
+    and takeoffs, attributed to runways by LandingAndTakeoffManager.runway(). The stream time is the latest message
+    generation time. A flight is completed when it was not seen for MAX_AGE seconds of stream time.
+
+    :param adsb_filter: The filter which decides if a flight will be tracked or not
+    :param rejection_cache: Cache of declined hexidents, to be shared with the parser
+    :param written_until: Stream time up to which completed flights were written before (see Checkpoint)
+    """
+
+    MAX_AGE = datetime.timedelta(seconds=CurrentFlights.MAX_AGE)
+
+    def __init__(self, adsb_filter: AdsbMessageFilter, rejection_cache: RejectionCache = None,
+                 written_until: datetime.datetime = None):
+        self._adsb_filter = adsb_filter
+        self._rejection_cache = rejection_cache
+        self._written_until = written_until
+        self._flights = {}
+        self._completed = []
+        self.time = None
+        self.skipped = 0
+
+    def __len__(self):
+        return len(self._flights)
+
+    @property
+    def pending(self) -> int:
+        """Number of completed flights not yet handed over by completed()."""
+        return len(self._completed)
+
+    @property
+    def rejection_cache(self) -> RejectionCache:
+        return self._rejection_cache
+
+    @property
+    def resume_position(self) -> tuple:
+        """Archive position of the first message of the oldest flight in the pool, or None if the pool is empty."""
+        return min((entry.position for entry in self._flights.values()), default=None)
+
+    def update(self, adsb_message: AdsbRecord, position: tuple):
+        """
+        Updates the pool from an ADSb message, see CurrentFlights.update().
+
+        A flight not seen for MAX_AGE is completed before the message is processed, as CurrentFlights would have
+        pruned it on any message received in the meantime.
+
+        :param adsb_message: ADSb message record
+        :param position: Archive position of the message (see ArchiveSource)
+        """
+        if self.time is None or adsb_message.gen_date_time > self.time:
+            self.time = adsb_message.gen_date_time
+
+        entry = self._flights.get(adsb_message.hexident)
+        if entry is not None and self.time - entry.flight.last_seen > self.MAX_AGE:
+            self._complete(self._flights.pop(adsb_message.hexident))
+            entry = None
+
+        if entry is not None:
+            entry.flight.update(adsb_message)
+
+        elif admits(adsb_message, self._adsb_filter):
+            if self._rejection_cache is not None:
+                self._rejection_cache.admit(adsb_message.hexident)
+
+            entry = self._flights[adsb_message.hexident] = BackfillFlight(models.Flight(adsb_message.hexident),
+                                                                          position)
+            entry.flight.register_on_landing(
+                lambda _position, flight: self._on_event(entry, _position, flight, models.Landings))
+            entry.flight.register_on_takeoff(
+                lambda _position, flight: self._on_event(entry, _position, flight, models.Takeoffs))
+            entry.flight.update(adsb_message)
+
+        elif self._rejection_cache is not None:
+            self._rejection_cache.reject(adsb_message.hexident)
+
+    def _on_event(self, entry: BackfillFlight, position: models.Position, flight: models.Flight, event_type):
+        runway = LandingAndTakeoffManager.runway(position, flight)
+        if runway:
+            entry.events.append((event_type, position.time, runway.name))
+
+    def prune(self):
+        """Complete all flights not seen for MAX_AGE."""
+        for hexident in [hexident for hexident, entry in self._flights.items()
+                         if self.time - entry.flight.last_seen > self.MAX_AGE]:
+            self._complete(self._flights.pop(hexident))
+
+    def finish(self):
+        """Complete all flights of the pool, at the end of the archive."""
+        for entry in self._flights.values():
+            self._complete(entry)
+        self._flights.clear()
+
+    def _complete(self, entry: BackfillFlight):
+        if self._written_until is not None and entry.flight.last_seen + self.MAX_AGE < self._written_until:
+            self.skipped += 1  # Written before the backfill was resumed
+        else:
+            self._completed.append(entry)
+
+    def completed(self) -> list:
+        """Return and forget the flights completed since the last call."""
+        completed, self._completed = self._completed, []
+        return completed
+
+
+class BulkFlightWriter:
+    """
+    Writes completed flights with their positions, landings and takeoffs with COPY.
+
+    The flight ids are reserved from the sequence of the flights table first, to reference them in the other tables.
+
+    :param connection: psycopg2 connection, e.g. engine.raw_connection()
+    """
+
+    FLIGHT_SEQUENCE = 'flights_id_seq'
+    FLIGHT_COLUMNS = ('id', 'hexident', 'callsign', 'first_seen', 'last_seen', 'intention')
+    POSITION_COLUMNS = ('flight_id', 'time', 'coordinates', 'verticalrate', 'track', 'onground')
+    EVENT_COLUMNS = ('flight_id', 'time', 'runway')
+
+    def __init__(self, connection):
+        self._connection = connection
+        self.flights = 0
+        self.positions = 0
+        self.events = 0
+
+    def write(self, entries: list):
+        """Copy the flights (list of BackfillFlight) within the current transaction."""
+        with self._connection.cursor() as cursor:
+            ids = bulk.reserve_ids(cursor, self.FLIGHT_SEQUENCE, len(entries))
+
+            self.flights += bulk.copy_rows(cursor, models.Flight.__tablename__, self.FLIGHT_COLUMNS,
+                                           ((flight_id, entry.flight.hexident, entry.flight.callsign,
+                                             entry.flight.first_seen, entry.flight.last_seen,
+                                             entry.flight.intention or models.Intention.unknown)
+                                            for flight_id, entry in zip(ids, entries)))
+
+            self.positions += bulk.copy_rows(cursor, models.Position.__tablename__, self.POSITION_COLUMNS,
+                                             ((flight_id, position.time,
+                                               bulk.ewkt_point(*position.xyz, srid=models.SRID),
+                                               position.verticalrate, position.track, position.onground)
+                                              for flight_id, entry in zip(ids, entries)
+                                              for position in entry.flight.positions))
+
+            for event_type in (models.Landings, models.Takeoffs):
+                self.events += bulk.copy_rows(cursor, event_type.__tablename__, self.EVENT_COLUMNS,
+                                              ((flight_id, event_time, runway)
+                                               for flight_id, entry in zip(ids, entries)
+                                               for _type, event_time, runway in entry.events if _type is event_type))
+
+    def commit(self):
+        self._connection.commit()
+
+
+class Backfill:
+    """
+    Backfill of recorded log files into the database.
+
+    The completed flights are written every FLUSH_SIZE flights and committed together with a checkpoint every
+    CHECKPOINT_PERIOD seconds, so that an interrupted backfill is resumed from its checkpoint without duplicating or
+    losing flights. The progress is logged every PROGRESS_PERIOD seconds.
+
+    :param file_paths: List of log files, in chronological order
+    :param writer: Writer of the completed flights, e.g. BulkFlightWriter
+    :param adsb_filter: The filter which decides if a flight will be tracked or not
+    :param checkpoint: Checkpoint to resume from and to update, or None
+    :param chunk_size: Number of bytes to read at once
+    """
+
+    CHECKPOINT_PERIOD = 60
+    PROGRESS_PERIOD = 10
+    FLUSH_SIZE = 1000
+
+    def __init__(self, file_paths: list, writer: BulkFlightWriter, adsb_filter: AdsbMessageFilter,
+                 checkpoint: Checkpoint = None, chunk_size: int = ArchiveSource.CHUNK_SIZE):
+        self._file_paths = file_paths
+        self._writer = writer
+        self._adsb_filter = adsb_filter
+        self._checkpoint = checkpoint
+        self._chunk_size = chunk_size
+        self.messages = 0
+
+    def run(self):
+        """Backfill all files, or the remainder of the files if the checkpoint exists."""
+        position, written_until = (0, 0), None
+        if self._checkpoint is not None and self._checkpoint.load():
+            if self._checkpoint.complete:
+                log.info("Backfill of checkpoint {} is complete already".format(self._checkpoint.path))
+                return
+            if self._checkpoint.file not in self._file_paths:
+                raise ValueError("File {} of checkpoint {} is not in the list of files to backfill".format(
+                    self._checkpoint.file, self._checkpoint.path))
+            position = (self._file_paths.index(self._checkpoint.file), self._checkpoint.offset)
+            written_until = self._checkpoint.written_until
+            log.info("Resuming backfill from {} at offset {}".format(self._checkpoint.file, self._checkpoint.offset))
+
+        source = ArchiveSource(self._file_paths, position, chunk_size=self._chunk_size)
+        pool = FlightReconstructor(self._adsb_filter, RejectionCache(), written_until=written_until)
+
+        chunk = source.position
+        start = last_checkpoint = last_progress = time.monotonic()
+        for msg in AdsbMessage(source, rejection_cache=pool.rejection_cache):
+            if source.position != chunk:
+                # All messages of the previous chunk are processed
+                chunk = source.position
+                pool.prune()
+                self._flush(pool, self.FLUSH_SIZE)
+
+                now = time.monotonic()
+                if now - last_checkpoint > self.CHECKPOINT_PERIOD:
+                    self._commit(pool, chunk)
+                    last_checkpoint = now
+                if now - last_progress > self.PROGRESS_PERIOD:
+                    self._log_progress(source, pool, now - start)
+                    last_progress = now
+
+            pool.update(msg, chunk)
+            self.messages += 1
+
+        pool.finish()
+        self._commit(pool, source.position, complete=True)
+        self._log_progress(source, pool, time.monotonic() - start)
+        log.info("Backfill complete: {} flights, {} positions and {} landings/takeoffs written, {} flights skipped as "
+                 "written before, {} malformed lines".format(self._writer.flights, self._writer.positions,
+                                                             self._writer.events, pool.skipped, source.malformed))
+
+    def _flush(self, pool: FlightReconstructor, size: int = 1):
+        """Write the completed flights if there are at least 'size'."""
+        if pool.pending >= size:
+            self._writer.write(pool.completed())
+
+    def _commit(self, pool: FlightReconstructor, chunk: tuple, complete: bool = False):
+        """Write all completed flights and commit them together with the checkpoint."""
+        self._flush(pool)
+        self._writer.commit()
+        if self._checkpoint is None:
+            return
+
+        index, offset = min(pool.resume_position or chunk, chunk)
+        self._checkpoint.file = self._file_paths[min(index, len(self._file_paths) - 1)]
+        self._checkpoint.offset = offset if index < len(self._file_paths) else 0
+        self._checkpoint.written_until = pool.time
+        self._checkpoint.complete = complete
+        self._checkpoint.save()
+
+    def _log_progress(self, source: ArchiveSource, pool: FlightReconstructor, duration: float):
+        index = min(source.position[0], len(self._file_paths) - 1)
+        log.info("{} ({:.0%}): {} messages in {:.0f}sec ({:.0f} msg/sec), {} flights written, {} in pool".format(
+            self._file_paths[index], source.progress, self.messages, duration, self.messages / max(duration, 1e-6),
+            self._writer.flights, len(pool)))
@@ -0,0 +1,555 @@
+"""
+Message source for the Beast binary output of dump1090 (port 30005).
+
+The Beast output carries the raw Mode S frames received by dump1090, each with a 12MHz MLAT timestamp and the signal
+level, instead of the BaseStation text rendering of port 30003. The frames are decoded into the same AdsbRecords the
+AdsbMessage parser yields for BaseStation messages, so BeastSocket can be used wherever Dump1090Socket is:
+
+    for msg in AdsbMessage(BeastSocket(hostname='localhost', port=30005)):
+        ...
+
+Only DF17 extended squitters (ADS-B) are decoded, into the BaseStation transmission types dump1090 would render:
+- Identification (type codes 1-4): MSG,1 with callsign
+- Surface position (type codes 5-8): MSG,2 with speed, track and position
+- Airborne position (type codes 9-18): MSG,3 with barometric altitude and position
+- Airborne velocity (type code 19): MSG,4 with speed, track and vertical rate
+
+Frame format:
+https://wiki.jetvision.de/wiki/Mode-S_Beast:Data_Output_Formats
+Decoding inspired from:
+https://mode-s.org/decode/
+"""
+import asyncio
+import bisect
+import datetime
+import logging
+import math
+import socket
+import string
+import time
+from typing import NamedTuple
+
+from dump1090_postgis.adsb_parser import AdsbRecord, AsyncDump1090Socket, Dump1090Socket, FileSource, dump1090_host
+
+log = logging.getLogger(__name__)
+
+BEAST_PORT = 30005
+
+ESCAPE = 0x1a
+MODE_S_LONG = 0x33
+
+# Length of the frame body (6 bytes MLAT timestamp, 1 byte signal level, message) by frame type
+FRAME_LENGTHS = {0x31: 6 + 1 + 2,  # '1': Mode A/C
+                 0x32: 6 + 1 + 7,  # '2': Mode S short
+                 MODE_S_LONG: 6 + 1 + 14,  # '3': Mode S long
+                 }
+
+
+class BeastFrame(NamedTuple):
+    """One frame of the Beast binary format."""
+    frame_type: int
+    timestamp: int  # MLAT counter [1/12 us]
+    signal: int
+    message: bytes
+
+
+class BeastFramer:
+    """
+    Incremental splitter of a Beast byte stream into frames.
+
+    Frames start with the escape byte 0x1a followed by the frame type; Escape bytes within a frame are doubled.
+    Incomplete frames are kept until the next call of feed(). After garbage or a broken frame the framer
+    resynchronizes on the next frame start.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def feed(self, data) -> list:
+        """Append the bytes received to the buffer and return the list of complete BeastFrames."""
+        buffer = self._buffer
+        buffer += data
+        size = len(buffer)
+        frames = []
+
+        position = 0
+        while True:
+            start = buffer.find(ESCAPE, position)
+            if start < 0:
+                position = size
+                break
+            if start + 1 == size:
+                position = start
+                break
+
+            length = FRAME_LENGTHS.get(buffer[start + 1])
+            if length is None:
+                position = start + 1
+                continue
+
+            begin = start + 2
+            body = buffer[begin:begin + length]
+            if ESCAPE in body:
+                body, end = self._unescape(buffer, begin, length)
+            else:
+                end = begin + length
+
+            if end < 0:  # Escape byte not followed by an escape byte: Broken frame
+                position = -end
+                continue
+            if len(body) < length:  # Incomplete frame
+                position = start
+                break
+
+            frames.append(BeastFrame(buffer[start + 1], int.from_bytes(body[:6], 'big'), body[6], bytes(body[7:])))
+            position = end
+
+        del buffer[:position]
+        return frames
+
+    @staticmethod
+    def _unescape(buffer: bytearray, begin: int, length: int) -> tuple:
+        """
+        Read a frame body of 'length' bytes containing escape bytes.
+
+        :return: Tuple (body, end of the body in the buffer); If the body is broken, the negative position of the
+            offending escape byte is returned as end
+        """
+        body = bytearray()
+        i = begin
+        while len(body) < length and i < len(buffer):
+            byte = buffer[i]
+            if byte == ESCAPE:
+                if i + 1 == len(buffer):
+                    break
+                if buffer[i + 1] != ESCAPE:
+                    return body, -i
+                i += 1
+            body.append(byte)
+            i += 1
+        return body, i
+
+
+def _crc_table() -> tuple:
+    """Table of the Mode S CRC (generator polynomial 0x1FFF409) of each byte value."""
+    table = []
+    for byte in range(256):
+        crc = byte << 16
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0xFFF409 if crc & 0x800000 else crc << 1) & 0xFFFFFF
+        table.append(crc)
+    return tuple(table)
+
+
+def _nl_table(nz: int = 15) -> tuple:
+    """Latitudes [deg] at which the number of CPR longitude zones NL decreases, in ascending order."""
+    a = 1 - math.cos(math.pi / (2 * nz))
+    return tuple(math.degrees(math.acos(math.sqrt(a / (1 - math.cos(2 * math.pi / nl))))) for nl in range(59, 1, -1))
+
+
+def _surface_speed_table() -> tuple:
+    """Ground speed [knots] of each value of the surface movement field; None if not available."""
+    # Movement value and speed at the lower bound of each quantization step, and the step size
+    steps = ((2, 0.125, 0.125), (9, 1, 0.25), (13, 2, 0.5), (39, 15, 1), (94, 70, 2), (109, 100, 5), (124, 175, 0))
+    table = [None, 0.0] + [None] * 126
+    for (movement, speed, step), (upper, _, _) in zip(steps, steps[1:] + ((125, 0, 0),)):
+        for value in range(movement, upper):
+            table[value] = speed + (value - movement) * step
+    return tuple(table)
+
+
+def _altitude_table() -> tuple:
+    """Barometric altitude [ft] of each value of the 12 bit altitude field; None for Gray coded (Q bit not set)."""
+    table = []
+    for value in range(4096):
+        if value & 0x10:
+            n = ((value & 0xFE0) >> 1) | (value & 0x0F)
+            table.append(n * 25 - 1000)
+        else:
+            table.append(None)
+    return tuple(table)
+
+
+CRC_TABLE = _crc_table()
+NL_TABLE = _nl_table()
+SURFACE_SPEED_TABLE = _surface_speed_table()
+ALTITUDE_TABLE = _altitude_table()
+CALLSIGN_CHARSET = '#ABCDEFGHIJKLMNOPQRSTUVWXYZ##### ###############0123456789######'
+
+CPR_SCALE = 1 << 17
+
+
+def crc(message: bytes) -> int:
+    """Mode S CRC of the message without its parity field."""
+    remainder = 0
+    for byte in message[:-3]:
+        remainder = ((remainder << 8) & 0xFFFFFF) ^ CRC_TABLE[(remainder >> 16) ^ byte]
+    return remainder
+
+
+def cpr_nl(lat: float) -> int:
+    """Number of CPR longitude zones at latitude lat [deg]."""
+    return 59 - bisect.bisect_right(NL_TABLE, abs(lat))
+
+
+def cpr_global(even: tuple, odd: tuple, odd_latest: bool) -> tuple:
+    """
+    Decode an airborne position from a pair of even and odd CPR encoded positions.
+
+    :param even: Tuple (lat_cpr, lon_cpr) of the even frame, normalized to [0, 1)
+    :param odd: Tuple (lat_cpr, lon_cpr) of the odd frame, normalized to [0, 1)
+    :param odd_latest: True if the odd frame was received last
+    :return: Tuple (lat, lon) [deg] of the latest frame, or None if the frames lie in different longitude zones
+    """
+    j = math.floor(59 * even[0] - 60 * odd[0] + 0.5)
+    lat_even = 360 / 60 * (j % 60 + even[0])
+    lat_odd = 360 / 59 * (j % 59 + odd[0])
+    if lat_even >= 270:
+        lat_even -= 360
+    if lat_odd >= 270:
+        lat_odd -= 360
+
+    nl = cpr_nl(lat_even)
+    if nl != cpr_nl(lat_odd):
+        return None
+
+    m = math.floor(even[1] * (nl - 1) - odd[1] * nl + 0.5)
+    if odd_latest:
+        lat, lon_cpr, ni = lat_odd, odd[1], max(nl - 1, 1)
+    else:
+        lat, lon_cpr, ni = lat_even, even[1], max(nl, 1)
+
+    lon = 360 / ni * (m % ni + lon_cpr)
+    if lon >= 180:
+        lon -= 360
+    return lat, lon
+
+
+def cpr_local(reference: tuple, lat_cpr: float, lon_cpr: float, odd: bool, span: float = 360.0) -> tuple:
+    """
+    Decode a CPR encoded position relative to a reference position.
+
+    The reference must be within 180NM of the position for airborne positions (span 360), within 45NM for surface
+    positions (span 90).
+
+    :param reference: Tuple (lat, lon) [deg]
+    :return: Tuple (lat, lon) [deg]
+    """
+    ref_lat, ref_lon = reference
+    d_lat = span / (59 if odd else 60)
+    j = math.floor(ref_lat / d_lat) + math.floor((ref_lat % d_lat) / d_lat - lat_cpr + 0.5)
+    lat = d_lat * (j + lat_cpr)
+
+    d_lon = span / max(cpr_nl(lat) - odd, 1)
+    m = math.floor(ref_lon / d_lon) + math.floor((ref_lon % d_lon) / d_lon - lon_cpr + 0.5)
+    return lat, d_lon * (m + lon_cpr)
+
+
+class _Aircraft:
+    """CPR decoding state of an aircraft."""
+    __slots__ = ('cpr', 'position', 'last_seen')
+
+    def __init__(self):
+        self.cpr = [None, None]  # Latest even and odd CPR position: Tuple (lat_cpr, lon_cpr, time)
+        self.position = None  # Latest decoded position: Tuple (lat, lon, time)
+        self.last_seen = 0.0
+
+
+class BeastDecoder:
+    """
+    Decoder of batches of Beast frames into AdsbRecords.
+
+    The DF17 messages are dispatched by their type code on the DECODERS table. Airborne positions are decoded from
+    an even and odd frame received within CPR_MAX_AGE seconds (global decoding), afterwards relative to the last
+    position of the aircraft (local decoding). Surface positions are decoded relative to the last position of the
+    aircraft or, if none is known, relative to the reference position of the receiver.
+
+    The generation time of a record is derived from the MLAT timestamp of the frame, anchored to the wall clock;
+    The log time is the time at which the batch was decoded.
+
+    :param reference: Position (lon, lat) of the receiver [deg], to decode surface positions
+    """
+
+    # Maximum age [s] of the other frame of an even/odd pair for global CPR decoding
+    CPR_MAX_AGE = 10
+    # Maximum age [s] of the reference position for local CPR decoding of airborne positions
+    LOCAL_MAX_AGE = 60
+    # The decoding state of aircraft not seen for STATE_TTL seconds is dropped
+    STATE_TTL = 300
+    # Re-anchor the MLAT clock to the wall clock if they drift apart more than MAX_CLOCK_OFFSET seconds
+    MAX_CLOCK_OFFSET = 1.0
+    MLAT_CLOCK = 12e6  # [Hz]
+
+    # Timestamp of positions computed by multilateration (mlat-client), which carry no MLAT counter value
+    _MLAT_SYNTHETIC = 0xFF004D4C4154
+
+    def __init__(self, reference: tuple = None):
+        self._reference = (reference[1], reference[0]) if reference is not None else None
+        self._aircraft = {}
+        self._clock_epoch = None
+        self._last_prune = time.time()
+        self.frames = 0
+        self.decoded = 0
+
+    def decode(self, frames: list) -> list:
+        """Return the AdsbRecords of all decodable frames of a batch of BeastFrames, in order."""
+        now = time.time()
+        log_date_time = datetime.datetime.fromtimestamp(now, datetime.timezone.utc)
+        records = []
+        self.frames += len(frames)
+
+        for frame in frames:
+            message = frame.message
+            if frame.frame_type != MODE_S_LONG or message[0] >> 3 != 17:
+                continue
+            if crc(message) != int.from_bytes(message[11:], 'big'):
+                continue
+
+            me = int.from_bytes(message[4:11], 'big')
+            decoder = self.DECODERS[me >> 51]
+            if decoder is None:
+                continue
+
+            hexident = message[1:4].hex().upper()
+            values = decoder(self, hexident, me, now)
+            if values is None:
+                continue
+
+            transmission_type, callsign, altitude, speed, track, lat, lon, verticalrate, onground = values
+            records.append(AdsbRecord(transmission_type, 1, 1, hexident, 1, self._gen_date_time(frame.timestamp, now),
+                                      log_date_time, callsign, altitude, speed, track, lat, lon, verticalrate, None,
+                                      False, False, False, onground))
+
+        self.decoded += len(records)
+        if now - self._last_prune > self.STATE_TTL:
+            self._prune(now)
+        return records
+
+    def _gen_date_time(self, timestamp: int, now: float) -> datetime.datetime:
+        """Wall clock time of an MLAT timestamp, anchored at the first frame."""
+        if timestamp == 0 or timestamp == self._MLAT_SYNTHETIC:
+            seconds = now
+        else:
+            seconds = timestamp / self.MLAT_CLOCK
+            if self._clock_epoch is None or abs(self._clock_epoch + seconds - now) > self.MAX_CLOCK_OFFSET:
+                self._clock_epoch = now - seconds
+            seconds += self._clock_epoch
+        return datetime.datetime.fromtimestamp(seconds, datetime.timezone.utc)
+
+    def _aircraft_state(self, hexident: string, now: float) -> _Aircraft:
+        aircraft = self._aircraft.get(hexident)
+        if aircraft is None:
+            aircraft = self._aircraft[hexident] = _Aircraft()
+        aircraft.last_seen = now
+        return aircraft
+
+    def _prune(self, now: float):
+        """Drop the decoding state of aircraft not seen for STATE_TTL seconds."""
+        for hexident in [h for h, aircraft in self._aircraft.items() if now - aircraft.last_seen > self.STATE_TTL]:
+            del self._aircraft[hexident]
+        self._last_prune = now
+
+    def _identification(self, hexident: string, me: int, now: float) -> tuple:
+        callsign = ''.join(CALLSIGN_CHARSET[(me >> shift) & 0x3F] for shift in range(42, -1, -6))
+        return 1, callsign.strip('# ') or None, None, None, None, None, None, None, False
+
+    def _surface_position(self, hexident: string, me: int, now: float) -> tuple:
+        aircraft = self._aircraft_state(hexident, now)
+        speed = SURFACE_SPEED_TABLE[(me >> 44) & 0x7F]
+        track = ((me >> 36) & 0x7F) * 360 / 128 if (me >> 43) & 1 else None
+
+        reference = aircraft.position[:2] if aircraft.position is not None else self._reference
+        lat = lon = None
+        if reference is not None:
+            lat, lon = cpr_local(reference, ((me >> 17) & 0x1FFFF) / CPR_SCALE, (me & 0x1FFFF) / CPR_SCALE,
+                                 (me >> 34) & 1, span=90.0)
+            aircraft.position = (lat, lon, now)
+            lat, lon = round(lat, 5), round(lon, 5)
+
+        return (2, None, None, round(speed) if speed is not None else None, round(track) if track is not None else None,
+                lat, lon, None, True)
+
+    def _airborne_position(self, hexident: string, me: int, now: float) -> tuple:
+        aircraft = self._aircraft_state(hexident, now)
+        altitude = ALTITUDE_TABLE[(me >> 36) & 0xFFF]
+        odd = (me >> 34) & 1
+        lat_cpr, lon_cpr = ((me >> 17) & 0x1FFFF) / CPR_SCALE, (me & 0x1FFFF) / CPR_SCALE
+        aircraft.cpr[odd] = (lat_cpr, lon_cpr, now)
+
+        position = None
+        other = aircraft.cpr[1 - odd]
+        if other is not None and now - other[2] <= self.CPR_MAX_AGE:
+            even, odd_cpr = (other, aircraft.cpr[1]) if odd else (aircraft.cpr[0], other)
+            position = cpr_global(even, odd_cpr, odd_latest=bool(odd))
+        elif aircraft.position is not None and now - aircraft.position[2] <= self.LOCAL_MAX_AGE:
+            position = cpr_local(aircraft.position[:2], lat_cpr, lon_cpr, odd)
+
+        lat = lon = None
+        if position is not None:
+            aircraft.position = position + (now,)
+            lat, lon = round(position[0], 5), round(position[1], 5)
+
+        return 3, None, altitude, None, None, lat, lon, None, False
+
+    def _velocity(self, hexident: string, me: int, now: float) -> tuple:
+        subtype = (me >> 48) & 0x7
+        factor = 4 if subtype in (2, 4) else 1
+        speed = track = verticalrate = None
+
+        if subtype in (1, 2):  # Ground speed
+            v_ew, v_ns = (me >> 32) & 0x3FF, (me >> 21) & 0x3FF
+            if v_ew and v_ns:
+                v_x = (v_ew - 1) * factor * (-1 if (me >> 42) & 1 else 1)
+                v_y = (v_ns - 1) * factor * (-1 if (me >> 31) & 1 else 1)
+                speed = round(math.hypot(v_x, v_y))
+                track = round(math.degrees(math.atan2(v_x, v_y))) % 360
+        elif subtype in (3, 4):  # Airspeed and heading
+            airspeed = (me >> 21) & 0x3FF
+            if airspeed:
+                speed = (airspeed - 1) * factor
+            if (me >> 42) & 1:
+                track = round(((me >> 32) & 0x3FF) * 360 / 1024) % 360
+        else:
+            return None
+
+        rate = (me >> 10) & 0x1FF
+        if rate:
+            verticalrate = (rate - 1) * 64 * (-1 if (me >> 19) & 1 else 1)
+
+        return 4, None, None, speed, track, None, None, verticalrate, False
+
+    # Decoder by type code of the DF17 message (first 5 bits of the ME field)
+    DECODERS = ((None,) + (_identification,) * 4 + (_surface_position,) * 4 + (_airborne_position,) * 10 +
+                (_velocity,) + (None,) * 12)
+
+
+class BeastReader:
+    """
+    Iterator over the AdsbRecords decoded from a Beast byte stream (socket or binary file).
+
+    The stream is read in chunks into a reusable buffer, and the frames of each chunk are decoded as a batch.
+    The stream is closed when leaving the context manager.
+    """
+
+    BUFFER_SIZE = 65536
+
+    def __init__(self, stream, decoder: BeastDecoder, buffer_size: int = BUFFER_SIZE):
+        self._stream = stream
+        self._read_into = stream.recv_into if isinstance(stream, socket.socket) else stream.readinto
+        self._buffer = bytearray(buffer_size)
+        self._framer = BeastFramer()
+        self._decoder = decoder
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._stream.close()
+
+    def __iter__(self) -> AdsbRecord:
+        """Yields the decoded records; Stops when the stream is exhausted."""
+        view = memoryview(self._buffer)
+        try:
+            while True:
+                n = self._read_into(view)
+                if not n:
+                    return
+                yield from self._decoder.decode(self._framer.feed(view[:n]))
+        finally:
+            view.release()
+
+
+class AsyncBeastReader:
+    """
+    Async iterator over the AdsbRecords decoded from a Beast byte stream; Counterpart of BeastReader.
+
+    Raises socket.timeout if no data is received for 'timeout' seconds.
+    """
+
+    BUFFER_SIZE = BeastReader.BUFFER_SIZE
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, decoder: BeastDecoder,
+                 timeout: float = None):
+        self._reader = reader
+        self._writer = writer
+        self._decoder = decoder
+        self._timeout = timeout
+        self._framer = BeastFramer()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self._writer.close()
+        try:
+            await self._writer.wait_closed()
+        except OSError:
+            pass  # Connection reset by the peer, the stream is closed nevertheless
+
+    async def __aiter__(self):
+        """Yields the decoded records; Stops when the peer closes the connection."""
+        while True:
+            try:
+                data = await asyncio.wait_for(self._reader.read(self.BUFFER_SIZE), self._timeout)
+            except asyncio.TimeoutError:
+                raise socket.timeout("No data received within {}sec".format(self._timeout))
+            if not data:
+                return
+
+            for record in self._decoder.decode(self._framer.feed(data)):
+                yield record
+
+
+class BeastSocket(Dump1090Socket):
+    """
+    Generator for AdsbRecords decoded from the Beast binary output of dump1090 received from port on hostname.
+
+    :param hostname: Ip address of host
+    :param port: Port of the Beast output
+    :param reference: Position (lon, lat) of the receiver [deg], to decode surface positions
+    """
+
+    YIELDS_RECORDS = True
+
+    def __init__(self, hostname: string = dump1090_host, port: int = BEAST_PORT, reference: tuple = None):
+        super(BeastSocket, self).__init__(hostname=hostname, port=port)
+        # The decoder keeps the CPR state of the aircraft across reconnections
+        self._decoder = BeastDecoder(reference)
+
+    def _reader(self, sock: socket.socket) -> BeastReader:
+        return BeastReader(sock, self._decoder)
+
+    def _accept(self, msg: AdsbRecord) -> AdsbRecord:
+        return msg
+
+
+class BeastFileSource(FileSource):
+    """Generator for AdsbRecords decoded from a recorded Beast binary file."""
+
+    YIELDS_RECORDS = True
+
+    def __init__(self, file_path: string, reference: tuple = None):
+        super(BeastFileSource, self).__init__(file_path)
+        self._decoder = BeastDecoder(reference)
+
+    def _initiate_stream(self) -> BeastReader:
+        return BeastReader(super(BeastFileSource, self)._initiate_stream(), self._decoder)
+
+    def _accept(self, msg: AdsbRecord) -> AdsbRecord:
+        return msg
+
+
+class AsyncBeastSocket(AsyncDump1090Socket):
+    """Async counterpart of BeastSocket."""
+
+    YIELDS_RECORDS = True
+
+    def __init__(self, hostname: string = dump1090_host, port: int = BEAST_PORT, reference: tuple = None):
+        super(AsyncBeastSocket, self).__init__(hostname=hostname, port=port)
+        self._decoder = BeastDecoder(reference)
+
+    def _reader(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> AsyncBeastReader:
+        return AsyncBeastReader(reader, writer, self._decoder, timeout=self.SOCKET_TIMEOUT)
+
+    def _accept(self, msg: AdsbRecord) -> AdsbRecord:
+        return msg
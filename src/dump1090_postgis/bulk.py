@@ -0,0 +1,68 @@
+"""
+Bulk writing of rows with PostgreSQL's COPY FROM STDIN, instead of inserting ORM objects one by one.
+
+Rows are rendered in the text format of COPY into an in-memory buffer, which is sent with a single COPY statement
+through a psycopg2 cursor (e.g. of engine.raw_connection()). Geometries are rendered as EWKT, which the input function
+of the PostGIS geometry type accepts including the SRID.
+"""
+import datetime
+import enum
+import io
+
+# Representation of NULL and escapes of special characters in the text format of COPY
+NULL = '\\N'
+_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+
+def copy_text(value) -> str:
+    """Render a Python value in the text format of COPY."""
+    if value is None:
+        return NULL
+    if value is True:
+        return 't'
+    if value is False:
+        return 'f'
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, enum.Enum):
+        return value.name
+    if isinstance(value, str):
+        return value.translate(_ESCAPES)
+    return str(value)
+
+
+def ewkt_point(lon: float, lat: float, alt: float, srid: int) -> str:
+    """Render a 3D point as EWKT, e.g. 'SRID=4326;POINT Z (-1.6 47.15 300.0)'."""
+    return 'SRID={};POINT Z ({!r} {!r} {!r})'.format(srid, lon, lat, alt)
+
+
+def copy_rows(cursor, table: str, columns: tuple, rows: iter) -> int:
+    """
+    Write rows into a table with a single COPY statement.
+
+    :param cursor: psycopg2 cursor
+    :param table: Name of the table
+    :param columns: Names of the columns, in the order of the row values
+    :param rows: Iterable of row tuples
+    :return: Number of rows written
+    """
+    buffer = io.StringIO()
+    count = 0
+    for row in rows:
+        buffer.write('\t'.join(map(copy_text, row)))
+        buffer.write('\n')
+        count += 1
+
+    if count:
+        buffer.seek(0)
+        cursor.copy_expert('COPY {} ({}) FROM STDIN'.format(table, ', '.join('"{}"'.format(c) for c in columns)),
+                           buffer)
+    return count
+
+
+def reserve_ids(cursor, sequence: str, count: int) -> list:
+    """Return 'count' new values of a sequence, to assign primary keys before copying the rows."""
+    if count == 0:
+        return []
+    cursor.execute("SELECT nextval(%s) FROM generate_series(1, %s)", (sequence, count))
+    return [row[0] for row in cursor.fetchall()]
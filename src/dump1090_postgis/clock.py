@@ -0,0 +1,78 @@
+"""
+Clocks of the flights pool.
+
+The flights pool ages and commits flights relative to the current time of a clock. Live, the WallClock returns the
+system time. When recorded messages are replayed, the StreamClock returns the latest generation time of the messages
+instead, so that flights are aged in the time of the recording regardless of the replay speed.
+
+The ReplayPacer throttles a replay to a multiple of the recorded speed.
+"""
+import datetime
+import time
+
+
+class WallClock:
+    """Clock returning the system time (UTC), for live message streams."""
+
+    def observe(self, message_time: datetime.datetime):
+        """Messages do not advance the wall clock."""
+
+    def now(self) -> datetime.datetime:
+        return datetime.datetime.now(datetime.timezone.utc)
+
+
+class StreamClock:
+    """
+    Clock driven by the generation time of the messages, for replayed message streams.
+
+    The time is the latest message time observed; It never runs backwards if messages arrive out of order. Before the
+    first message is observed, the clock returns the system time.
+    """
+
+    def __init__(self):
+        self._time = None
+
+    def observe(self, message_time: datetime.datetime):
+        """Advance the clock to the generation time of a message."""
+        if self._time is None or message_time > self._time:
+            self._time = message_time
+
+    def now(self) -> datetime.datetime:
+        return self._time if self._time is not None else datetime.datetime.now(datetime.timezone.utc)
+
+
+class ReplayPacer:
+    """
+    Throttles the replay of recorded messages to 'speed' times the recorded speed.
+
+    The first message is released immediately, every further message when its time offset to the first message,
+    divided by the speed, has elapsed. Messages which are due already (e.g. after a slow consumer blocked the replay)
+    are released immediately, so that the replay catches up with its schedule.
+
+    :param speed: Speed multiplier, e.g. 1.0 for real time, 10.0 for ten times faster. None replays unthrottled.
+    """
+
+    def __init__(self, speed: float = 1.0):
+        if speed is not None and speed <= 0:
+            raise ValueError("Replay speed must be positive or None, got {}".format(speed))
+        self._speed = speed
+        self._start = None  # (Time of the first message, monotonic time of its release)
+
+    @property
+    def speed(self) -> float:
+        return self._speed
+
+    def wait(self, message_time: datetime.datetime):
+        """Sleep until the message with the given generation time is due."""
+        if self._speed is None:
+            return
+
+        if self._start is None:
+            self._start = (message_time, time.monotonic())
+            return
+
+        first_time, first_release = self._start
+        due = first_release + (message_time - first_time).total_seconds() / self._speed
+        delay = due - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
@@ -0,0 +1,127 @@
+"""
+In-process event bus, to handle flight events (landings, takeoffs) off the thread which processes the messages.
+
+A publisher calls publish(topic, *args), which only enqueues the event and never blocks. Each subscriber has its own
+bounded queue and worker thread, which calls the subscriber with (topic, *args) for the events of its topics in order
+of publication. A slow subscriber (e.g. runway attribution and database writes, statistics, notifications) delays only
+its own events; When its queue is full, further events are dropped for it and counted.
+"""
+import logging
+import queue
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+LANDING = 'landing'
+TAKEOFF = 'takeoff'
+
+
+class _Subscriber:
+    """Queue and worker thread of a subscriber, with its delivery statistics."""
+
+    _STOP = object()
+
+    def __init__(self, name: str, callback, topics: frozenset, qsize: int):
+        self.name = name
+        self.topics = topics
+        self._callback = callback
+        self._queue = queue.Queue(maxsize=qsize)
+
+        self.delivered = 0
+        self.dropped = 0
+        self.errors = 0
+        self.latency_max = 0.0
+        self._latency_sum = 0.0
+
+        self._thread = threading.Thread(target=self._run, name='event-subscriber-{}'.format(name), daemon=True)
+        self._thread.start()
+
+    def put(self, item):
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            if self.dropped == 0:
+                log.warning("Event queue of subscriber {} full ({} events), dropping events".format(
+                    self.name, self._queue.maxsize))
+            self.dropped += 1
+
+    def stop(self):
+        """Deliver the queued events and stop the worker thread."""
+        self._queue.put(self._STOP)
+        self._thread.join()
+
+    @property
+    def statistics(self) -> dict:
+        return {'delivered': self.delivered,
+                'dropped': self.dropped,
+                'errors': self.errors,
+                'latency_mean': self._latency_sum / self.delivered if self.delivered else 0.0,
+                'latency_max': self.latency_max}
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is self._STOP:
+                break
+
+            published, topic, args = item
+            latency = time.monotonic() - published
+            try:
+                self._callback(topic, *args)
+            except Exception:
+                log.exception("Subscriber {} failed to handle {} event".format(self.name, topic))
+                self.errors += 1
+            self.delivered += 1
+            self._latency_sum += latency
+            self.latency_max = max(self.latency_max, latency)
+
+
+class EventBus:
+    """
+    Publish/subscribe of flight events with a bounded queue and worker thread per subscriber, see module docstring.
+
+    The delivery latency is the time from publishing an event until its subscriber is called.
+
+    :param qsize: Maximum number of queued events per subscriber
+    """
+
+    QSIZE = 10000
+
+    def __init__(self, qsize: int = QSIZE):
+        self._qsize = qsize
+        self._subscribers = []
+
+    def subscribe(self, name: str, callback, topics: iter):
+        """
+        Call callback(topic, *args) in a worker thread for each event published on one of the topics.
+
+        :param name: Name of the subscriber, for logs and statistics
+        :param callback: Callable
+        :param topics: Topics of the events to deliver, e.g. (LANDING, TAKEOFF)
+        """
+        self._subscribers.append(_Subscriber(name, callback, frozenset(topics), self._qsize))
+
+    def publish(self, topic: str, *args):
+        """Queue an event for the subscribers of its topic; Never blocks."""
+        item = (time.monotonic(), topic, args)
+        for subscriber in self._subscribers:
+            if topic in subscriber.topics:
+                subscriber.put(item)
+
+    def close(self):
+        """Deliver all published events and stop the subscriber threads."""
+        for subscriber in self._subscribers:
+            subscriber.stop()
+        self.log_statistics()
+        self._subscribers = []
+
+    @property
+    def statistics(self) -> dict:
+        """Delivery statistics per subscriber name."""
+        return {subscriber.name: subscriber.statistics for subscriber in self._subscribers}
+
+    def log_statistics(self):
+        for name, statistics in self.statistics.items():
+            log.info("Event subscriber {}: {delivered} events delivered ({dropped} dropped, {errors} failed), "
+                     "latency mean {latency_mean:.4f}s max {latency_max:.4f}s".format(name, **statistics))
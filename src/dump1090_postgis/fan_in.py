@@ -0,0 +1,245 @@
+"""
+Fan-in of several ADSB message streams, e.g. of dump1090 receivers with overlapping coverage.
+
+The composite streams MultiSource (threads) and AsyncMultiSource (asyncio) connect to all their receivers at once,
+merge their messages (strings, or decoded records of Beast sources) and drop duplicates of the same message received
+by more than one receiver.
+
+The composites are registered as virtual subclasses of MessageStream and AsyncMessageStream, so that they are accepted
+wherever a single stream is: They only provide the iteration, the connections are made and kept by their sources.
+"""
+import asyncio
+import collections
+import logging
+import queue
+import threading
+import time
+
+from dump1090_postgis.adsb_parser import AdsbRecord, AsyncMessageStream, MessageStream
+
+log = logging.getLogger(__name__)
+
+
+class MessageDeduplicator:
+    """
+    Bounded, time-windowed set of recently seen messages.
+
+    A message is identified by the key (hexident, transmission type, generation date and time). A message is a
+    duplicate if a message with the same key was seen from another source less than 'window' seconds before.
+    Messages with the same key from the same source are not duplicates: dump1090 renders some Mode S replies into
+    several messages of the same type and time, carrying different fields.
+
+    Decoded records (AdsbRecord, e.g. of Beast sources) are identified by their content instead of their generation
+    time: The decoder of each receiver anchors the MLAT timestamps of the frames to its own wall clock, so the
+    generation times of the same frame received by several receivers never agree. Records of the same type and
+    content from different sources within the window are duplicates; A record repeating the content of one received
+    from another source carries no new information besides its time.
+
+    Keys are expired in order of arrival, and the oldest keys are dropped if more than 'max_size' keys are within the
+    window. Receivers which are not time-synchronized stamp the same message with slightly different generation times.
+    Lowering 'time_digits' (number of decimals of the seconds) truncates the generation times to intervals of 10ms (2),
+    100ms (1) or 1s (0): Messages match if their times fall into the same interval. Times close to each other on both
+    sides of an interval boundary (e.g. .099 and .101 with 1 digit) do not match, so the duplicate is kept.
+    """
+
+    WINDOW = 2.0
+    MAX_SIZE = 100000
+
+    def __init__(self, window: float = WINDOW, max_size: int = MAX_SIZE, time_digits: int = 3):
+        self._window = window
+        self._max_size = max_size
+        # Length of the time field "HH:MM:SS.sss" to compare
+        self._time_length = 8 + (time_digits + 1 if time_digits > 0 else 0)
+        self._seen = collections.OrderedDict()  # Key -> (arrival time (monotonic clock), source)
+
+    def __len__(self):
+        return len(self._seen)
+
+    def key(self, msg) -> tuple:
+        """
+        Return the key (hexident, transmission type, date, time) of a message string or bytes, or the key (hexident,
+        transmission type, decoded values) of an AdsbRecord.
+        """
+        if isinstance(msg, AdsbRecord):
+            return msg.hexident, msg.transmission_type, msg[7:]  # Values from callsign to onground
+
+        fields = msg.split(b',' if isinstance(msg, bytes) else ',', 8)
+        return fields[4], fields[1], fields[6], fields[7][:self._time_length]
+
+    def is_duplicate(self, msg, source=None) -> bool:
+        """Return True if the message was seen from another source within the window, otherwise remember it.
+
+        :param msg: Message string or bytes
+        :param source: Any hashable identifying the source of the message, e.g. its index
+        """
+        now = time.monotonic()
+        self._expire(now)
+
+        key = self.key(msg)
+        seen = self._seen.get(key)
+        if seen is not None:
+            return seen[1] != source
+
+        self._seen[key] = (now, source)
+        if len(self._seen) > self._max_size:
+            self._seen.popitem(last=False)
+        return False
+
+    def _expire(self, now: float):
+        """Drop all keys which arrived more than 'window' seconds before now."""
+        seen = self._seen
+        while seen:
+            oldest, _ = next(iter(seen.values()))
+            if now - oldest <= self._window:
+                break
+            seen.popitem(last=False)
+
+
+def _yields_records(message_sources: list) -> bool:
+    """Return YIELDS_RECORDS of the sources of a composite stream, which must not mix records and message strings."""
+    kinds = {source.YIELDS_RECORDS for source in message_sources}
+    if len(kinds) > 1:
+        raise ValueError("Cannot merge sources of decoded records (e.g. Beast) with sources of message strings: "
+                         "{}".format(', '.join(str(source) for source in message_sources)))
+    return bool(kinds) and kinds.pop()
+
+
+class _FanInStatistics:
+    """Per-source message counters of the composite streams."""
+
+    def __init__(self, message_sources: list):
+        self._names = [str(source) for source in message_sources]
+        self._received = [0] * len(message_sources)
+        self._unique = [0] * len(message_sources)
+
+    def count(self, index: int, unique: bool):
+        self._received[index] += 1
+        if unique:
+            self._unique[index] += 1
+
+    @property
+    def statistics(self) -> list:
+        """Number of messages received and contributed uniquely, per source (in order of the sources)."""
+        return [{'source': name, 'received': received, 'unique': unique}
+                for name, received, unique in zip(self._names, self._received, self._unique)]
+
+    def log_statistics(self):
+        for counters in self.statistics:
+            log.info("Source {source}: {received} messages received, {unique} unique".format(**counters))
+
+
+class MultiSource(_FanInStatistics):
+    """
+    Composite MessageStream (virtual subclass), merging the messages of several message streams without duplicates.
+
+    Each source is iterated in its own daemon thread (sources keep their own reconnect semantics) which pushes the
+    messages into a common queue. The iterator stops when all sources are exhausted.
+
+    :param message_sources: List of MessageStream instances
+    :param deduplicator: MessageDeduplicator to apply to the merged messages
+    """
+
+    QSIZE = 10000
+
+    _SOURCE_DONE = object()
+
+    def __init__(self, message_sources: list, deduplicator: MessageDeduplicator = None):
+        assert all(isinstance(source, MessageStream) for source in message_sources)
+        self.YIELDS_RECORDS = _yields_records(message_sources)
+        _FanInStatistics.__init__(self, message_sources)
+        self._message_sources = message_sources
+        self._deduplicator = deduplicator if deduplicator is not None else MessageDeduplicator()
+
+    def __str__(self):
+        return ', '.join(str(source) for source in self._message_sources)
+
+    def __iter__(self):
+        """Yields the merged messages of all sources, dropping duplicates."""
+        _queue = queue.Queue(maxsize=self.QSIZE)
+
+        for index, source in enumerate(self._message_sources):
+            threading.Thread(target=self._receive, args=(index, source, _queue), daemon=True).start()
+
+        active = len(self._message_sources)
+        while active:
+            item = _queue.get()
+            if item is self._SOURCE_DONE:
+                active -= 1
+                continue
+
+            index, msg = item
+            unique = not self._deduplicator.is_duplicate(msg, index)
+            self.count(index, unique)
+            if unique:
+                yield msg
+
+        log.info("All message sources exhausted")
+
+    def _receive(self, index: int, source: MessageStream, _queue: queue.Queue):
+        """Worker thread pushing the messages of one source into the queue."""
+        log.info("Receiving messages from {}".format(source))
+        for msg in source:
+            _queue.put((index, msg))
+        _queue.put(self._SOURCE_DONE)
+
+
+class AsyncMultiSource(_FanInStatistics):
+    """
+    Composite AsyncMessageStream (virtual subclass), merging the messages of several async message streams without
+    duplicates.
+
+    Counterpart of MultiSource, with one task instead of one thread per source.
+
+    :param message_sources: List of AsyncMessageStream instances
+    :param deduplicator: MessageDeduplicator to apply to the merged messages
+    """
+
+    QSIZE = MultiSource.QSIZE
+
+    _SOURCE_DONE = object()
+
+    def __init__(self, message_sources: list, deduplicator: MessageDeduplicator = None):
+        assert all(isinstance(source, AsyncMessageStream) for source in message_sources)
+        self.YIELDS_RECORDS = _yields_records(message_sources)
+        _FanInStatistics.__init__(self, message_sources)
+        self._message_sources = message_sources
+        self._deduplicator = deduplicator if deduplicator is not None else MessageDeduplicator()
+
+    def __str__(self):
+        return ', '.join(str(source) for source in self._message_sources)
+
+    async def __aiter__(self):
+        """Yields the merged messages of all sources, dropping duplicates."""
+        _queue = asyncio.Queue(maxsize=self.QSIZE)
+        receivers = [asyncio.ensure_future(self._receive(index, source, _queue))
+                     for index, source in enumerate(self._message_sources)]
+
+        try:
+            active = len(receivers)
+            while active:
+                item = await _queue.get()
+                if item is self._SOURCE_DONE:
+                    active -= 1
+                    continue
+
+                index, msg = item
+                unique = not self._deduplicator.is_duplicate(msg, index)
+                self.count(index, unique)
+                if unique:
+                    yield msg
+        finally:
+            for receiver in receivers:
+                receiver.cancel()
+
+        log.info("All message sources exhausted")
+
+    async def _receive(self, index: int, source: AsyncMessageStream, _queue: asyncio.Queue):
+        """Task pushing the messages of one source into the queue."""
+        log.info("Receiving messages from {}".format(source))
+        async for msg in source:
+            await _queue.put((index, msg))
+        await _queue.put(self._SOURCE_DONE)
+
+
+MessageStream.register(MultiSource)
+AsyncMessageStream.register(AsyncMultiSource)
@@ -1,4 +1,7 @@
+import collections
 import datetime
+import heapq
+import itertools
 import logging
 import string
 
@@ -6,20 +9,60 @@ from sqlalchemy.orm.session import Session
 
 from dump1090_postgis import models
 from dump1090_postgis import adsb_parser
-from dump1090_postgis.airports import nte_airport
+from dump1090_postgis.airports import RunwayIndex, nte_airport
+from dump1090_postgis.clock import WallClock
+from dump1090_postgis.events import LANDING, TAKEOFF, EventBus
+from dump1090_postgis.sharding import shard_of
+from dump1090_postgis.snapshot import PoolSnapshot
 
 log = logging.getLogger(__name__)
 
 
+def admits(adsb_message: adsb_parser.AdsbRecord, adsb_filter: adsb_parser.AdsbMessageFilter) -> bool:
+    """
+    Returns True if the ADSb message admits its unknown aircraft to a flights pool.
+
+    Either the transmission type equals 2 (aircraft on ground), or it equals 3 and the altitude passes the filter.
+    """
+    return adsb_message.transmission_type == 2 or (adsb_message.transmission_type == 3 and adsb_filter.altitude(
+        adsb_message))
+
+
 class CurrentFlights:
-    """Pool of currently observed flights."""
+    """
+    Pool of currently observed flights.
+
+    Aged flights are found with an expiry index: A min-heap of entries (deadline, sequence number, flight), with the
+    deadline last_seen + MAX_AGE of the flight when the entry was pushed. Updates of a flight do not touch the heap.
+    Instead, an entry whose deadline has passed is checked against the current last_seen of its flight, and pushed
+    again if the flight was seen in the meantime. So a flight costs at most one heap operation per MAX_AGE, and
+    pruning costs O(1) per message while no deadline has passed.
+
+    The positions of the flights are released from memory once committed or handed over to the writer stage (see
+    models.Flight.release_positions), so that the memory of the pool is proportional to the number of flights.
+
+    Landings and takeoffs are published to an event bus (see events.EventBus), whose worker threads attribute them to
+    runways and write them, so that processing the messages never waits for these side effects.
+
+    With a snapshot (see snapshot.PoolSnapshot), the flights of a previous run are restored on construction, and the
+    flights with a database row are saved every snapshot period and on close().
+
+    With a reattach gap, an aircraft reappearing within the gap after it was last seen continues its flight and row
+    instead of starting a new one, e.g. after a coverage gap on final approach. Removed flights are kept in a cache of
+    recent flights, ordered by last seen and bounded by the gap. The cache is seeded once with the flights of the
+    database last seen within the gap before the first message (e.g. of the run before a restart), by a single query
+    on last_seen (indexed), so that processing the messages never waits for a database lookup per aircraft.
+    """
 
     # Maximum age in seconds since last seen of a flight before it gets deleted from the pool
     MAX_AGE = 300
     # Commit to Postgres every X seconds
     DB_COMMIT_PERIOD = 1
 
-    def __init__(self, session: Session, adsb_filter: adsb_parser.AdsbMessageFilter = None):
+    def __init__(self, session: Session, adsb_filter: adsb_parser.AdsbMessageFilter = None, autocommit: bool = True,
+                 rejection_cache: adsb_parser.RejectionCache = None, clock=None, writer=None,
+                 event_bus: EventBus = None, snapshot: PoolSnapshot = None, reattach_gap: float = None,
+                 shard: tuple = None):
         """
         Constructor of the flight pool.
 
@@ -27,6 +70,26 @@ class CurrentFlights:
         :type session: sqlalchemy.orm.session.Session
         :param adsb_filter: The filter object which will decide if a flight will be tracked or not
         :type adsb_filter: adsb_parser.AdsbMessageFilter
+        :param autocommit: If False, the pool never commits the session itself; commit() must be called by the owner
+        :type autocommit: bool
+        :param rejection_cache: Cache of declined hexidents, to be shared with the parser (see AdsbMessage)
+        :type rejection_cache: adsb_parser.RejectionCache
+        :param clock: Clock to age flights and to time commits: clock.WallClock (default) for live streams,
+            clock.StreamClock for replayed recordings
+        :param writer: Optional writer stage (writer.FlightWriter). If given, the pool submits write intents to the
+            writer instead of adding flights and events to the session, and never commits the session itself
+        :type writer: writer.FlightWriter
+        :param event_bus: Event bus to publish landings and takeoffs to, e.g. to add further subscribers. By default,
+            the pool creates its own, which is closed by close()
+        :type event_bus: events.EventBus
+        :param snapshot: Optional snapshot to restore the flights from and to save them to
+        :type snapshot: snapshot.PoolSnapshot
+        :param reattach_gap: Maximum time [s] since an aircraft was last seen, within which it continues its flight.
+            None (default) starts a new flight for every aircraft admitted to the pool
+        :type reattach_gap: float
+        :param shard: (index, number of shards) of the aircraft tracked by the pool in a sharding.ShardedFlights worker,
+            so that only their recent flights are loaded from the database
+        :type shard: tuple
         """
 
         assert isinstance(session, Session)
@@ -34,11 +97,32 @@ class CurrentFlights:
 
         # Key-value pairs of fight hexident and models.Flight instances
         self._flights = {}
+        # Expiry index of the flights, see class docstring
+        self._expiry = []
+        self._expiry_sequence = itertools.count()
+        # Flights removed from the pool within the reattach gap, by hexident, in order of last seen
+        self._recent_flights = collections.OrderedDict()
+        self._recent_flights_loaded = False
+        self._shard = shard
+        self._reattach_gap = datetime.timedelta(seconds=reattach_gap) if reattach_gap is not None else None
         self._adsb_filter = adsb_filter
+        self._rejection_cache = rejection_cache
         self.__session = session
-        self.__last_session_commit = datetime.datetime.now(datetime.timezone.utc)
-
-        self._landing_and_takeoff_manager = LandingAndTakeoffManager(session)
+        self.__autocommit = autocommit
+        self._clock = clock if clock is not None else WallClock()
+        self._writer = writer
+        self.__last_session_commit = None
+        self._own_event_bus = event_bus is None
+        self._event_bus = EventBus() if event_bus is None else event_bus
+
+        self._landing_and_takeoff_manager = LandingAndTakeoffManager(session, autocommit=autocommit, writer=writer,
+                                                                     event_bus=self._event_bus)
+
+        self._snapshot = snapshot
+        self.__last_snapshot = None
+        if snapshot is not None:
+            self.restore(snapshot.load())
+            self.__last_snapshot = self._clock.now()
 
     def __getitem__(self, hexident: string) -> models.Flight:
         try:
@@ -49,6 +133,8 @@ class CurrentFlights:
 
     def __setitem__(self, key, value):
         assert isinstance(value, models.Flight)
+        if self._flights.get(key) is not value:
+            self._schedule_expiry(value)
         self._flights[key] = value
 
     def __iter__(self):
@@ -58,7 +144,7 @@ class CurrentFlights:
     def __len__(self):
         return len(self._flights.values())
 
-    def update(self, adsb_message: adsb_parser.AdsbMessage):
+    def update(self, adsb_message: adsb_parser.AdsbRecord):
         """
         Updates the flights pool from a ADSb message object and commits to Postgres.
 
@@ -80,41 +166,210 @@ class CurrentFlights:
 
         In both cases, the flight pool is 'pruned' = aged flights are removed.
 
-        :param adsb_message: Instance of adsb_parser.AdsbMessage
+        With a reattach gap, an unknown aircraft last seen within the gap first resumes its flight (see
+        class docstring), which is then updated like in case A.
+
+        If the message is declined, its hexident is added to the rejection cache (if any), so that the parser can
+        drop further messages of this aircraft which cannot lead to its admission.
+
+        :param adsb_message: Instance of adsb_parser.AdsbRecord
         """
+        self._clock.observe(adsb_message.gen_date_time)
+
+        if self._reattach_gap is not None and adsb_message.hexident not in self._flights:
+            self._reattach(adsb_message)
 
         if adsb_message.hexident in self._flights.keys():
-            self[adsb_message.hexident].update(adsb_message)
+            flight = self[adsb_message.hexident]
+            flight.update(adsb_message)
+            if self._writer is not None:
+                self._writer.update_flight(flight.writer_key, flight)
+                self._submit_positions(flight)
 
             self._commit_flights(period=self.DB_COMMIT_PERIOD)
             self.prune()
 
-        elif adsb_message.transmission_type == 2 or (adsb_message.transmission_type == 3 and self._adsb_filter.altitude(
-                adsb_message)):
+        elif admits(adsb_message, self._adsb_filter):
             log.info("New flight spotted: {} Adding to current pool...".format(adsb_message.hexident))
+            if self._rejection_cache is not None:
+                self._rejection_cache.admit(adsb_message.hexident)
 
             self[adsb_message.hexident] = models.Flight(adsb_message.hexident)
 
             log.info(self)  # Print pool contents for info
 
             # Register the manager's callback methods as subscribers to this Flight instance
-            self[adsb_message.hexident].register_on_landing(self._landing_and_takeoff_manager.on_landing_callback)
-            self[adsb_message.hexident].register_on_takeoff(self._landing_and_takeoff_manager.on_takeoff_callback)
+            self._register(self[adsb_message.hexident])
 
             self[adsb_message.hexident] = self[adsb_message.hexident].update(adsb_message)
 
-            self.__session.add(self._flights[adsb_message.hexident])
+            if self._writer is None:
+                self.__session.add(self._flights[adsb_message.hexident])
+            else:
+                flight = self._flights[adsb_message.hexident]
+                flight.writer_key = self._writer.new_flight(flight)
+                self._submit_positions(flight)
 
             self._commit_flights(period=self.DB_COMMIT_PERIOD)  # Immediate commit
             self.prune()
 
+        elif self._rejection_cache is not None:
+            self._rejection_cache.reject(adsb_message.hexident)
+
+    def update_batch(self, batch: list):
+        """Updates the flights pool from a batch of ADSb messages, in order. See update()."""
+        update = self.update
+        for adsb_message in batch:
+            update(adsb_message)
+        self._save_snapshot(period=True)
+
+    def restore(self, states: list) -> int:
+        """
+        Resume the flights of a previous run from their states (see models.Flight.get_state()).
+
+        The flights continue on their existing rows. Flights without a row, aged in the meantime or already in the
+        pool are skipped.
+
+        :param states: Flight states, e.g. of snapshot.PoolSnapshot.load()
+        :return: Number of restored flights
+        """
+        _now = self._clock.now()
+        _max_age = datetime.timedelta(seconds=self.MAX_AGE)
+        count = 0
+        for state in states:
+            flight = models.Flight.from_state(state)
+            if flight.id is None or flight.hexident in self._flights or flight.age_at(_now) > _max_age:
+                continue
+
+            self._register(flight)
+            self._resume(flight)
+            count += 1
+
+        log.info("Restored {} of {} flights from snapshot".format(count, len(states)))
+        return count
+
+    def get_states(self) -> list:
+        """Return the states of the flights with a database row, see restore()."""
+        states = []
+        for flight in self._flights.values():
+            state = flight.get_state()
+            if self._writer is not None:
+                state['id'] = self._writer.flight_id(flight.writer_key)
+            if state['id'] is not None:
+                states.append(state)
+        return states
+
     def prune(self):
-        """Remove all flights from the pool which are older than MAX_AGE."""
-        _aged__flights = list(filter(lambda f: f.age > datetime.timedelta(seconds=self.MAX_AGE),
-                                     self._flights.values()))
-        for f in _aged__flights:
+        """Remove all flights from the pool which are older than MAX_AGE (in the time of the pool's clock)."""
+        _expiry = self._expiry
+        if not _expiry:
+            return
+        _now = self._clock.now()
+        _max_age = datetime.timedelta(seconds=self.MAX_AGE)
+        while _expiry and _expiry[0][0] < _now:
+            _, _, f = heapq.heappop(_expiry)
+            if self._flights.get(f.hexident) is not f:
+                continue  # Removed, or replaced by a new flight of the same aircraft with its own entry
+            if f.last_seen is None or f.age_at(_now) <= _max_age:
+                self._schedule_expiry(f)  # Seen since the entry was pushed
+                continue
+
             log.info("Removing aged flight {} from current flight pool.".format(f.hexident))
             del self._flights[f.hexident]
+            if self._reattach_gap is not None:
+                self._remember(f, _now)
+            if self._writer is not None:
+                self._writer.close_flight(f.writer_key)
+
+    def _remember(self, flight: models.Flight, now: datetime.datetime):
+        """Keep a removed flight with a database row in the recent flights, and evict flights older than the gap."""
+        if self._writer is not None:
+            flight.id = self._writer.flight_id(flight.writer_key)
+        if flight.id is not None:
+            self._recent_flights.pop(flight.hexident, None)
+            self._recent_flights[flight.hexident] = flight
+
+        _recent_flights = self._recent_flights
+        while _recent_flights and now - next(iter(_recent_flights.values())).last_seen > self._reattach_gap:
+            _recent_flights.popitem(last=False)
+
+    def _reattach(self, adsb_message: adsb_parser.AdsbRecord):
+        """Resume the flight of an unknown aircraft last seen within the reattach gap, if any."""
+        if not self._recent_flights_loaded:
+            self._load_recent_flights(adsb_message.gen_date_time)
+
+        flight = self._recent_flights.pop(adsb_message.hexident, None)
+        if flight is None or adsb_message.gen_date_time - flight.last_seen > self._reattach_gap:
+            return
+
+        log.info("Flight {} reappeared after {}, continuing flight {}".format(
+            flight.hexident, adsb_message.gen_date_time - flight.last_seen, flight.id))
+        self._resume(flight)
+
+    def _load_recent_flights(self, now: datetime.datetime):
+        """Seed the recent flights with the last flight of each aircraft in the database seen within the gap."""
+        Flight = models.Flight
+        rows = self.__session.query(Flight.id, Flight.hexident, Flight.callsign, Flight.first_seen, Flight.last_seen,
+                                    Flight.intention) \
+            .filter(Flight.last_seen >= now - self._reattach_gap) \
+            .order_by(Flight.last_seen).all()
+        if self._writer is not None:
+            self.__session.rollback()  # The session holds no changes, end the transaction of the query
+        self._recent_flights_loaded = True
+
+        for row in rows:
+            if row.hexident in self._flights:
+                continue  # Restored from the snapshot
+            if self._shard is not None and shard_of(row.hexident, self._shard[1]) != self._shard[0]:
+                continue  # Tracked by another shard worker
+            flight = Flight.from_row(row.id, row.hexident, row.callsign, row.first_seen, row.last_seen, row.intention)
+            self._register(flight)
+            # In order of last seen, the last flight of an aircraft wins
+            self._recent_flights.pop(row.hexident, None)
+            self._recent_flights[row.hexident] = flight
+        log.info("Loaded {} flights last seen within the reattach gap".format(len(self._recent_flights)))
+
+    def _resume(self, flight: models.Flight):
+        """Add a flight of a previous pass or run to the pool, continuing its row."""
+        if self._writer is None:
+            self.__session.add(flight)
+        else:
+            flight.writer_key = self._writer.resume_flight(flight.id)
+        if self._rejection_cache is not None:
+            self._rejection_cache.admit(flight.hexident)
+        self[flight.hexident] = flight
+
+    def _register(self, flight: models.Flight):
+        """Register the landing and takeoff callbacks of the pool's manager on a flight."""
+        flight.register_on_landing(self._landing_and_takeoff_manager.on_landing_callback)
+        flight.register_on_takeoff(self._landing_and_takeoff_manager.on_takeoff_callback)
+
+    def _save_snapshot(self, period: bool = False):
+        """Save the flights to the snapshot (if any), or with period=True only if the snapshot period has passed."""
+        if self._snapshot is None:
+            return
+
+        _now = self._clock.now()
+        if not period or _now > self.__last_snapshot + datetime.timedelta(seconds=self._snapshot.period):
+            self._snapshot.save(self.get_states())
+            self.__last_snapshot = _now
+
+    def _submit_positions(self, flight: models.Flight):
+        """Hand the new positions of a flight over to the writer stage and release them from memory."""
+        if flight.positions:
+            self._writer.new_positions(flight.writer_key, list(flight.positions))
+            flight.release_positions()
+
+    def _release_positions(self):
+        """Release the committed positions of all flights from memory and from the session."""
+        for flight in self._flights.values():
+            flight.release_positions()
+
+    def _schedule_expiry(self, flight: models.Flight):
+        """Push an entry of a flight to the expiry index; A flight not seen yet is checked at the next prune."""
+        deadline = flight.last_seen + datetime.timedelta(seconds=self.MAX_AGE) if flight.last_seen is not None \
+            else self._clock.now()
+        heapq.heappush(self._expiry, (deadline, next(self._expiry_sequence), flight))
 
     def _commit_flights(self, period: int = None):
         """
@@ -123,12 +378,62 @@ class CurrentFlights:
         If period==None, the commit is performed immediately.
         If an integer is provided as a commit period (in seconds), the commit is delayed by this amount relative to
         the time value saved in the instance attribute __last_session_commit.
+        Does nothing if the pool was constructed with autocommit=False or with a writer stage.
         """
-        _now = datetime.datetime.now(datetime.timezone.utc)
+        if not self.__autocommit or self._writer is not None:
+            return
 
-        if period is None or _now > self.__last_session_commit + datetime.timedelta(seconds=self.DB_COMMIT_PERIOD):
+        _now = self._clock.now()
+
+        if period is None or self.__last_session_commit is None or \
+                _now > self.__last_session_commit + datetime.timedelta(seconds=self.DB_COMMIT_PERIOD):
+            self._landing_and_takeoff_manager.add_pending_events()
             self.__session.commit()
             self.__last_session_commit = _now
+            self._release_positions()
+
+    @property
+    def clock(self):
+        """Clock of the pool, see dump1090_postgis.clock."""
+        return self._clock
+
+    @property
+    def event_bus(self) -> EventBus:
+        """Event bus of the landings and takeoffs of the pool."""
+        return self._event_bus
+
+    @property
+    def snapshot(self) -> PoolSnapshot:
+        """Snapshot of the pool, or None."""
+        return self._snapshot
+
+    @property
+    def rejection_cache(self) -> adsb_parser.RejectionCache:
+        """Cache of hexidents declined by the pool, or None."""
+        return self._rejection_cache
+
+    def commit(self):
+        """Commit the session immediately. To be called by the owner of a pool constructed with autocommit=False."""
+        self._landing_and_takeoff_manager.add_pending_events()
+        self.__session.commit()
+        self.__last_session_commit = self._clock.now()
+        self._release_positions()
+        self._save_snapshot(period=True)
+
+    def close(self):
+        """
+        Wait until the events published so far are handled, and the writer stage (if any) wrote all intents.
+
+        Without a writer stage, the events attributed since the last commit are committed. Then the flights are saved
+        to the snapshot, if any.
+        """
+        if self._own_event_bus:
+            self._event_bus.close()
+        if self._writer is not None:
+            self._writer.close()
+        elif self._landing_and_takeoff_manager.add_pending_events():
+            self.__session.commit()
+        self._save_snapshot()
 
     def __repr__(self):
         return "Current flight pool contains {} fights: {}".format(len(self), ', '.join(self.hexidents()))
@@ -141,18 +446,68 @@ class LandingAndTakeoffManager:
     """Class providing callback methods which add Landing or Takeoff instances to SQL session.
 
     Provide these callbacks as argument to models.Flight.register_on_landing().
+    The events are attributed to the runways of the airports set by use_airports() (default: Nantes Atlantique).
+
+    With an event bus, the callbacks only publish the events together with a copy of the position and the current track
+    of the flight. They are attributed by the manager's subscriber thread, which submits them to the writer stage or, as
+    the session must only be used by its owner, keeps them until the owner adds them to the session with
+    add_pending_events().
     """
-    _airports = [nte_airport]
+    _runways = RunwayIndex([nte_airport])
 
-    def __init__(self, session):
+    def __init__(self, session, autocommit: bool = True, writer=None, event_bus: EventBus = None):
         """Construct by providing the current SQL session.
 
         :param session: A DB connection instance.
         :type session: sqlalchemy.orm.session.Session
+        :param autocommit: If False, events are only added to the session and committed by the session owner
+        :type autocommit: bool
+        :param writer: Optional writer stage, to submit the events to instead of the session
+        :type writer: writer.FlightWriter
+        :param event_bus: Optional event bus, to handle the events in a subscriber thread
+        :type event_bus: events.EventBus
         """
         self.__session = session
-
-    def _callback(self, position: models.Position, flight: models.Flight, event_type):
+        self.__autocommit = autocommit
+        self.__writer = writer
+        self.__event_bus = event_bus
+        # Attributed events to be added to the session by its owner, see add_pending_events()
+        self._pending_events = collections.deque()
+        if event_bus is not None:
+            event_bus.subscribe('runways', self._on_event, (LANDING, TAKEOFF))
+
+    def add_pending_events(self) -> int:
+        """Add the events attributed by the subscriber thread to the session. Returns the number of events."""
+        count = 0
+        while self._pending_events:
+            event_type, flight, position, runway = self._pending_events.popleft()
+            self.__session.add(event_type(flight, position, runway))
+            self._log_event(event_type, flight, position, runway)
+            count += 1
+        return count
+
+    def _publish(self, topic: str, position: models.Position, flight: models.Flight):
+        """Publish an event with a copy of the position, which remains valid when the session expires the original."""
+        lon, lat, alt = position.xyz
+        snapshot = models.Position(time=position.time, lon=lon, lat=lat, alt=alt, onground=position.onground)
+        self.__event_bus.publish(topic, snapshot, flight, flight.interpolated_track)
+
+    def _on_event(self, topic: str, position: models.Position, flight: models.Flight, track: float):
+        """Subscriber of the event bus."""
+        self._callback(position, flight, models.Landings if topic == LANDING else models.Takeoffs, track=track)
+
+    @staticmethod
+    def _log_event(event_type, flight: models.Flight, position: models.Position, runway):
+        log.info("{}: Flight {} ({}) just {} on runway {}!".format(position.time,
+                                                                  flight.callsign,
+                                                                  flight.hexident,
+                                                              'landed' if issubclass(event_type, models.Landings)
+                                                                  else
+                                                              'took off',
+                                                              runway.name)
+                 )
+
+    def _callback(self, position: models.Position, flight: models.Flight, event_type, track: float = None):
         """Adds Landing or Takeoff instance to SQL session if touchdown or takoff event was identified.
 
         If the airports.Airport.get_runway() method identifies a touchdown or takeoff from the flight's last
@@ -165,34 +520,61 @@ class LandingAndTakeoffManager:
         :type flight: models.Flight
         :param event_type: Instance of Landing or Takeoff event
         :type event_type: models.Landings or models.Takeoffs
+        :param track: Track of the flight at the event, by default its current interpolated track
         """
 
         assert isinstance(position, models.Position)
         assert isinstance(flight, models.Flight)
         assert issubclass(event_type, (models.Landings, models.Takeoffs))
 
-        for airport in LandingAndTakeoffManager._airports:
-            runway = airport.get_runway(position.point, flight.interpolated_track)
-            if runway:
+        runway = self.runway(position, flight, track=track)
+        if runway:
+            if self.__writer is not None:
+                self.__writer.event(flight.writer_key, event_type, position.time, runway.name)
+            elif self.__event_bus is not None:
+                # Flight attributes are only read by the owner of the session, see add_pending_events()
+                self._pending_events.append((event_type, flight, position, runway))
+                return
+            else:
                 self.__session.add(event_type(flight, position, runway))
-                log.info("{}: Flight {} ({}) just {} on runway {}!".format(position.time,
-                                                                      flight.callsign,
-                                                                      flight.hexident,
-                                                                  'landed' if issubclass(event_type, models.Landings)
-                                                                      else
-                                                                  'took off',
-                                                                  runway.name)
-                         )
+            self._log_event(event_type, flight, position, runway)
+            if self.__autocommit and self.__writer is None and self.__event_bus is None:
                 self.__session.commit()
-                break
+
+    @classmethod
+    def use_airports(cls, airports: list):
+        """Attribute the landings and takeoffs of all managers of this process to the runways of these airports.
+
+        :param airports: airports.Airport instances, e.g. from airports.load_airports()
+        """
+        cls._runways = RunwayIndex(airports)
+        log.info("Attributing landings and takeoffs to {} runways of {} airports".format(len(cls._runways),
+                                                                                      len(airports)))
+
+    @classmethod
+    def runway(cls, position: models.Position, flight: models.Flight, track: float = None):
+        """Return the runway which attributes the landing or takeoff at position, or None.
+
+        :param position: Position at which the onground status of the flight flipped
+        :param flight: Flight instance to which the position belongs
+        :param track: Track of the flight at position, by default its current interpolated track
+        :rtype: airports.Runway
+        """
+        return cls._runways.get_runway(position.point, track if track is not None else flight.interpolated_track)
 
     def on_landing_callback(self, position, flight):
         """Adds a models.Landings instance to SQL session if the landing can be attributed to a runway."""
-        self._callback(position, flight, models.Landings)
+        if self.__event_bus is not None:
+            self._publish(LANDING, position, flight)
+        else:
+            self._callback(position, flight, models.Landings)
 
     def on_takeoff_callback(self, position, flight):
         """Adds a models.Takeoff instance to SQL session if the takeoff can be attributed to a runway."""
-        self._callback(position, flight, models.Takeoffs)
+        if self.__event_bus is not None:
+            self._publish(TAKEOFF, position, flight)
+        else:
+            self._callback(position, flight, models.Takeoffs)
 
 
 if __name__ == '__main__':
@@ -1,3 +1,4 @@
+import collections
 import datetime
 import enum
 import logging
@@ -5,17 +6,19 @@ import string
 import time
 
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import types, Column, Integer, Float, String, TIMESTAMP, BOOLEAN, ForeignKey, BigInteger, Enum
-from sqlalchemy.orm import relationship, backref
+from sqlalchemy import event, types, Column, Integer, Float, String, TIMESTAMP, BOOLEAN, ForeignKey, BigInteger, Enum
+from sqlalchemy.orm import relationship, backref, make_transient_to_detached, object_session
+from sqlalchemy.orm.attributes import set_committed_value
 from geoalchemy2 import Geometry
 # https://geoalchemy-2.readthedocs.io/en/latest/shape.html
-from geoalchemy2.shape import from_shape, to_shape
+from geoalchemy2.shape import to_shape
 from shapely.geometry import Point
 from shapely import speedups
 
 from db import session
 from dump1090_postgis import adsb_parser
 from dump1090_postgis.airports import Runway
+from dump1090_postgis.bulk import ewkt_point
 from dump1090_postgis.shared import feet2m, interpolate_track
 
 
@@ -59,33 +62,63 @@ class Position(Base):
     track = Column(Integer)
     onground = Column(BOOLEAN, default=False)
 
+    # Coordinates (lon, lat, alt) as floats. The geometry of a new position is rendered when it is inserted (see
+    # _render_coordinates), the geometry of a position loaded from the database is decoded on first access.
+    _xyz = None
+
+    def __init__(self, lon: float = None, lat: float = None, alt: float = None, **kwargs):
+        """
+        :param lon: Longitude
+        :param lat: Latitude
+        :param alt: Altitude [m]
+        Further keyword arguments set the columns, like the default constructor.
+        """
+        super().__init__(**kwargs)
+        if lon is not None:
+            self._xyz = (lon, lat, alt)
+
     def __str__(self):
         return "Position {id} of flight {flight_id} at {time}: {coordinates} (onground={onground})".format(
             id=self.id,
             flight_id = self.flight_id,
             time = self.time,
-            coordinates = to_shape(self.coordinates).coords[:],
+            coordinates = self.xyz,
             onground = self.onground
             )
 
+    @property
+    def xyz(self) -> tuple:
+        """Coordinates (lon, lat, alt)"""
+        if self._xyz is None:
+            self._xyz = to_shape(self.coordinates).coords[0]
+        return self._xyz
+
     @property
     def lon(self):
         """Longitude"""
-        return to_shape(self.coordinates).coords[:][0][0]
+        return self.xyz[0]
 
     @property
     def lat(self):
         """Latitude"""
-        return to_shape(self.coordinates).coords[:][0][1]
+        return self.xyz[1]
 
     @property
     def alt(self):
         """Altitude [m]"""
-        return to_shape(self.coordinates).coords[:][0][2]
+        return self.xyz[2]
 
     @property
     def point(self):
-        return to_shape(self.coordinates)
+        """Shapely point of the coordinates, built on each access."""
+        return Point(self.xyz)
+
+
+@event.listens_for(Position, 'before_insert')
+def _render_coordinates(mapper, connection, position: Position):
+    """Render the geometry of a new position as EWKT, which the database parses on insert (ST_GeomFromEWKT)."""
+    if position.coordinates is None and position._xyz is not None:
+        position.coordinates = ewkt_point(*position._xyz, srid=SRID)
 
 
 class Flight(Base):
@@ -107,6 +140,12 @@ class Flight(Base):
                                        passive_deletes=True,
                                        order_by="asc(Position.time)")
 
+    # Number of the most recent positions kept in memory for the flight logic, see release_positions()
+    POSITION_WINDOW = 16
+    # Number of the most recent positions to interpolate the track from, and the weight of the reported track (MSG 4)
+    TRACK_WINDOW = 4
+    REPORTED_TRACK_WEIGHT = 0.5
+
     def __init__(self, hexident: string):
         self.hexident = hexident
         self.squawk = None
@@ -118,7 +157,14 @@ class Flight(Base):
         self._on_takeoff_subscribers = []
 
         self._onground = None
-        self._last_event = datetime.datetime.now(datetime.timezone.utc)
+        # Track reported by the aircraft (MSG 4) [compass deg]
+        self.track = None
+        # The last POSITION_WINDOW positions, also after older positions were released from self.positions
+        self.recent_positions = collections.deque(maxlen=self.POSITION_WINDOW)
+        # Key of the flight in the writer stage of the flights pool, if any (see writer.FlightWriter)
+        self.writer_key = None
+        # Time of the last landing or takeoff event, initialized with the time of the first message
+        self._last_event = None
 
     def __str__(self):
         return "Flight {hexident}: last seen: {last_seen}".format(**self.__dict__)
@@ -126,20 +172,25 @@ class Flight(Base):
     @property
     def age(self) -> datetime.timedelta:
         """
-        Computes the age in seconds since last seen.
+        Computes the age in seconds since last seen, relative to the system time.
         :return: Age in seconds since last seen
         """
-        return datetime.datetime.now(datetime.timezone.utc) - self.last_seen
+        return self.age_at(datetime.datetime.now(datetime.timezone.utc))
+
+    def age_at(self, now: datetime.datetime) -> datetime.timedelta:
+        """
+        Computes the age since last seen, relative to the time 'now' of a clock (see dump1090_postgis.clock).
+        :return: Age since last seen
+        """
+        return now - self.last_seen
 
     @property
     def interpolated_track(self):
-        """Compute flight heading from last known 2 positions."""
-        if len(self.positions) >= 2:
-            return interpolate_track(self.positions[-2:])
-        else:
-            return None
+        """Compute flight heading from the last TRACK_WINDOW positions, fused with the reported track (if any)."""
+        positions = list(self.recent_positions)[-self.TRACK_WINDOW:]
+        return interpolate_track(positions, reported_track=self.track, reported_weight=self.REPORTED_TRACK_WEIGHT)
 
-    def update(self, adsb: adsb_parser.AdsbMessage):
+    def update(self, adsb: adsb_parser.AdsbRecord):
         """
         Updates the instance attributes with values from an ADSb message object and returns.
 
@@ -153,7 +204,7 @@ class Flight(Base):
         - 7: altitude
         - 8: onground
 
-        :param adsb: Instance of AdsbMessage
+        :param adsb: Instance of AdsbRecord
         :returns Updated version of self
         """
 
@@ -175,6 +226,8 @@ class Flight(Base):
 
         if not self.first_seen:
             self.first_seen = adsb.gen_date_time
+        if self._last_event is None:
+            self._last_event = adsb.gen_date_time
 
         # Note: last_seen timestamp gets updated from any MSG type, regardless whether the message content will be used
         # to update the object attributes or not.
@@ -194,11 +247,10 @@ class Flight(Base):
         if adsb.transmission_type == 3:
             if adsb.longitude is not None and adsb.latitude is not None and adsb.altitude is not None:
                 position = Position(time=adsb.gen_date_time,
-                                    coordinates=from_shape(
-                                        Point(adsb.longitude, adsb.latitude, feet2m(adsb.altitude)),
-                                        srid=SRID),
+                                    lon=adsb.longitude, lat=adsb.latitude, alt=feet2m(adsb.altitude),
                                     onground=adsb.onground)
                 self.positions.append(position)
+                self.recent_positions.append(position)
                 self.update_onground(adsb.onground)
 
             else:
@@ -206,15 +258,89 @@ class Flight(Base):
         # First MSG2 of aircraft at terminal does not contain coordinates, only 'onground'
         # Also, the altitude is not included in MSG2, and is being set here to GND_ALTITUDE (0m AGL)
         elif adsb.transmission_type == 2 and adsb.longitude is not None and adsb.latitude is not None:
-            self.positions.append(Position(time=adsb.gen_date_time,
-                                           coordinates=from_shape(Point(adsb.longitude, adsb.latitude, GND_ALTITUDE),
-                                                                  srid=SRID),
-                                           onground=adsb.onground)
-                                  )
+            position = Position(time=adsb.gen_date_time, lon=adsb.longitude, lat=adsb.latitude, alt=GND_ALTITUDE,
+                                onground=adsb.onground)
+            self.positions.append(position)
+            self.recent_positions.append(position)
             self.update_onground(adsb.onground)
 
         return self
 
+    def release_positions(self) -> int:
+        """
+        Release the positions of this flight from memory, after they were committed or handed over to a writer stage.
+
+        The positions are expunged from their session and the positions collection is emptied without marking it as
+        changed, so neither the flight nor the session keep them. Only recent_positions remain for the flight logic.
+        New positions are appended to the emptied collection and persisted as before.
+
+        :return: Number of released positions
+        """
+        released = list(self.positions)
+        for position in released:
+            session = object_session(position)
+            if session is not None:
+                session.expunge(position)
+        set_committed_value(self, 'positions', [])
+        return len(released)
+
+    def get_state(self) -> dict:
+        """
+        Return the state of this flight as JSON-serializable dict, to resume it after a restart (see from_state()).
+
+        The state holds the columns of the flight row, the onground status, the reported track, the time of the last
+        landing or takeoff, and the recent positions as lists [time, lon, lat, alt, onground].
+        """
+        return {'id': self.id,
+                'hexident': self.hexident,
+                'callsign': self.callsign,
+                'first_seen': _isoformat(self.first_seen),
+                'last_seen': _isoformat(self.last_seen),
+                'intention': self.intention.name if self.intention is not None else None,
+                'onground': self._onground,
+                'track': self.track,
+                'last_event': _isoformat(self._last_event),
+                'positions': [[position.time.isoformat(), *position.xyz, position.onground]
+                              for position in self.recent_positions]}
+
+    @classmethod
+    def from_row(cls, flight_id: int, hexident: str, callsign: str, first_seen: datetime.datetime,
+                 last_seen: datetime.datetime, intention: Intention) -> 'Flight':
+        """
+        Construct a flight continuing its existing row, from the values of its columns.
+
+        The flight is detached, as if it was loaded by a query which did not load its positions: Added to a session,
+        it's updated instead of inserted, and new positions are appended to its row. Its onground status is unknown.
+        """
+        flight = cls(hexident)
+        flight.id = flight_id
+        flight.callsign = callsign
+        flight.first_seen = first_seen
+        flight.last_seen = last_seen
+        flight.intention = intention
+        if flight_id is not None:
+            make_transient_to_detached(flight)
+            set_committed_value(flight, 'positions', [])
+        return flight
+
+    @classmethod
+    def from_state(cls, state: dict) -> 'Flight':
+        """
+        Construct a flight from its state returned by get_state(), continuing its row (see from_row()).
+
+        :param state: State of the flight
+        """
+        flight = cls.from_row(state['id'], state['hexident'], state['callsign'], _fromisoformat(state['first_seen']),
+                              _fromisoformat(state['last_seen']),
+                              Intention[state['intention']] if state['intention'] is not None else None)
+        flight._onground = state['onground']
+        flight.track = state['track']
+        flight._last_event = _fromisoformat(state['last_event'])
+        for position_time, lon, lat, alt, onground in state['positions']:
+            flight.recent_positions.append(Position(time=_fromisoformat(position_time), lon=lon, lat=lat, alt=alt,
+                                                    onground=onground))
+        return flight
+
     def update_onground(self, onground):
         """Flip the onground attribute of this flight and broadcast event."""
 
@@ -222,10 +348,10 @@ class Flight(Base):
             self._onground = onground
         elif self._onground and self._onground != onground:  # takeoff
             self._onground = onground
-            self._broadcast_takeoff(self.positions[-1])
+            self._broadcast_takeoff(self.recent_positions[-1])
         elif not self._onground and self._onground != onground:  # landing
             self._onground = onground
-            self._broadcast_landing(self.positions[-1])
+            self._broadcast_landing(self.recent_positions[-1])
 
     def register_on_landing(self, subscriber):
         """Register an on-landing subscriber."""
@@ -270,6 +396,15 @@ class Flight(Base):
         return valid
 
 
+
+def _isoformat(timestamp: datetime.datetime):
+    return timestamp.isoformat() if timestamp is not None else None
+
+
+def _fromisoformat(timestamp: str):
+    return datetime.datetime.fromisoformat(timestamp) if timestamp is not None else None
+
+
 class Landings(Base):
     __tablename__ = 'landings'
     id = Column(Integer, primary_key=True)
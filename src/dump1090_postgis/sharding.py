@@ -0,0 +1,147 @@
+"""
+Flight tracking sharded by hexident across worker processes.
+
+ShardedFlights stands in for CurrentFlights in the AdsbLogger, whose main thread becomes the router: Each batch of
+parsed messages is split by shard_of(hexident) and the sub-batches are sent through pipes (multiprocessing queues) to
+the worker processes. Each worker owns the flights of its shard in its own CurrentFlights pool and database session,
+created by a pool factory. All messages of an aircraft reach the same worker in order, so flights, landings and
+takeoffs are tracked exactly like in a single pool.
+"""
+import logging
+import multiprocessing
+import queue
+import signal
+
+log = logging.getLogger(__name__)
+
+
+def shard_of(hexident: str, shards: int) -> int:
+    """Return the shard of an aircraft: Its ICAO address modulo the number of shards."""
+    try:
+        return int(hexident, 16) % shards
+    except ValueError:
+        return 0
+
+
+def _shard_worker(index: int, shards: int, inbox, results, pool_factory):
+    """
+    Worker process tracking the flights of one shard until it receives None.
+
+    :param index: Index of the shard
+    :param shards: Number of shards
+    :param inbox: Queue of message batches
+    :param results: Queue to report (index, number of flights in the pool) when finished
+    :param pool_factory: Picklable callable pool_factory(index, shards) returning the flights pool of this process
+    """
+    # The router stops the workers after the last batch; Signals to the process group must not interrupt a batch
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+    flights_pool = pool_factory(index, shards)
+    log.info("Shard {} started".format(index))
+    while True:
+        batch = inbox.get()
+        if batch is None:
+            break
+        flights_pool.update_batch(batch)
+
+    flights_pool.close()
+    log.info("Shard {} finished with {} flights in pool".format(index, len(flights_pool)))
+    results.put((index, len(flights_pool)))
+
+
+class ShardedFlights:
+    """
+    Flights pool facade routing messages to 'shards' worker processes, see module docstring.
+
+    The workers are started on construction and stopped by close(), after which len() returns the total number of
+    flights left in the pools. The queue of each worker holds QSIZE batches; A slow worker blocks the router, and with
+    it the AdsbLogger main loop, while the receiver thread keeps reading into the logger's queue. A dead worker raises
+    RuntimeError in the router on the next batch of its shard, instead of blocking it forever.
+
+    :param shards: Number of worker processes
+    :param pool_factory: Picklable callable (e.g. a module-level function) returning the flights pool of a worker,
+        called with the index of its shard and the number of shards
+    """
+
+    QSIZE = 200
+    PUT_TIMEOUT = 1.0
+
+    def __init__(self, shards: int, pool_factory):
+        if shards < 1:
+            raise ValueError("Number of shards must be positive, got {}".format(shards))
+        self._shards = shards
+        self._sizes = [0] * shards
+
+        # Spawn instead of fork: The workers must not inherit the database connection and threads of the router
+        context = multiprocessing.get_context('spawn')
+        self._inboxes = [context.Queue(maxsize=self.QSIZE) for _ in range(shards)]
+        self._results = context.Queue()
+        self._workers = [context.Process(target=_shard_worker, args=(index, shards, inbox, self._results, pool_factory),
+                                         name='shard-{}'.format(index), daemon=True)
+                         for index, inbox in enumerate(self._inboxes)]
+        for worker in self._workers:
+            worker.start()
+        log.info("Started {} shard worker processes".format(shards))
+
+    def __len__(self):
+        return sum(self._sizes)
+
+    @property
+    def shards(self) -> int:
+        return self._shards
+
+    @property
+    def rejection_cache(self):
+        """The aircraft are admitted in the workers, so the parser of the router cannot drop declined aircraft."""
+        return None
+
+    def update(self, adsb_message):
+        """Route a single message to its shard."""
+        self._send(shard_of(adsb_message.hexident, self._shards), [adsb_message])
+
+    def update_batch(self, batch: list):
+        """Split a batch of messages by shard and send the sub-batches to the workers, keeping the message order."""
+        sub_batches = [[] for _ in range(self._shards)]
+        for msg in batch:
+            sub_batches[shard_of(msg.hexident, self._shards)].append(msg)
+
+        for index, sub_batch in enumerate(sub_batches):
+            if sub_batch:
+                self._send(index, sub_batch)
+
+    def _send(self, index: int, batch):
+        """Put a batch into the queue of a worker, waiting while it's full; Raises RuntimeError if the worker died."""
+        worker = self._workers[index]
+        while True:
+            if not worker.is_alive():
+                raise RuntimeError("Shard worker {} died with exit code {}".format(index, worker.exitcode))
+            try:
+                self._inboxes[index].put(batch, timeout=self.PUT_TIMEOUT)
+                return
+            except queue.Full:
+                log.warning("Queue of shard worker {} full for {}s".format(index, self.PUT_TIMEOUT))
+
+    def close(self):
+        """Stop the workers after they processed all batches, and collect their pool sizes."""
+        for index in range(self._shards):
+            try:
+                self._send(index, None)
+            except RuntimeError:
+                pass  # Reported below
+
+        pending = set(range(self._shards))
+        while pending:
+            try:
+                index, size = self._results.get(timeout=1)
+            except queue.Empty:
+                for index in [index for index in pending if not self._workers[index].is_alive()]:
+                    log.error("Shard worker {} died with exit code {}".format(index, self._workers[index].exitcode))
+                    pending.discard(index)
+                continue
+            self._sizes[index] = size
+            pending.discard(index)
+
+        for worker in self._workers:
+            worker.join()
+        log.info("All shard worker processes finished")
@@ -1,5 +1,17 @@
+import math
+
 import numpy as np
-from shapely.geometry import LineString, Point
+
+
+EARTH_RADIUS = 6371000.0  # [m]
+
+
+def haversine(lon1: float, lat1: float, lon2: float, lat2: float) -> float:
+    """Great circle distance [m] between two points given in degrees."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = math.sin((phi2 - phi1) / 2) ** 2 + \
+        math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
 
 
 def feet2m(ft):
@@ -33,18 +45,107 @@ def angle2compass(deg):
     return (450 - deg) % 360
 
 
-def interpolate_track(positions: iter):
+def heading_difference(a: float, b: float) -> float:
+    """Smallest absolute difference of two compass directions [deg], in [0, 180]."""
+    return abs((a - b + 180.0) % 360.0 - 180.0)
+
+
+def fuse_track(track: float, reported_track: float, weight: float) -> float:
+    """Weighted circular mean of an estimated track and the track reported by the aircraft [compass deg].
+
+    :param weight: Weight of the reported track, between 0 (estimated track only) and 1 (reported track only)
+    """
+    a, b = math.radians(track), math.radians(reported_track)
+    east = (1.0 - weight) * math.sin(a) + weight * math.sin(b)
+    north = (1.0 - weight) * math.cos(a) + weight * math.cos(b)
+    return math.degrees(math.atan2(east, north)) % 360.0
+
+
+def interpolate_track(positions: iter, reported_track: float = None, reported_weight: float = 0.0):
     """Compute flight heading from a list of two or more aircraft positions.
 
     Expects a list of 2 or more positions, sorted in chronologically ascending order along the flight path. The
-    track heading is computed from the last two points in the list.
+    direction of motion is the least squares fit of the coordinates over the time of the positions, which smoothes
+    the jitter of more than two positions; For two positions it is the direction from the first to the second. The
+    eastward component is scaled by cos(latitude), so that the heading is a true compass direction.
 
-    :param positions: List of Position instances to interpolate the track from
+    Optionally, the estimate is fused with the track reported by the aircraft (ADSb MSG 4), which is returned as is
+    when the positions do not determine a direction.
+
+    :param positions: List of Position instances to interpolate the track from (lon, lat and time are used)
     :type positions: list of models.Position
+    :param reported_track: Track reported by the aircraft [compass deg], or None
+    :param reported_weight: Weight of the reported track, see fuse_track()
+    :return: Track [compass deg], or None
+    """
+    track = None
+    n = len(positions)
+    if n == 2:
+        east, north = positions[1].lon - positions[0].lon, positions[1].lat - positions[0].lat
+    elif n > 2:
+        t0 = positions[0].time
+        times = [(p.time - t0).total_seconds() for p in positions]
+        if max(times) == min(times):
+            times = list(range(n))
+        t_mean = sum(times) / n
+        lon_mean = sum(p.lon for p in positions) / n
+        lat_mean = sum(p.lat for p in positions) / n
+        # Slopes of the fits, up to the common positive factor 1 / sum((t - t_mean)^2)
+        east = sum((t - t_mean) * (p.lon - lon_mean) for t, p in zip(times, positions))
+        north = sum((t - t_mean) * (p.lat - lat_mean) for t, p in zip(times, positions))
+    else:
+        east = north = 0.0
+
+    if east or north:
+        east *= math.cos(math.radians(positions[-1].lat))
+        track = angle2compass(math.degrees(math.atan2(north, east)))
+
+    if track is None or reported_track is None or reported_weight <= 0.0:
+        return track if track is not None else reported_track
+    return fuse_track(track, reported_track, reported_weight)
+
+
+def interpolate_tracks(times, lon, lat, window: int = 2) -> np.ndarray:
+    """Compute the flight heading at each position of a whole flight, e.g. to reprocess historical flights.
+
+    The heading at position i is the least squares track of the positions i - window + 1 ... i, the same as
+    interpolate_track() of these positions.
+
+    :param times: Times of the positions [s], ascending
+    :param lon: Longitudes of the positions
+    :param lat: Latitudes of the positions
+    :param window: Number of positions per fit, at least 2
+    :return: Array of tracks [compass deg]; NaN for the first window - 1 positions and where undetermined
     """
+    if window < 2:
+        raise ValueError("Track window must be at least 2 positions, got {}".format(window))
+    t = np.asarray(times, dtype=float)
+    x = np.asarray(lon, dtype=float)
+    y = np.asarray(lat, dtype=float)
+    tracks = np.full(len(t), np.nan)
+    if len(t) < window:
+        return tracks
+    # Relative values, to limit the cancellation of the sums of products
+    t, x, y = t - t[0], x - x[0], y - y[0]
+
+    def rolling_sum(values):
+        cumsum = np.concatenate(([0.0], np.cumsum(values)))
+        return cumsum[window:] - cumsum[:-window]
 
-    points = np.array(LineString([p.point for p in positions]))
-    rad = np.arctan2(np.diff(points[..., 1]), np.diff(points[..., 0]))
-    deg = np.rad2deg(rad)[-1]  # Take only the heading interpolation of the last 2 positions
+    s_t, s_x, s_y = rolling_sum(t), rolling_sum(x), rolling_sum(y)
+    s_tt, s_tx, s_ty = rolling_sum(t * t), rolling_sum(t * x), rolling_sum(t * y)
+    variance = window * s_tt - s_t * s_t
+    # Without time variance within the window, fit over the index of the positions like interpolate_track()
+    index = np.arange(window, dtype=float)
+    i_mean = index.mean()
+    end = np.arange(window - 1, len(t))
+    east_index = sum((i - i_mean) * x[end - window + 1 + k] for k, i in enumerate(index))
+    north_index = sum((i - i_mean) * y[end - window + 1 + k] for k, i in enumerate(index))
+    timed = variance > 0
+    east = np.where(timed, window * s_tx - s_t * s_x, east_index)
+    north = np.where(timed, window * s_ty - s_t * s_y, north_index)
 
-    return angle2compass(deg)
+    east = east * np.cos(np.radians(np.asarray(lat, dtype=float)[end]))
+    determined = (east != 0) | (north != 0)
+    tracks[end] = np.where(determined, (450.0 - np.degrees(np.arctan2(north, east))) % 360.0, np.nan)
+    return tracks
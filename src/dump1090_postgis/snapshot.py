@@ -0,0 +1,50 @@
+"""
+Snapshots of a flights pool, to resume its flights after a restart.
+
+Without a snapshot, a restarted logger forgets all flights in range: Each aircraft gets a new flight row, and its
+onground status is unknown until the next positions, so that landings and takeoffs around the restart are missed. The
+pool saves the states of its flights (see models.Flight.get_state) periodically and when it's closed, and restores them
+on startup, attached to their existing rows without querying the database (see CurrentFlights).
+"""
+import gzip
+import json
+import logging
+import os
+
+log = logging.getLogger(__name__)
+
+
+class PoolSnapshot:
+    """
+    States of the flights of a pool, saved as gzip-compressed JSON file.
+
+    The file is replaced atomically, so that it's never left half written. An unreadable file is ignored.
+
+    :param path: Path of the file
+    :param period: Time [s] between periodic saves of the pool
+    """
+
+    PERIOD = 60
+
+    def __init__(self, path: str, period: float = PERIOD):
+        self.path = path
+        self.period = period
+
+    def load(self) -> list:
+        """Return the saved flight states, or an empty list if the file does not exist or cannot be read."""
+        if not os.path.exists(self.path):
+            return []
+
+        try:
+            with gzip.open(self.path, 'rt') as f:
+                return json.load(f)['flights']
+        except (OSError, ValueError, KeyError) as err:
+            log.error("Ignoring unreadable flights pool snapshot {}: {}".format(self.path, err))
+            return []
+
+    def save(self, states: list):
+        """Save flight states, replacing the file."""
+        with gzip.open(self.path + '.tmp', 'wt') as f:
+            json.dump({'flights': states}, f, separators=(',', ':'))
+        os.replace(self.path + '.tmp', self.path)
+        log.debug("Saved {} flights to snapshot {}".format(len(states), self.path))
@@ -0,0 +1,185 @@
+"""
+Unbounded FIFO queue between the receiver thread and the flights pool, which spills to disk instead of dropping.
+
+Up to 'maxsize' items are kept in memory. When the consumer falls behind (traffic peak, stalled database), further
+items are appended to segment files on disk. The consumer drains the memory first and then the segments in order of
+writing; When it has caught up, the queue returns to memory. A slow consumer costs latency, but no messages.
+"""
+import collections
+import logging
+import os
+import pickle
+import queue
+import shutil
+import tempfile
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class SpillQueue:
+    """
+    Thread-safe FIFO queue for one producer and one consumer, spilling to disk when 'maxsize' items are in memory.
+
+    Items are pickled into segment files of about 'segment_size' bytes, together with the time they were spilled.
+    Drained segment files are deleted. The producer calls close() after its last item; The consumer then receives
+    CLOSED after all remaining items. A consumer which stops before, calls cleanup() to delete the remaining segment
+    files. The segments are written to a directory of their own, created within 'spill_dir' on the first spill and
+    deleted when the queue is drained after close() or cleaned up, so that several queues can share a 'spill_dir'.
+
+    Metrics: spilled_items and spilled_bytes (totals), lag (time the last item read from disk had spent there) and
+    lag_max.
+
+    :param maxsize: Maximum number of items in memory
+    :param spill_dir: Parent directory of the segment directory; The system's temporary directory if None
+    :param segment_size: Size of a segment file [bytes] before the next one is started
+    """
+
+    CLOSED = object()
+    SEGMENT_SIZE = 16 * 1024 * 1024
+
+    def __init__(self, maxsize: int, spill_dir: str = None, segment_size: int = SEGMENT_SIZE):
+        self._maxsize = maxsize
+        self._spill_dir = spill_dir
+        self._segment_dir = None
+        self._segment_size = segment_size
+
+        self._memory = collections.deque()
+        self._not_empty = threading.Condition(threading.Lock())
+        self._closed = False
+
+        self._segments = collections.deque()  # Paths of the segment files, oldest first
+        self._writer = None  # File of the newest segment
+        self._reader = None  # File of the oldest segment
+        self._segment_count = 0
+        self._on_disk = 0  # Number of items in the segment files
+
+        self.spilled_items = 0
+        self.spilled_bytes = 0
+        self.lag = 0.0
+        self.lag_max = 0.0
+
+    def qsize(self) -> int:
+        """Number of items in memory and on disk."""
+        return len(self._memory) + self._on_disk
+
+    @property
+    def spilling(self) -> bool:
+        """True while items are on disk; New items are appended to disk too, to keep their order."""
+        return self._on_disk > 0
+
+    def put(self, item):
+        """Append an item; Never blocks and never drops, spills to disk if the memory is full."""
+        with self._not_empty:
+            if self._closed:
+                raise ValueError("Put to closed SpillQueue")
+
+            if self._on_disk == 0 and len(self._memory) < self._maxsize:
+                self._memory.append(item)
+            else:
+                if self._on_disk == 0:
+                    log.warning("Queue size limit reached ({}). Spilling messages to disk".format(self._maxsize))
+                self._spill(item)
+            self._not_empty.notify()
+
+    def close(self):
+        """Signal the end of the items to the consumer."""
+        with self._not_empty:
+            self._closed = True
+            self._not_empty.notify()
+
+    def get(self, timeout: float = None):
+        """
+        Remove and return the oldest item, blocking until one is available. Returns CLOSED when closed and empty.
+
+        :param timeout: Maximum time to block [s], None blocks indefinitely
+        :raises queue.Empty: If no item was available within the timeout
+        """
+        with self._not_empty:
+            deadline = time.monotonic() + timeout if timeout is not None else None
+            while not self._memory and not self._on_disk:
+                if self._closed:
+                    self._remove_spill_dir()
+                    return self.CLOSED
+                if deadline is None:
+                    self._not_empty.wait()
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise queue.Empty
+                    self._not_empty.wait(remaining)
+
+            if self._memory:
+                return self._memory.popleft()
+            return self._unspill()
+
+    def cleanup(self):
+        """Discard the remaining items and delete their segment files and the temporary directory; Idempotent."""
+        with self._not_empty:
+            if self._on_disk or self._memory:
+                log.warning("Discarding {} queued items ({} on disk)".format(self.qsize(), self._on_disk))
+            self._memory.clear()
+            self._on_disk = 0
+            self._reset_segments()
+            self._remove_spill_dir()
+
+    def _spill(self, item):
+        if self._writer is None or self._writer.tell() >= self._segment_size:
+            self._start_segment()
+
+        start = self._writer.tell()
+        pickle.dump((time.monotonic(), item), self._writer, protocol=pickle.HIGHEST_PROTOCOL)
+        self._on_disk += 1
+        self.spilled_items += 1
+        self.spilled_bytes += self._writer.tell() - start
+
+    def _start_segment(self):
+        if self._writer is not None:
+            self._writer.close()
+
+        if self._segment_dir is None:
+            self._segment_dir = tempfile.mkdtemp(prefix='dump1090-spill-', dir=self._spill_dir)
+        path = os.path.join(self._segment_dir, 'segment-{:06d}.pickle'.format(self._segment_count))
+        self._segment_count += 1
+        self._writer = open(path, 'w+b')
+        self._segments.append(path)
+
+    def _unspill(self):
+        if self._reader is None:
+            self._reader = open(self._segments[0], 'rb')
+        if self._reader.name == self._writer.name:
+            self._writer.flush()
+
+        try:
+            spilled_at, item = pickle.load(self._reader)
+        except EOFError:
+            # Oldest segment drained; The newest segment is never drained before all its items are read
+            self._reader.close()
+            os.remove(self._segments.popleft())
+            self._reader = None
+            return self._unspill()
+
+        self._on_disk -= 1
+        self.lag = time.monotonic() - spilled_at
+        self.lag_max = max(self.lag_max, self.lag)
+
+        if self._on_disk == 0:
+            self._reset_segments()
+            log.warning("Caught up with spilled messages after {:.1f}s: {} messages, {} bytes spilled so far".format(
+                self.lag, self.spilled_items, self.spilled_bytes))
+        return item
+
+    def _reset_segments(self):
+        """Delete all segment files, when all items were read."""
+        for stream in (self._reader, self._writer):
+            if stream is not None:
+                stream.close()
+        self._reader = self._writer = None
+        while self._segments:
+            os.remove(self._segments.popleft())
+
+    def _remove_spill_dir(self):
+        if self._segment_dir is not None:
+            shutil.rmtree(self._segment_dir, ignore_errors=True)
+            self._segment_dir = None
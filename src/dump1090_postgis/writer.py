@@ -0,0 +1,307 @@
+"""
+Database writer stage, decoupled from the flight-state updates of the flights pool.
+
+Instead of adding flights to an ORM session and committing inline, a flights pool constructed with a FlightWriter
+submits write intents: A new flight (or a flight resumed on its existing row), its new positions, updates of the
+flight row, landings and takeoffs. Intents are snapshots of plain values, so the writer thread never touches the
+Flight instances of the pool.
+
+The writer thread applies the intents with its own database connection and commits them in groups: A group is
+committed when it holds 'max_batch' intents, or 'max_latency' seconds after its oldest intent was submitted. Submitting
+never blocks; Intents exceeding the in-memory queue are spilled to disk (see spill_queue.SpillQueue) while the
+database is slow or unreachable.
+"""
+import itertools
+import logging
+import queue
+import threading
+import time
+from typing import NamedTuple
+
+import psycopg2
+from sqlalchemy import bindparam, text
+from sqlalchemy.exc import InterfaceError, OperationalError, SQLAlchemyError
+
+from dump1090_postgis import bulk, models
+from dump1090_postgis.spill_queue import SpillQueue
+
+log = logging.getLogger(__name__)
+
+
+class NewFlight(NamedTuple):
+    key: int
+    hexident: str
+    callsign: str
+    first_seen: object
+    last_seen: object
+    intention: models.Intention
+
+
+class ResumedFlight(NamedTuple):
+    key: int
+    flight_id: int
+
+
+class FlightUpdate(NamedTuple):
+    key: int
+    callsign: str
+    last_seen: object
+    intention: models.Intention
+
+
+class NewPositions(NamedTuple):
+    key: int
+    positions: list  # Tuples (time, lon, lat, alt, onground)
+
+
+class FlightEvent(NamedTuple):
+    key: int
+    event_type: type  # models.Landings or models.Takeoffs
+    time: object
+    runway: str
+
+
+class FlightClosed(NamedTuple):
+    key: int
+
+
+def _disconnected(err: Exception) -> bool:
+    """True for errors of the connection to the database (e.g. an outage), as opposed to errors of the data."""
+    return isinstance(err, (OperationalError, InterfaceError, psycopg2.OperationalError, psycopg2.InterfaceError)) \
+        or getattr(err, 'connection_invalidated', False)
+
+
+class FlightWriter:
+    """
+    Writer stage of a flights pool, see module docstring.
+
+    Flights are identified by keys handed out by new_flight(), which the writer maps to the ids of their rows. The
+    flight ids are reserved from the sequence of the flights table, so that a whole group of flights and their
+    positions is inserted without a round trip per row. Positions, by far the most rows, are written with a single
+    COPY per group in the order of submission, their geometries rendered as EWKT and constructed by the database.
+
+    A group which fails to commit is retried, with delays doubling from RETRY_DELAY up to RETRY_DELAY_MAX seconds.
+    While the connection to the database is lost, it's retried until the database is back, and the following intents
+    are spilled to disk meanwhile; A group failing with other database errors (e.g. invalid data) is dropped after
+    RETRIES retries. Errors of the COPY are raised by psycopg2 directly, not wrapped by SQLAlchemy. Any other error
+    drops the group at once, and if the writer thread fails outright, it keeps draining the queue and counts all
+    further intents as dropped. Intents of a flight whose new row was dropped are dropped as well, and counted.
+    Commit statistics: Number of commits and intents, commit duration and latency (oldest intent submitted until
+    committed).
+
+    :param engine: SQLAlchemy engine to open the writer's own connection from
+    :param max_batch: Maximum number of intents per commit
+    :param max_latency: Maximum time [s] from submitting an intent until its group is committed
+    :param spill_dir: Directory for intents spilled to disk (default: a temporary directory)
+    """
+
+    MAX_BATCH = 5000
+    MAX_LATENCY = 1.0
+    QSIZE = 100000
+    RETRIES = 3
+    RETRY_DELAY = 1.0
+    RETRY_DELAY_MAX = 30.0
+    FLIGHT_SEQUENCE = 'flights_id_seq'
+    POSITION_COLUMNS = ('flight_id', 'time', 'coordinates', 'onground')
+
+    def __init__(self, engine, max_batch: int = MAX_BATCH, max_latency: float = MAX_LATENCY, spill_dir: str = None):
+        self._engine = engine
+        self._max_batch = max_batch
+        self._max_latency = max_latency
+        self._queue = SpillQueue(maxsize=self.QSIZE, spill_dir=spill_dir)
+        self._keys = itertools.count()
+        self._flight_ids = {}  # Key -> id of the flight row
+
+        self.commits = 0
+        self.intents = 0
+        self.dropped = 0
+        self.commit_duration_max = 0.0
+        self.latency = 0.0
+        self.latency_max = 0.0
+        self._latency_sum = 0.0
+
+        self._thread = threading.Thread(target=self._run, name='flight-writer', daemon=True)
+        self._thread.start()
+
+    def new_flight(self, flight: models.Flight) -> int:
+        """Submit a new flight and return its key."""
+        key = next(self._keys)
+        self._submit(NewFlight(key, flight.hexident, flight.callsign, flight.first_seen, flight.last_seen,
+                               flight.intention or models.Intention.unknown))
+        return key
+
+    def resume_flight(self, flight_id: int) -> int:
+        """Submit a flight continued on its existing row with id flight_id, and return its key."""
+        key = next(self._keys)
+        self._submit(ResumedFlight(key, flight_id))
+        return key
+
+    def flight_id(self, key: int) -> int:
+        """Return the id of the row of a flight once its group is committed, or None. Safe to call from any thread."""
+        return self._flight_ids.get(key)
+
+    def update_flight(self, key: int, flight: models.Flight):
+        """Submit the current callsign, last_seen and intention of a flight; Updates within a group are merged."""
+        self._submit(FlightUpdate(key, flight.callsign, flight.last_seen, flight.intention or models.Intention.unknown))
+
+    def new_positions(self, key: int, positions: list):
+        """Submit new positions (models.Position instances) of a flight."""
+        self._submit(NewPositions(key, [(position.time, *position.xyz, position.onground) for position in positions]))
+
+    def event(self, key: int, event_type, event_time, runway: str):
+        """Submit a landing (event_type models.Landings) or takeoff (models.Takeoffs) of a flight."""
+        self._submit(FlightEvent(key, event_type, event_time, runway))
+
+    def close_flight(self, key: int):
+        """Submit that a flight left the pool, after which its key is not used anymore."""
+        self._submit(FlightClosed(key))
+
+    def close(self):
+        """Commit all intents submitted so far and stop the writer thread."""
+        self._queue.close()
+        self._thread.join()
+        self.log_statistics()
+
+    @property
+    def statistics(self) -> dict:
+        return {'commits': self.commits,
+                'intents': self.intents,
+                'dropped': self.dropped,
+                'commit_duration_max': self.commit_duration_max,
+                'latency_mean': self._latency_sum / self.commits if self.commits else 0.0,
+                'latency_max': self.latency_max}
+
+    def log_statistics(self):
+        log.info("Flight writer: {commits} commits of {intents} intents ({dropped} dropped), "
+                 "commit duration max {commit_duration_max:.3f}s, "
+                 "latency mean {latency_mean:.3f}s max {latency_max:.3f}s".format(**self.statistics))
+
+    def _submit(self, intent):
+        self._queue.put((time.monotonic(), intent))
+
+    def _run(self):
+        """Writer thread: Collect groups of intents and commit them, until the queue is closed."""
+        try:
+            self._write_groups()
+        except Exception:
+            log.exception("Flight writer failed, dropping all further intents")
+            # Drain the queue, so that it doesn't keep spilling to disk until the pool is closed
+            while self._queue.get() is not SpillQueue.CLOSED:
+                self.dropped += 1
+
+    def _write_groups(self):
+        closed = False
+        with self._engine.connect() as connection:
+            while not closed:
+                item = self._queue.get()
+                if item is SpillQueue.CLOSED:
+                    break
+
+                submitted, intent = item
+                group = [intent]
+                deadline = submitted + self._max_latency
+                while len(group) < self._max_batch:
+                    try:
+                        item = self._queue.get(timeout=max(deadline - time.monotonic(), 0.0))
+                    except queue.Empty:
+                        break
+                    if item is SpillQueue.CLOSED:
+                        closed = True
+                        break
+                    group.append(item[1])
+
+                try:
+                    self._commit(connection, group, submitted)
+                except Exception:
+                    log.exception("Dropping {} intents after an unexpected error".format(len(group)))
+                    self.dropped += len(group)
+
+    def _commit(self, connection, group: list, submitted: float):
+        """Write and commit a group of intents, retrying on database errors."""
+        attempt = 0
+        while True:
+            start = time.monotonic()
+            try:
+                with connection.begin():
+                    flight_ids = self._write(connection, group)
+            except (SQLAlchemyError, psycopg2.Error) as err:
+                attempt += 1
+                if attempt > self.RETRIES and not _disconnected(err):
+                    log.error("Dropping {} intents after {} failed attempts: {}".format(len(group), attempt, err))
+                    self.dropped += len(group)
+                    return
+                delay = min(self.RETRY_DELAY * 2 ** (attempt - 1), self.RETRY_DELAY_MAX)
+                log.error("Writing {} intents failed (attempt {}), retrying in {:.1f}s: {}".format(
+                    len(group), attempt, delay, err))
+                time.sleep(delay)
+                continue
+
+            now = time.monotonic()
+            self._flight_ids.update(flight_ids)
+            # Intents of flights whose row was never written (their group was dropped) cannot be written either
+            orphans = sum(1 for intent in group if isinstance(intent, (FlightUpdate, NewPositions, FlightEvent))
+                          and self._flight_ids.get(intent.key) is None)
+            if orphans:
+                log.warning("Dropped {} intents of flights without a row".format(orphans))
+                self.dropped += orphans
+            for intent in group:
+                if isinstance(intent, FlightClosed):
+                    self._flight_ids.pop(intent.key, None)
+
+            self.commits += 1
+            self.intents += len(group)
+            self.commit_duration_max = max(self.commit_duration_max, now - start)
+            self.latency = now - submitted
+            self.latency_max = max(self.latency_max, self.latency)
+            self._latency_sum += self.latency
+            return
+
+    def _write(self, connection, group: list) -> dict:
+        """
+        Execute the statements of a group of intents within the current transaction.
+
+        :return: Mapping of the keys of the new and resumed flights of the group to their ids
+        """
+        new_flights = [intent for intent in group if isinstance(intent, NewFlight)]
+        flight_ids = {}
+        if new_flights:
+            ids = connection.execute(text("SELECT nextval(:sequence) FROM generate_series(1, :count)"),
+                                     sequence=self.FLIGHT_SEQUENCE, count=len(new_flights)).fetchall()
+            flight_ids = {intent.key: row[0] for intent, row in zip(new_flights, ids)}
+            connection.execute(models.Flight.__table__.insert(),
+                               [{'id': flight_ids[intent.key], 'hexident': intent.hexident,
+                                 'callsign': intent.callsign, 'first_seen': intent.first_seen,
+                                 'last_seen': intent.last_seen, 'intention': intent.intention}
+                                for intent in new_flights])
+        flight_ids.update((intent.key, intent.flight_id) for intent in group if isinstance(intent, ResumedFlight))
+
+        def flight_id(key):
+            _id = flight_ids.get(key)
+            return _id if _id is not None else self._flight_ids.get(key)
+
+        # The last update of a flight within the group wins
+        updates = {intent.key: intent for intent in group if isinstance(intent, FlightUpdate)}
+        rows = [{'_id': flight_id(key), 'callsign': intent.callsign, 'last_seen': intent.last_seen,
+                 'intention': intent.intention} for key, intent in updates.items() if flight_id(key) is not None]
+        if rows:
+            flights = models.Flight.__table__
+            connection.execute(flights.update().where(flights.c.id == bindparam('_id')).values(
+                callsign=bindparam('callsign'), last_seen=bindparam('last_seen'),
+                intention=bindparam('intention')), rows)
+
+        rows = [(flight_id(intent.key), position_time, bulk.ewkt_point(lon, lat, alt, srid=models.SRID), onground)
+                for intent in group if isinstance(intent, NewPositions) and flight_id(intent.key) is not None
+                for position_time, lon, lat, alt, onground in intent.positions]
+        if rows:
+            # COPY on the DBAPI connection, within the transaction of the group
+            with connection.connection.cursor() as cursor:
+                bulk.copy_rows(cursor, models.Position.__tablename__, self.POSITION_COLUMNS, rows)
+
+        for event_type in (models.Landings, models.Takeoffs):
+            rows = [{'flight_id': flight_id(intent.key), 'time': intent.time, 'runway': intent.runway}
+                    for intent in group if isinstance(intent, FlightEvent) and intent.event_type is event_type
+                    and flight_id(intent.key) is not None]
+            if rows:
+                connection.execute(event_type.__table__.insert(), rows)
+
+        return flight_ids
@@ -1,44 +1,193 @@
+import asyncio
 import logging
+import os
 import signal
 import sys
 
-from db import session
-from dump1090_postgis.adsb_logger import AdsbLogger
-from dump1090_postgis.adsb_parser import AdsbMessageFilter, Dump1090Socket
-from dump1090_postgis.flights import CurrentFlights
+from config import AIRPORTS, AIRPORTS_RADIUS, DB_WRITER, DEDUP_TIME_DIGITS, DEDUP_WINDOW, DUMP1090_FORMAT, \
+    DUMP1090_RECEIVERS, FILTER_CENTER, FILTER_RADIUS, LOGGER_MODE, REATTACH_GAP, RECEIVER_POSITION, REPLAY_FILE, \
+    REPLAY_SPEED, RUNWAYS_FILE, SHARDS, SNAPSHOT_FILE, SNAPSHOT_PERIOD, SPILL_DIR
+from db import engine, session
+from dump1090_postgis.adsb_logger import AdsbLogger, AsyncAdsbLogger
+from dump1090_postgis.adsb_parser import AdsbMessageFilter, AsyncDump1090Socket, Dump1090Socket, FileSource, \
+    RejectionCache
+from dump1090_postgis.airports import RUNWAYS_CSV, load_airports
+from dump1090_postgis.beast import AsyncBeastSocket, BeastSocket
+from dump1090_postgis.clock import StreamClock
+from dump1090_postgis.fan_in import AsyncMultiSource, MessageDeduplicator, MultiSource
+from dump1090_postgis.flights import CurrentFlights, LandingAndTakeoffManager
+from dump1090_postgis.sharding import ShardedFlights
+from dump1090_postgis.snapshot import PoolSnapshot
+from dump1090_postgis.writer import FlightWriter
 
 
 log = logging.getLogger()
 
 
-def handle_sigterm():
-    """Handle Docker's SIGTERM by raising KeyboardInterrupt."""
+def handle_termination(adsb_logger: AdsbLogger):
+    """Handle Docker's SIGTERM and SIGINT by shutting down the logger gracefully.
+
+    The handler only sets the shutdown flag of the logger, instead of raising an exception at an arbitrary point, e.g.
+    within a batch of messages or a commit.
+    """
 
     def exit_gracefully(signum, frame):
-        raise KeyboardInterrupt
+        log.info("Termination signal received. Processing the queued messages before shutting down")
+        adsb_logger.shutdown()
 
-    signal.signal(signal.SIGTERM, exit_gracefully)
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, exit_gracefully)
 
 
-def main():
-    log.info(">>> WELCOME TO THE ADSB POSTGIS LOGGER <<<")
+def message_source(stream_class, multi_source_class):
+    """Return a message stream of the configured receivers; Several receivers are merged without duplicates.
+
+    :param stream_class: Class of the stream of a single receiver, e.g. Dump1090Socket
+    :param multi_source_class: Class of the composite stream, e.g. MultiSource
+    """
+    # The Beast decoder needs the receiver position for surface positions
+    options = {'reference': RECEIVER_POSITION} if DUMP1090_FORMAT == 'beast' else {}
+    sources = [stream_class(hostname=host, port=port, **options) for host, port in DUMP1090_RECEIVERS]
+    if len(sources) == 1:
+        return sources[0]
+
+    log.info("Merging messages of {} receivers".format(len(sources)))
+    return multi_source_class(sources, MessageDeduplicator(window=DEDUP_WINDOW, time_digits=DEDUP_TIME_DIGITS))
+
+
+def message_filter():
+    """Return the configured region filter, or None. Messages without a position pass the filter."""
+    if FILTER_RADIUS is None:
+        return None
+
+    log.info("Dropping messages farther than {}m about {}".format(FILTER_RADIUS, FILTER_CENTER))
+    return AdsbMessageFilter(radius=FILTER_RADIUS, center=FILTER_CENTER, strict=False)
+
+
+def use_airports():
+    """Attribute landings and takeoffs to the runways of the configured airports, in this process."""
+    path = RUNWAYS_FILE or RUNWAYS_CSV
+    if not os.path.exists(path):
+        log.warning("Runways file {} not found, attributing landings and takeoffs to LFRS only".format(path))
+        return
+
+    airports = load_airports(path, idents=AIRPORTS or None, center=RECEIVER_POSITION or FILTER_CENTER,
+                             radius=AIRPORTS_RADIUS)
+    if airports:
+        LandingAndTakeoffManager.use_airports(airports)
+    else:
+        log.warning("None of the configured airports found in {}, attributing landings and takeoffs to LFRS "
+                    "only".format(path))
+
+
+def flight_writer():
+    """Return the writer stage of a flights pool if configured, or None to write through the pool's session."""
+    if DB_WRITER != 'stage':
+        return None
+    return FlightWriter(engine, spill_dir=SPILL_DIR)
+
+
+def pool_snapshot():
+    """Return the snapshot of the flights pool if configured, or None."""
+    if SNAPSHOT_FILE is None:
+        return None
+    return PoolSnapshot(SNAPSHOT_FILE, period=SNAPSHOT_PERIOD)
+
 
-    handle_sigterm()
+def shard_flights_pool(index: int, shards: int) -> CurrentFlights:
+    """Return the flights pool of a shard worker process, with the session of that process."""
+    use_airports()
+    return CurrentFlights(session=session, adsb_filter=AdsbMessageFilter(below=10000), writer=flight_writer(),
+                          reattach_gap=REATTACH_GAP, shard=(index, shards))
 
-    flights_pool = CurrentFlights(session=session, adsb_filter=AdsbMessageFilter(below=10000))
-    adsb_logger = AdsbLogger(message_source=Dump1090Socket(), flights_pool=flights_pool)
+
+def log_threaded(flights_pool: CurrentFlights, source) -> AdsbLogger:
+    """Run the multi-thread AdsbLogger until a termination signal is received."""
+    adsb_logger = AdsbLogger(message_source=source, flights_pool=flights_pool, message_filter=message_filter(),
+                             spill_dir=SPILL_DIR)
+    handle_termination(adsb_logger)
+
+    # A termination signal makes the logger process the queued messages before it returns
+    log.info("Start logging messages...")
+    adsb_logger.log()
+
+    return adsb_logger
+
+
+def log_asyncio(flights_pool: CurrentFlights, source) -> AsyncAdsbLogger:
+    """Run the AsyncAdsbLogger on an event loop until a termination signal is received."""
+    adsb_logger = AsyncAdsbLogger(message_sources=[source], flights_pool=flights_pool, message_filter=message_filter())
+
+    async def run_logger():
+        logger_task = asyncio.get_running_loop().create_task(adsb_logger.log())
+
+        # Cancel the logger task on SIGTERM (Docker) or SIGINT, the task commits the flights pool before finishing
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            asyncio.get_running_loop().add_signal_handler(signum, logger_task.cancel)
+
+        await logger_task
 
     try:
-        log.info("Start logging messages...")
-        adsb_logger.log()
-    except KeyboardInterrupt:
+        log.info("Start logging messages (asyncio)...")
+        asyncio.run(run_logger())
+    except asyncio.CancelledError:
         log.info("Termination signal received. Shutting down logger and closing database connection")
-        adsb_logger.shutdown()
-        log.info("Maximum queue size: {}".format(adsb_logger.qsize_max))
-        if len(flights_pool):
-            log.warning("Dropping {} flights from flight pool".format(len(flights_pool)))
-        session.close()
-        log.info(">>> Goodbye <<<")
+
+    return adsb_logger
+
+
+def main():
+    log.info(">>> WELCOME TO THE ADSB POSTGIS LOGGER <<<")
+    use_airports()
+
+    if REPLAY_FILE is not None:
+        log.info("Replaying {} at {} speed".format(REPLAY_FILE,
+                                                  '{}x'.format(REPLAY_SPEED) if REPLAY_SPEED else 'unbounded'))
+        source = FileSource(REPLAY_FILE, speed=REPLAY_SPEED)
+        flights_pool = CurrentFlights(session=session, adsb_filter=AdsbMessageFilter(below=10000),
+                                      rejection_cache=RejectionCache(), clock=StreamClock(), writer=flight_writer(),
+                                      reattach_gap=REATTACH_GAP)
+        adsb_logger = log_threaded(flights_pool, source)
+        flights_pool.commit()  # Flights updated since the last commit period of the recorded time
+    elif LOGGER_MODE == 'asyncio':
+        source = message_source(AsyncBeastSocket if DUMP1090_FORMAT == 'beast' else AsyncDump1090Socket,
+                                AsyncMultiSource)
+        flights_pool = CurrentFlights(session=session, adsb_filter=AdsbMessageFilter(below=10000), autocommit=False,
+                                      rejection_cache=RejectionCache(), writer=flight_writer(),
+                                      snapshot=pool_snapshot(), reattach_gap=REATTACH_GAP)
+        adsb_logger = log_asyncio(flights_pool, source)
+    elif SHARDS > 1:
+        if SNAPSHOT_FILE is not None:
+            log.warning("Snapshots of the flights pool are not supported with {} shards, ignoring SNAPSHOT_FILE".format(
+                SHARDS))
+        source = message_source(BeastSocket if DUMP1090_FORMAT == 'beast' else Dump1090Socket, MultiSource)
+        flights_pool = ShardedFlights(SHARDS, shard_flights_pool)
+        adsb_logger = log_threaded(flights_pool, source)
+    else:
+        source = message_source(BeastSocket if DUMP1090_FORMAT == 'beast' else Dump1090Socket, MultiSource)
+        flights_pool = CurrentFlights(session=session, adsb_filter=AdsbMessageFilter(below=10000),
+                                      rejection_cache=RejectionCache(), writer=flight_writer(),
+                                      snapshot=pool_snapshot(), reattach_gap=REATTACH_GAP)
+        adsb_logger = log_threaded(flights_pool, source)
+
+    flights_pool.close()  # Stops the writer stage or the shard workers, saves the snapshot (if any)
+    log.info("Maximum queue size: {}".format(adsb_logger.qsize_max))
+    if isinstance(adsb_logger, AdsbLogger) and adsb_logger.message_queue.spilled_items:
+        spill_queue = adsb_logger.message_queue
+        log.info("Messages spilled to disk: {} ({} bytes), maximum catch-up lag {:.1f}s".format(
+            spill_queue.spilled_items, spill_queue.spilled_bytes, spill_queue.lag_max))
+    if flights_pool.rejection_cache is not None:
+        log.info("Messages of declined aircraft dropped by the parser: {}".format(
+            flights_pool.rejection_cache.dropped))
+    if isinstance(source, (MultiSource, AsyncMultiSource)):
+        source.log_statistics()
+    if isinstance(flights_pool, CurrentFlights) and flights_pool.snapshot is not None:
+        log.info("Saved {} flights of the flight pool to snapshot {}".format(len(flights_pool),
+                                                                             flights_pool.snapshot.path))
+    elif len(flights_pool):
+        log.warning("Dropping {} flights from flight pool".format(len(flights_pool)))
+    session.close()
+    log.info(">>> Goodbye <<<")
 
 
 if __name__ == "__main__":
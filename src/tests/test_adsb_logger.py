@@ -0,0 +1,139 @@
+import os
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from tests.test_adsb_parser import TESTS_DIR
+
+MESSAGE_STREAM = os.path.join(TESTS_DIR, 'adsb_message_stream.txt')
+
+
+class PoolStub:
+    """Flights pool stub recording the messages."""
+    rejection_cache = None
+
+    def __init__(self):
+        self.messages = []
+
+    def update(self, adsb_message):
+        self.messages.append(adsb_message)
+
+    def update_batch(self, batch):
+        for adsb_message in batch:
+            self.update(adsb_message)
+
+
+class TestAdsbLogger(unittest.TestCase):
+
+    def setUp(self):
+        with patch('os.environ'):
+            from dump1090_postgis.adsb_logger import AdsbLogger
+            from dump1090_postgis.adsb_parser import AdsbMessage, AdsbMessageFilter, FileSource
+
+        self.AdsbLogger = AdsbLogger
+        self.FileSource = FileSource
+        self.message_filter = AdsbMessageFilter(radius=30000, center=(-1.61, 47.15), strict=False)
+        self.expected = [msg for msg in AdsbMessage(FileSource(MESSAGE_STREAM)) if self.message_filter.filter(msg)]
+
+    def test_batches(self):
+        """Batches of any size must hand over the messages passing the filter, in order."""
+        for batch_size in (1, 10, 500):
+            with self.subTest(batch_size=batch_size):
+                pool = PoolStub()
+                logger_class = type('AdsbLogger', (self.AdsbLogger,), {'BATCH_SIZE': batch_size})
+                logger_class(self.FileSource(MESSAGE_STREAM), pool, message_filter=self.message_filter).log()
+
+                self.assertEqual(pool.messages, self.expected)
+
+    def test_overflow(self):
+        """Messages exceeding the queue are spilled, not dropped."""
+        pool = PoolStub()
+        logger_class = type('AdsbLogger', (self.AdsbLogger,), {'QSIZE': 20, 'BATCH_SIZE': 10})
+        adsb_logger = logger_class(self.FileSource(MESSAGE_STREAM), pool, message_filter=self.message_filter)
+
+        def stall(adsb_message):
+            # The database stalls on the first message, while the receiver thread reads the whole file
+            if not pool.messages:
+                time.sleep(0.5)
+            pool.messages.append(adsb_message)
+
+        with patch.object(pool, 'update', side_effect=stall):
+            adsb_logger.log()
+
+        self.assertGreater(adsb_logger.message_queue.spilled_items, 0)
+        self.assertEqual(pool.messages, self.expected)
+
+    def test_shutdown(self):
+        """A logger shut down processes the batches in memory and on disk before it returns, without losing any."""
+        pool = PoolStub()
+        logger_class = type('AdsbLogger', (self.AdsbLogger,), {'QSIZE': 20, 'BATCH_SIZE': 10})
+        adsb_logger = logger_class(self.FileSource(MESSAGE_STREAM), pool, message_filter=self.message_filter)
+        spill_dirs = []
+
+        def shutdown(batch):
+            # The signal arrives while the database stalls on the first batch, after the whole file was read
+            if not spill_dirs:
+                time.sleep(0.5)
+                spill_dirs.append(adsb_logger.message_queue._segment_dir)
+                adsb_logger.shutdown()
+            pool.messages.extend(batch)
+
+        with patch.object(pool, 'update_batch', side_effect=shutdown):
+            adsb_logger.log()
+
+        self.assertGreater(adsb_logger.message_queue.spilled_items, 0)
+        self.assertEqual(pool.messages, self.expected)
+        self.assertFalse(os.path.exists(spill_dirs[0]))
+
+    def test_shutdown_idle_source(self):
+        """A logger shut down while its source is idle processes the pending messages and returns."""
+        first_message, release = threading.Event(), threading.Event()
+
+        class IdleSource(self.FileSource):
+            def __iter__(self):
+                yield next(super().__iter__())
+                first_message.set()
+                release.wait()
+
+        pool = PoolStub()
+        adsb_logger = self.AdsbLogger(IdleSource(MESSAGE_STREAM), pool)
+        logger_thread = threading.Thread(target=adsb_logger.log)
+        logger_thread.start()
+        self.addCleanup(release.set)
+
+        self.assertTrue(first_message.wait(timeout=5))
+        adsb_logger.shutdown()
+        logger_thread.join(timeout=5)
+
+        self.assertFalse(logger_thread.is_alive())
+        self.assertEqual(len(pool.messages), 1)
+
+    def test_idle_source(self):
+        """A single message is handed over within about BATCH_TIME, although the source delivers no further message."""
+        first_message, release = threading.Event(), threading.Event()
+
+        class IdleSource(self.FileSource):
+            def __iter__(self):
+                yield next(super().__iter__())
+                first_message.set()
+                release.wait()
+
+        received = threading.Event()
+        pool = PoolStub()
+        adsb_logger = self.AdsbLogger(IdleSource(MESSAGE_STREAM), pool)
+        logger_thread = threading.Thread(target=adsb_logger.log)
+        logger_thread.start()
+        self.addCleanup(logger_thread.join)
+        self.addCleanup(release.set)
+
+        with patch.object(pool, 'update', side_effect=lambda msg: received.set()):
+            self.assertTrue(first_message.wait(timeout=5))
+            start = time.monotonic()
+            self.assertTrue(received.wait(timeout=5))
+
+        self.assertLess(time.monotonic() - start, 10 * self.AdsbLogger.BATCH_TIME)
+
+
+if __name__ == '__main__':
+    unittest.main()
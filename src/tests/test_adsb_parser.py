@@ -1,4 +1,27 @@
+import asyncio
+import collections
+import datetime
+import os
+import socket
+import threading
 import unittest
+from unittest.mock import patch
+
+import numpy as np
+import shapely.geometry
+
+TESTS_DIR = os.path.dirname(__file__)
+
+
+def busiest_aircraft() -> tuple:
+    """Return the messages of adsb_message_stream.txt and the hexident with the most airborne positions (MSG 3)."""
+    with patch('os.environ'):
+        from dump1090_postgis.adsb_parser import AdsbMessage, FileSource
+
+    messages = list(AdsbMessage(FileSource(os.path.join(TESTS_DIR, 'adsb_message_stream.txt'))))
+    hexident = collections.Counter(msg.hexident for msg in messages
+                                   if msg.transmission_type == 3 and msg.latitude is not None).most_common(1)[0][0]
+    return messages, hexident
 
 
 class AdsbMessageStub:
@@ -36,5 +59,282 @@ class MyTestCase(unittest.TestCase):
         self.assertEqual(True, False)
 
 
+class TestAdsbMessage(unittest.TestCase):
+
+    def setUp(self):
+        with patch('os.environ'):
+            from dump1090_postgis.adsb_parser import AdsbMessage, AdsbRecord, FileSource
+
+        self.AdsbMessage = AdsbMessage
+        self.AdsbRecord = AdsbRecord
+        self.FileSource = FileSource
+
+    def _parse(self, file_name, strict):
+        source = self.FileSource(os.path.join(TESTS_DIR, file_name))
+        fields = ('hexident',) + tuple(self.AdsbMessage.NORMALIZE_MSG)
+        return [{field: getattr(msg, field) for field in fields}
+                for msg in self.AdsbMessage(source, strict=strict)]
+
+    def test_fast_parser(self):
+        msg_1, msg_2 = self._parse('adsb_messages_ok.txt', strict=False)[-2:]
+
+        self.assertEqual(msg_1['transmission_type'], 1)
+        self.assertEqual(msg_1['hexident'], '40757F')
+        self.assertEqual(msg_1['callsign'], 'TEST123')
+        self.assertIsNone(msg_1['altitude'])
+        self.assertEqual(msg_2['speed'], 240)
+        self.assertAlmostEqual(msg_2['latitude'], 46.75470)
+        self.assertAlmostEqual(msg_2['longitude'], -2.87776)
+        self.assertTrue(msg_2['onground'])
+        self.assertEqual(msg_2['gen_date_time'].isoformat(), '2019-10-20T11:33:45.311000+00:00')
+
+    def test_fast_parser_equals_strict_parser(self):
+        """The fast parser must yield the same values as the regex based parser on recorded messages."""
+        for file_name in ('adsb_messages_ok.txt', 'adsb_messages_faulty.txt', 'adsb_message_stream.txt'):
+            self.assertListEqual(self._parse(file_name, strict=False), self._parse(file_name, strict=True))
+
+    def test_records(self):
+        """Each message must be yielded as separate immutable record."""
+        source = self.FileSource(os.path.join(TESTS_DIR, 'adsb_messages_faulty.txt'))
+        records = list(self.AdsbMessage(source))
+
+        self.assertTrue(all(isinstance(record, self.AdsbRecord) for record in records))
+        self.assertListEqual([record.altitude for record in records], [-25, -25, -1000])
+        self.assertRaises(AttributeError, setattr, records[0], 'altitude', 0)
+
+    def test_skip_faulty_message(self):
+        """A message which cannot be parsed must be skipped, not replaced by the previous one."""
+        hexidents = [msg['hexident'] for msg in self._parse('adsb_messages_ok.txt', strict=False)]
+        self.assertListEqual(hexidents, ['40757F', '40757F', '40757F'])
+
+
+class TestRejectionCache(unittest.TestCase):
+
+    def setUp(self):
+        with patch('os.environ'):
+            from dump1090_postgis.adsb_parser import AdsbMessage, FileSource, RejectionCache
+
+        self.AdsbMessage = AdsbMessage
+        self.FileSource = FileSource
+        self.RejectionCache = RejectionCache
+
+    def test_drops(self):
+        cache = self.RejectionCache()
+        cache.reject('40757F')
+
+        self.assertTrue(cache.drops(1, '40757F'))
+        self.assertFalse(cache.drops(3, '40757F'), msg="Admitting transmission type must never be dropped")
+        self.assertFalse(cache.drops(2, '40757F'), msg="Admitting transmission type must never be dropped")
+        self.assertFalse(cache.drops(1, '4CA8AA'))
+        self.assertEqual(cache.dropped, 1)
+
+        cache.admit('40757F')
+        self.assertFalse(cache.drops(1, '40757F'))
+
+    @patch('dump1090_postgis.adsb_parser.monotonic')
+    def test_ttl(self, monotonic):
+        cache = self.RejectionCache(ttl=10)
+
+        monotonic.return_value = 100.0
+        cache.reject('40757F')
+        monotonic.return_value = 109.0
+        self.assertTrue('40757F' in cache)
+        monotonic.return_value = 111.0
+        self.assertFalse('40757F' in cache)
+
+    def test_max_size(self):
+        cache = self.RejectionCache(max_size=2)
+        for hexident in ('A', 'B', 'C'):
+            cache.reject(hexident)
+
+        self.assertEqual(len(cache), 2)
+        self.assertFalse('A' in cache)
+        self.assertTrue('C' in cache)
+
+    def test_parser_drops(self):
+        """The parser must yield only the admitting messages of a rejected hexident."""
+        cache = self.RejectionCache()
+        cache.reject('40757F')
+
+        for strict in (False, True):
+            source = self.FileSource(os.path.join(TESTS_DIR, 'adsb_messages_ok.txt'))
+            records = list(self.AdsbMessage(source, strict=strict, rejection_cache=cache))
+            self.assertListEqual([record.transmission_type for record in records], [3, 2])
+
+
+class TestAdsbMessageFilter(unittest.TestCase):
+
+    def setUp(self):
+        with patch('os.environ'):
+            from dump1090_postgis.adsb_parser import AdsbMessage, AdsbMessageFilter, FileSource, Geofence
+
+        self.AdsbMessageFilter = AdsbMessageFilter
+        self.Geofence = Geofence
+        self.records = list(AdsbMessage(FileSource(os.path.join(TESTS_DIR, 'adsb_message_stream.txt'))))
+        self.columns = AdsbMessageFilter.columns(self.records)
+        positions = [msg for msg in self.records if msg.latitude is not None]
+        self.lon = sum(msg.longitude for msg in positions) / len(positions)
+        self.lat = sum(msg.latitude for msg in positions) / len(positions)
+
+    def assertBatchConsistent(self, adsb_filter):
+        expected = [adsb_filter.filter(msg) for msg in self.records]
+        self.assertEqual(adsb_filter.filter_batch(self.columns).tolist(), expected)
+        return expected
+
+    def test_defaults(self):
+        adsb_filter = self.AdsbMessageFilter(strict=False)
+        self.assertTrue(all(self.assertBatchConsistent(adsb_filter)))
+
+    def test_batch_consistent(self):
+        """The batch tests must decide like the single message tests, in strict and non-strict mode."""
+        triangle = [(self.lon - 1, self.lat - 1), (self.lon + 1, self.lat - 0.5), (self.lon, self.lat + 1)]
+        for strict in (True, False):
+            for kwargs in (dict(below=10000, above=2000), dict(faster=200, slower=400), dict(rising=True),
+                           dict(descending=False), dict(rising=False, descending=False), dict(onground=False),
+                           dict(radius=30000, center=(self.lon, self.lat)), dict(geofences=[triangle])):
+                with self.subTest(strict=strict, **kwargs):
+                    expected = self.assertBatchConsistent(self.AdsbMessageFilter(strict=strict, **kwargs))
+                    self.assertTrue(0 < sum(expected) < len(expected))
+
+    def test_strict(self):
+        """Messages lacking the tested value are rejected in strict mode only."""
+        msg6 = next(msg for msg in self.records if msg.transmission_type == 6)
+        self.assertIsNone(msg6.speed)
+        self.assertFalse(self.AdsbMessageFilter(faster=100).filter(msg6))
+        self.assertTrue(self.AdsbMessageFilter(faster=100, strict=False).speed(msg6))
+
+    def test_distance(self):
+        msg = self.records[0]._replace(longitude=-1.6, latitude=47.2)
+        # About 1000m north-east of the message
+        adsb_filter = self.AdsbMessageFilter(radius=1100, center=(-1.5906, 47.2064))
+        self.assertTrue(adsb_filter.distance(msg))
+        adsb_filter.radius = 900
+        self.assertFalse(adsb_filter.distance(msg))
+        with self.assertRaises(ValueError):
+            self.AdsbMessageFilter(radius=1000)
+
+    def test_geofence_grid(self):
+        """Lookup in the grid and exact test must agree with shapely, also for points in holes."""
+        exterior = [(0, 0), (10, 0), (10, 10), (5, 6), (0, 10)]
+        hole = [(2, 2), (4, 2), (4, 4), (2, 4)]
+        fence = self.Geofence(shapely.geometry.Polygon(exterior, [hole]), grid_size=8)
+
+        lon, lat = np.random.RandomState(1).uniform(-1, 11, (2, 2000))
+        expected = [fence.polygon.contains(shapely.geometry.Point(x, y)) for x, y in zip(lon, lat)]
+        self.assertEqual([fence.contains(x, y) for x, y in zip(lon, lat)], expected)
+        self.assertEqual(fence.contains_batch(lon, lat).tolist(), expected)
+        self.assertFalse(fence.contains_batch(np.array([np.nan]), np.array([5.0]))[0])
+
+
+class TestSbsTimestampDecoder(unittest.TestCase):
+
+    def setUp(self):
+        with patch('os.environ'):
+            from dump1090_postgis.adsb_parser import SbsTimestampDecoder, _date_time_parser
+
+        self.decoder = SbsTimestampDecoder()
+        self.isoparse = lambda v: _date_time_parser.isoparse(v.replace('/', '-')).replace(tzinfo=datetime.timezone.utc)
+
+    def test_recorded_timestamps(self):
+        """Decoded timestamps must be identical to dateutil's."""
+        with open(os.path.join(TESTS_DIR, 'adsb_message_stream.txt'), 'r') as f:
+            for line in f:
+                date, time = line.split(',')[6:8]
+                self.assertEqual(self.decoder.decode(date, time), self.isoparse(date + ',' + time))
+                self.assertEqual(self.decoder.decode(date.encode(), time.encode()), self.isoparse(date + ',' + time))
+
+    def test_fractions(self):
+        for value in ('2019/10/20,11:33:40', '2019/10/20,11:33:40.3', '2019/10/20,11:33:40.31',
+                      '2019/10/20,11:33:40.311', '2019/10/20,11:33:40.311257', '2019/10/20,11:33:40.3112579',
+                      '2019/12/31,23:59:59.999', '2020/01/01,00:00:00.001'):
+            self.assertEqual(self.decoder(value), self.isoparse(value), value)
+
+    def test_invalid(self):
+        for value in ('2019/10/20,11:33', '2019/13/20,11:33:40.311', '2019/10/20,11:33:40.abc', '2019/10/20,', ''):
+            self.assertRaises(ValueError, self.decoder, value)
+
+
+class TestSocketLineReader(unittest.TestCase):
+
+    def setUp(self):
+        with patch('os.environ'):
+            from dump1090_postgis.adsb_parser import SocketLineReader
+
+        self.SocketLineReader = SocketLineReader
+        self.sender, self.receiver = socket.socketpair()
+
+    def tearDown(self):
+        self.sender.close()
+
+    def _send(self, chunks):
+        for chunk in chunks:
+            self.sender.sendall(chunk)
+        self.sender.shutdown(socket.SHUT_WR)
+
+    def _receive(self, chunks, buffer_size):
+        sender = threading.Thread(target=self._send, args=(chunks,))
+        sender.start()
+        with self.SocketLineReader(self.receiver, buffer_size=buffer_size) as reader:
+            lines = list(reader)
+        sender.join()
+        return lines
+
+    def test_partial_lines(self):
+        """Lines split across reads must be reassembled."""
+        chunks = [b'MSG,8,1', b',1,400AFE\r\nMSG,7', b',1,1\r\n', b'\r\nMSG,1\r\n']
+        lines = self._receive(chunks, buffer_size=16)
+
+        self.assertListEqual(lines, [b'MSG,8,1,1,400AFE', b'MSG,7,1,1', b'', b'MSG,1'])
+
+    def test_line_longer_than_buffer(self):
+        line = b','.join([b'MSG'] + [b'1'] * 100)
+        lines = self._receive([line + b'\n', line + b'\n'], buffer_size=8)
+
+        self.assertListEqual(lines, [line, line])
+
+    def test_socket_closed(self):
+        self._receive([b'MSG\n'], buffer_size=8)
+        self.assertEqual(self.receiver.fileno(), -1)
+
+
+class TestAsyncDump1090Socket(unittest.TestCase):
+
+    def setUp(self):
+        with patch('os.environ'):
+            from dump1090_postgis.adsb_parser import AdsbMessage, AsyncDump1090Socket
+
+        self.AdsbMessage = AdsbMessage
+        self.AsyncDump1090Socket = AsyncDump1090Socket
+
+        with open(os.path.join(TESTS_DIR, 'adsb_messages_faulty.txt'), 'rb') as f:
+            self.messages = f.read()
+
+    async def _serve(self, reader, writer):
+        # Send in two chunks splitting a message, then close the connection
+        writer.write(self.messages[:50])
+        await writer.drain()
+        writer.write(self.messages[50:] + b'\r\n')
+        await writer.drain()
+        writer.close()
+
+    async def _receive(self):
+        server = await asyncio.start_server(self._serve, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+
+        message_source = self.AsyncDump1090Socket(hostname='127.0.0.1', port=port)
+        message_source.RECONNECT_ON_EOF = False
+        records = [record async for record in self.AdsbMessage(message_source)]
+
+        server.close()
+        await server.wait_closed()
+        return records
+
+    def test_receive(self):
+        records = asyncio.run(self._receive())
+
+        self.assertListEqual([record.hexident for record in records], ['4CA8AA', '4CA8AA', '3C0C9E'])
+        self.assertListEqual([record.altitude for record in records], [-25, -25, -1000])
+
+
 if __name__ == '__main__':
     unittest.main()
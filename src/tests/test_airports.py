@@ -1,8 +1,12 @@
+import random
 import unittest
 
+import shapely.geometry
 from shapely.geometry import Point
 
-from dump1090_postgis.airports import _nte_runway_03, _nte_runway_21, nte_airport
+from dump1090_postgis.airports import AIRPORT_MARGIN, RunwayIndex, _nte_runway_03, _nte_runway_21, load_airports, \
+    nte_airport
+from dump1090_postgis.shared import haversine
 
 
 class TestRunway(unittest.TestCase):
@@ -14,6 +18,25 @@ class TestRunway(unittest.TestCase):
         self.assertEqual(_nte_runway_03.point_in(self.point_on_runway), True)
         self.assertEqual(_nte_runway_21.point_in(self.point_on_runway), True)
 
+    def test_point_in_local_frame(self):
+        """The local frame of the runways decides like the exact polygon test, also near the edges."""
+        runways = [_nte_runway_03] + [runway for airport in load_airports(idents=['LFPG']) for runway in
+                                      airport.runways]
+        rng = random.Random(0)
+        for runway in runways:
+            self.assertIsNotNone(runway._frame)
+            (min_x, min_y, max_x, max_y) = runway.boundingbox.bounds
+            corners = list(runway.boundingbox.exterior.coords)
+            points = [Point(rng.uniform(min_x, max_x), rng.uniform(min_y, max_y)) for _ in range(2000)]
+            # Points very close to the edges and corners
+            points += [Point(x + rng.uniform(-1e-7, 1e-7), y + rng.uniform(-1e-7, 1e-7))
+                       for (x0, y0), (x1, y1) in zip(corners[:-1], corners[1:])
+                       for f in (0.0, 0.3, 0.7, 1.0)
+                       for x, y in [(x0 + f * (x1 - x0), y0 + f * (y1 - y0))] for _ in range(20)]
+            for point in points:
+                self.assertEqual(runway.contains_xy(point.x, point.y), runway.boundingbox.contains(point))
+                self.assertEqual(runway.point_in(point), runway.boundingbox.contains(point))
+
     def test_same_heading_exact(self):
         self.assertEqual(_nte_runway_03.same_heading(30), True)
         self.assertEqual(_nte_runway_21.same_heading(210), True)
@@ -34,6 +57,14 @@ class TestRunway(unittest.TestCase):
         self.assertEqual(_nte_runway_03.same_heading(210), False)
         self.assertEqual(_nte_runway_21.same_heading(30), False)
 
+    def test_same_heading_wraparound(self):
+        """Headings across north are compared by their angular difference."""
+        self.assertEqual(_nte_runway_03.same_heading(355, direction_tol=40), True)
+        self.assertEqual(_nte_runway_03.same_heading(345, direction_tol=40), False)
+
+    def test_same_heading_unknown(self):
+        self.assertEqual(_nte_runway_03.same_heading(None), False)
+
 
 class TestAirport(unittest.TestCase):
 
@@ -79,5 +110,62 @@ class TestAirport(unittest.TestCase):
         self.assertTrue(nte_airport.get_runway(self.point_outside_airport, 210) is None)
 
 
+
+class TestRunwayIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.point_on_runway = Point((-1.61046, 47.15356, 100.0))
+        self.point_on_airport = Point((-1.61046, 47.154, 100.0))
+        self.point_outside_airport = Point((-1.8, 48., 100.0))
+
+    def test_nte_airport(self):
+        """The index attributes like Airport.get_runway()."""
+        index = RunwayIndex([nte_airport])
+        for point in (self.point_on_runway, self.point_on_airport, self.point_outside_airport):
+            for heading in (None, 9, 10, 30, 50, 51, 180, 189, 190, 210, 230, 231, 330):
+                self.assertIs(index.get_runway(point, heading), nte_airport.get_runway(point, heading))
+
+    def test_empty(self):
+        self.assertIsNone(RunwayIndex([]).get_runway(self.point_on_runway, 30))
+
+    def test_load_airports(self):
+        """Runways of several airports are loaded from the OurAirports data set, one per direction."""
+        airports = {airport.name_icao: airport for airport in load_airports(idents=['LFRS', 'lfpg', 'LFRZ'])}
+        self.assertEqual(set(airports), {'LFRS', 'LFPG', 'LFRZ'})
+        self.assertEqual([runway.name for runway in airports['LFRS'].runways], ['03', '21'])
+        self.assertEqual(len(airports['LFPG'].runways), 8)
+
+        index = RunwayIndex(airports.values())
+        self.assertEqual(index.get_runway(self.point_on_runway, 30).name, '03')
+        self.assertEqual(index.get_runway(self.point_on_runway, 210).name, '21')
+        self.assertIsNone(index.get_runway(self.point_on_runway, 120))
+        self.assertEqual(index.get_runway(Point(2.58, 48.9968), 85).name, '08L')
+        self.assertEqual(index.get_runway(Point(2.58, 48.9968), 265).name, '26R')
+        self.assertEqual(index.get_runway(self.point_on_airport, 30).name, '03')  # Fallback to the airport
+        self.assertIsNone(index.get_runway(self.point_outside_airport, 30))
+
+    def test_load_airports_in_range(self):
+        airports = load_airports(center=(-1.61, 47.15), radius=60000)
+        self.assertIn('LFRS', {airport.name_icao for airport in airports})
+        self.assertNotIn('LFPG', {airport.name_icao for airport in airports})
+
+    def test_load_airports_partly_in_range(self):
+        """An airport is loaded with all its runways if any runway end is within the radius."""
+        airports = load_airports(center=(2.62, 49.0), radius=2000)  # East of the southern runways of LFPG
+        self.assertEqual([airport.name_icao for airport in airports], ['LFPG'])
+        self.assertEqual(len(airports[0].runways), 8)
+
+    def test_airport_margin(self):
+        """The margin about the runways is AIRPORT_MARGIN in meters, eastwards as well as northwards."""
+        airport, = load_airports(idents=['LFRS'])
+        min_lon, min_lat, max_lon, max_lat = shapely.geometry.MultiPoint(
+            [runway.ref_point for runway in airport.runways]).bounds
+        bbox_min_lon, bbox_min_lat, bbox_max_lon, bbox_max_lat = airport.boundingbox.bounds
+        lon, lat = airport.coordinates.x, airport.coordinates.y
+
+        self.assertAlmostEqual(haversine(max_lon, lat, bbox_max_lon, lat), AIRPORT_MARGIN, delta=0.02 * AIRPORT_MARGIN)
+        self.assertAlmostEqual(haversine(lon, max_lat, lon, bbox_max_lat), AIRPORT_MARGIN, delta=0.02 * AIRPORT_MARGIN)
+
+
 if __name__ == '__main__':
     unittest.main()
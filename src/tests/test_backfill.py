@@ -0,0 +1,166 @@
+import collections
+import datetime
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from tests.test_adsb_parser import TESTS_DIR
+
+MESSAGE_STREAM = os.path.join(TESTS_DIR, 'adsb_message_stream.txt')
+
+
+def shifted_log(path: str, copies: int, shift: float, first: int = 0):
+    """Write the recorded message stream 'copies' times, each copy 'shift' seconds later, to a (gzip) log file.
+
+    :param first: Number of the first copy, e.g. to continue the copies of the previous file
+    """
+    with open(MESSAGE_STREAM, 'r') as f:
+        lines = [line.rstrip('\n').split(',') for line in f]
+
+    with (gzip.open(path, 'wt') if path.endswith('.gz') else open(path, 'w')) as f:
+        for copy in range(first, first + copies):
+            for fields in lines:
+                for date, time in ((6, 7), (8, 9)):
+                    t = datetime.datetime.strptime(fields[date] + fields[time], '%Y/%m/%d%H:%M:%S.%f')
+                    t += datetime.timedelta(seconds=copy * shift)
+                    fields[date], fields[time] = t.strftime('%Y/%m/%d'), t.strftime('%H:%M:%S.%f')[:12]
+                f.write(','.join(fields) + '\n')
+                for date, time in ((6, 7), (8, 9)):
+                    t = datetime.datetime.strptime(fields[date] + fields[time], '%Y/%m/%d%H:%M:%S.%f')
+                    t -= datetime.timedelta(seconds=copy * shift)
+                    fields[date], fields[time] = t.strftime('%Y/%m/%d'), t.strftime('%H:%M:%S.%f')[:12]
+
+
+class WriterStub:
+    """Writer collecting the (hexident, first_seen) of the flights, which fails on the commit number 'fail_on'."""
+
+    def __init__(self, fail_on: int = None):
+        self.pending = []
+        self.committed = []
+        self.commits = 0
+        self.flights = self.positions = self.events = 0
+        self._fail_on = fail_on
+
+    def write(self, entries):
+        self.pending += [(entry.flight.hexident, entry.flight.first_seen) for entry in entries]
+        self.flights += len(entries)
+
+    def commit(self):
+        self.commits += 1
+        if self.commits == self._fail_on:
+            raise RuntimeError("Connection lost")
+        self.committed += self.pending
+        self.pending = []
+
+
+class TestBulk(unittest.TestCase):
+
+    def setUp(self):
+        with patch('os.environ'):
+            from dump1090_postgis import bulk
+
+        self.bulk = bulk
+
+    def test_copy_text(self):
+        self.assertEqual(self.bulk.copy_text(None), '\\N')
+        self.assertEqual(self.bulk.copy_text(True), 't')
+        self.assertEqual(self.bulk.copy_text('a\tb\\c\n'), 'a\\tb\\\\c\\n')
+        self.assertEqual(self.bulk.copy_text(datetime.datetime(2019, 10, 20, 11, 33, 40, 310000,
+                                                               tzinfo=datetime.timezone.utc)),
+                         '2019-10-20T11:33:40.310000+00:00')
+        self.assertEqual(self.bulk.ewkt_point(-1.6, 47.15, 300.0, 4326), 'SRID=4326;POINT Z (-1.6 47.15 300.0)')
+
+
+class TestArchiveSource(unittest.TestCase):
+
+    def setUp(self):
+        with patch('os.environ'):
+            from dump1090_postgis.adsb_parser import FileSource
+            from dump1090_postgis.backfill import ArchiveSource
+
+        self.ArchiveSource = ArchiveSource
+        self.expected = list(FileSource(MESSAGE_STREAM))
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_chunks(self):
+        """Lines split across chunks must be completed, in plain and compressed files."""
+        path = os.path.join(self.tmp_dir, 'log.txt.gz')
+        with open(MESSAGE_STREAM, 'rb') as f, gzip.open(path, 'wb') as f_gz:
+            f_gz.write(f.read())
+
+        for file_path in (MESSAGE_STREAM, path):
+            self.assertEqual(list(self.ArchiveSource([file_path], chunk_size=1000)), self.expected)
+        self.assertEqual(list(self.ArchiveSource([path, MESSAGE_STREAM], chunk_size=1000)), self.expected * 2)
+
+    def test_resume(self):
+        """Reading from the position of a chunk must yield the messages from the start of this chunk on."""
+        source = self.ArchiveSource([MESSAGE_STREAM, MESSAGE_STREAM], chunk_size=10000)
+        positions = [source.position for _ in source]
+        index = len(positions) * 3 // 4
+        position = positions[index]
+        first = positions.index(position)
+
+        self.assertEqual(position[0], 1)
+        self.assertEqual(list(self.ArchiveSource([MESSAGE_STREAM, MESSAGE_STREAM], position, chunk_size=10000)),
+                         (self.expected * 2)[first:])
+
+
+class TestBackfill(unittest.TestCase):
+
+    def setUp(self):
+        with patch('os.environ'):
+            from dump1090_postgis.adsb_parser import AdsbMessageFilter
+            from dump1090_postgis.backfill import Backfill, Checkpoint
+
+        self.AdsbMessageFilter = AdsbMessageFilter
+        self.Backfill = Backfill
+        self.Checkpoint = Checkpoint
+        self.tmp_dir = tempfile.mkdtemp()
+        self.files = [os.path.join(self.tmp_dir, name) for name in ('day1.txt.gz', 'day2.txt')]
+        for index, path in enumerate(self.files):
+            shifted_log(path, copies=3, shift=400, first=index * 3)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _backfill(self, writer, checkpoint=None):
+        backfill = self.Backfill(self.files, writer, self.AdsbMessageFilter(), checkpoint=checkpoint, chunk_size=20000)
+        backfill.CHECKPOINT_PERIOD = -1  # Checkpoint after every chunk
+        backfill.run()
+        return writer
+
+    def test_flights(self):
+        """Each copy of the stream must yield the same flights, a flight of the first copy is completed by MAX_AGE."""
+        writer = self._backfill(WriterStub())
+        flights = collections.Counter(hexident for hexident, _ in writer.committed)
+
+        self.assertTrue(flights)
+        self.assertEqual(set(flights.values()), {6})
+        self.assertEqual(len(set(writer.committed)), len(writer.committed))
+
+    def test_resume(self):
+        """A backfill interrupted and resumed from its checkpoint must neither lose nor duplicate flights."""
+        expected = self._backfill(WriterStub()).committed
+        checkpoint = self.Checkpoint(os.path.join(self.tmp_dir, 'checkpoint.json'))
+
+        committed = []
+        for fail_on in (20, 30, None):
+            writer = WriterStub(fail_on=fail_on)
+            try:
+                self._backfill(writer, checkpoint)
+            except RuntimeError:
+                pass
+            committed += writer.committed
+
+        self.assertTrue(checkpoint.complete)
+        self.assertCountEqual(committed, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
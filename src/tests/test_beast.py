@@ -0,0 +1,151 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+# DF17 messages and their decoded values from "The 1090MHz Riddle" (https://mode-s.org/decode/)
+IDENTIFICATION = bytes.fromhex('8D4840D6202CC371C32CE0576098')
+POSITION_EVEN = bytes.fromhex('8D40621D58C382D690C8AC2863A7')
+POSITION_ODD = bytes.fromhex('8D40621D58C386435CC412692AD6')
+VELOCITY = bytes.fromhex('8D485020994409940838175B284F')
+AIRSPEED = bytes.fromhex('8DA05F219B06B6AF189400CBC33F')
+SURFACE_MOVEMENT = bytes.fromhex('8C4841753A9A153237AEF0F275BE')
+SURFACE_POSITION = bytes.fromhex('8C4841753A8A35323FAEBDAC702D')
+
+
+def beast_frame(message: bytes, timestamp: int = 12000000, signal: int = 0x1a) -> bytes:
+    """Encode a Mode S long message as Beast frame, escaping all 0x1a bytes."""
+    body = timestamp.to_bytes(6, 'big') + bytes((signal,)) + message
+    return b'\x1a3' + body.replace(b'\x1a', b'\x1a\x1a')
+
+
+class TestBeastFramer(unittest.TestCase):
+
+    def setUp(self):
+        with patch('os.environ'):
+            from dump1090_postgis.beast import BeastFramer
+
+        self.framer = BeastFramer()
+
+    def test_escaped(self):
+        """Escaped bytes in the body (here the signal level) must be unescaped."""
+        frames = self.framer.feed(beast_frame(IDENTIFICATION) + beast_frame(VELOCITY, timestamp=0x1a1a))
+
+        self.assertEqual([frame.message for frame in frames], [IDENTIFICATION, VELOCITY])
+        self.assertEqual([frame.timestamp for frame in frames], [12000000, 0x1a1a])
+        self.assertEqual(frames[0].signal, 0x1a)
+
+    def test_split(self):
+        """Frames split across chunks, also between an escape byte and its duplicate, must be completed."""
+        data = beast_frame(IDENTIFICATION) + beast_frame(VELOCITY)
+        split = data.index(b'\x1a\x1a') + 1
+
+        self.assertEqual(self.framer.feed(data[:split]), [])
+        self.assertEqual([frame.message for frame in self.framer.feed(data[split:])], [IDENTIFICATION, VELOCITY])
+
+    def test_resynchronize(self):
+        data = b'garbage' + beast_frame(IDENTIFICATION)[:10] + beast_frame(VELOCITY)
+
+        self.assertEqual([frame.message for frame in self.framer.feed(data)], [VELOCITY])
+
+
+class TestBeastDecoder(unittest.TestCase):
+
+    def setUp(self):
+        with patch('os.environ'):
+            from dump1090_postgis.beast import BeastDecoder, BeastFrame, MODE_S_LONG
+
+        self.BeastDecoder = BeastDecoder
+        self.frame = lambda message: BeastFrame(MODE_S_LONG, 12000000, 0, message)
+
+    def test_identification(self):
+        msg, = self.BeastDecoder().decode([self.frame(IDENTIFICATION)])
+
+        self.assertEqual((msg.transmission_type, msg.hexident, msg.callsign), (1, '4840D6', 'KLM1023'))
+
+    def test_position(self):
+        """Positions are decoded from an even/odd pair, afterwards relative to the last position."""
+        decoder = self.BeastDecoder()
+        first, second = decoder.decode([self.frame(POSITION_EVEN), self.frame(POSITION_ODD)])
+        third, = decoder.decode([self.frame(POSITION_EVEN)])
+
+        self.assertEqual((first.transmission_type, first.altitude, first.latitude), (3, 38000, None))
+        self.assertEqual((second.latitude, second.longitude), (52.26578, 3.93891))
+        self.assertEqual((third.latitude, third.longitude), (52.2572, 3.91937))
+        self.assertFalse(third.onground)
+
+    def test_local_position(self):
+        decoder = self.BeastDecoder()
+        decoder.decode([self.frame(POSITION_EVEN), self.frame(POSITION_ODD)])
+        decoder._aircraft['40621D'].cpr = [None, None]
+
+        msg, = decoder.decode([self.frame(POSITION_EVEN)])
+        self.assertEqual((msg.latitude, msg.longitude), (52.2572, 3.91937))
+
+    def test_velocity(self):
+        ground, air = self.BeastDecoder().decode([self.frame(VELOCITY), self.frame(AIRSPEED)])
+
+        self.assertEqual((ground.transmission_type, ground.speed, ground.track, ground.verticalrate),
+                         (4, 159, 183, -832))
+        self.assertEqual((air.speed, air.track, air.verticalrate), (375, 244, -2304))
+
+    def test_surface_position(self):
+        movement, position = self.BeastDecoder(reference=(4.375, 51.99)).decode([self.frame(SURFACE_MOVEMENT),
+                                                                                 self.frame(SURFACE_POSITION)])
+
+        self.assertEqual((movement.transmission_type, movement.speed, movement.track, movement.onground),
+                         (2, 17, 93, True))
+        self.assertEqual((position.latitude, position.longitude), (52.32061, 4.73473))
+
+    def test_crc(self):
+        """Messages with a wrong parity and other downlink formats are skipped."""
+        corrupted = IDENTIFICATION[:5] + bytes((IDENTIFICATION[5] ^ 1,)) + IDENTIFICATION[6:]
+        self.assertEqual(self.BeastDecoder().decode([self.frame(corrupted), self.frame(b'\x5d' + IDENTIFICATION[1:])]),
+                         [])
+
+    def test_mlat_timestamp(self):
+        """Generation times follow the MLAT timestamps of the frames."""
+        with patch('os.environ'):
+            from dump1090_postgis.beast import BeastFrame, MODE_S_LONG
+
+        first, second = self.BeastDecoder().decode([BeastFrame(MODE_S_LONG, 12000000, 0, VELOCITY),
+                                                    BeastFrame(MODE_S_LONG, 12006000, 0, VELOCITY)])
+        self.assertEqual((second.gen_date_time - first.gen_date_time).total_seconds(), 0.0005)
+
+
+class TestBeastFileSource(unittest.TestCase):
+
+    def setUp(self):
+        with patch('os.environ'):
+            from dump1090_postgis.adsb_parser import AdsbMessage, RejectionCache
+            from dump1090_postgis.beast import BeastFileSource
+
+        self.AdsbMessage = AdsbMessage
+        self.RejectionCache = RejectionCache
+        self.BeastFileSource = BeastFileSource
+
+        with tempfile.NamedTemporaryFile(suffix='.bin', delete=False) as f:
+            for message in (IDENTIFICATION, POSITION_EVEN, POSITION_ODD, VELOCITY):
+                f.write(beast_frame(message))
+        self.file_path = f.name
+
+    def tearDown(self):
+        os.remove(self.file_path)
+
+    def test_records(self):
+        """AdsbMessage passes the decoded records through."""
+        records = list(self.AdsbMessage(self.BeastFileSource(self.file_path)))
+
+        self.assertEqual([msg.transmission_type for msg in records], [1, 3, 3, 4])
+        self.assertEqual(records[2].latitude, 52.26578)
+
+    def test_rejection_cache(self):
+        cache = self.RejectionCache()
+        cache.reject('485020')
+
+        records = list(self.AdsbMessage(self.BeastFileSource(self.file_path), rejection_cache=cache))
+        self.assertEqual([msg.hexident for msg in records], ['4840D6', '40621D', '40621D'])
+
+
+if __name__ == '__main__':
+    unittest.main()
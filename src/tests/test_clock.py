@@ -0,0 +1,113 @@
+import datetime
+import os
+import unittest
+from unittest.mock import Mock, patch
+
+import sqlalchemy.orm
+
+from tests.test_adsb_parser import TESTS_DIR
+
+T0 = datetime.datetime(2019, 10, 20, 11, 33, 40, tzinfo=datetime.timezone.utc)
+
+
+class TestClocks(unittest.TestCase):
+
+    def setUp(self):
+        with patch('os.environ'):
+            from dump1090_postgis.clock import StreamClock, WallClock
+
+        self.StreamClock = StreamClock
+        self.WallClock = WallClock
+
+    def test_wall_clock(self):
+        clock = self.WallClock()
+        clock.observe(T0)
+        self.assertLess(abs(clock.now() - datetime.datetime.now(datetime.timezone.utc)), datetime.timedelta(seconds=1))
+
+    def test_stream_clock(self):
+        """The stream clock follows the latest message time and never runs backwards."""
+        clock = self.StreamClock()
+        self.assertGreater(clock.now(), T0)  # System time before the first message
+
+        clock.observe(T0)
+        clock.observe(T0 + datetime.timedelta(seconds=5))
+        clock.observe(T0 + datetime.timedelta(seconds=2))
+        self.assertEqual(clock.now(), T0 + datetime.timedelta(seconds=5))
+
+
+class TestReplayPacer(unittest.TestCase):
+
+    def setUp(self):
+        with patch('os.environ'):
+            from dump1090_postgis.clock import ReplayPacer
+
+        self.ReplayPacer = ReplayPacer
+
+    @patch('dump1090_postgis.clock.time')
+    def test_wait(self, time_mock):
+        """Messages are released at their recorded offset divided by the speed."""
+        time_mock.monotonic.return_value = 100.0
+        pacer = self.ReplayPacer(speed=10)
+
+        pacer.wait(T0)
+        time_mock.sleep.assert_not_called()
+
+        time_mock.monotonic.return_value = 100.5
+        pacer.wait(T0 + datetime.timedelta(seconds=20))
+        time_mock.sleep.assert_called_once_with(1.5)
+
+        # Late messages are released immediately
+        time_mock.sleep.reset_mock()
+        time_mock.monotonic.return_value = 110.0
+        pacer.wait(T0 + datetime.timedelta(seconds=30))
+        time_mock.sleep.assert_not_called()
+
+    @patch('dump1090_postgis.clock.time')
+    def test_unbounded(self, time_mock):
+        pacer = self.ReplayPacer(speed=None)
+        pacer.wait(T0)
+        pacer.wait(T0 + datetime.timedelta(hours=1))
+        time_mock.sleep.assert_not_called()
+
+        self.assertRaises(ValueError, self.ReplayPacer, 0)
+
+    @patch('dump1090_postgis.clock.time')
+    def test_file_source(self, time_mock):
+        """A FileSource replayed with a speed waits for the recorded time span of the file."""
+        with patch('os.environ'):
+            from dump1090_postgis.adsb_parser import FileSource
+
+        time_mock.monotonic.return_value = 0.0
+        messages = list(FileSource(os.path.join(TESTS_DIR, 'adsb_message_stream.txt'), speed=2))
+
+        span = (datetime.datetime.strptime(messages[-1].split(b',')[7].decode(), '%H:%M:%S.%f') -
+                datetime.datetime.strptime(messages[0].split(b',')[7].decode(), '%H:%M:%S.%f')).total_seconds()
+        self.assertAlmostEqual(max(args[0] for args, _ in time_mock.sleep.call_args_list), span / 2, places=3)
+
+
+class TestCurrentFlightsClock(unittest.TestCase):
+
+    def setUp(self):
+        with patch('os.environ'):
+            from dump1090_postgis.clock import StreamClock
+            from dump1090_postgis.flights import CurrentFlights
+            from dump1090_postgis.models import Flight
+
+        self.Flight = Flight
+        self.current_flights = CurrentFlights(Mock(spec=sqlalchemy.orm.session.Session), clock=StreamClock())
+
+    def test_prune(self):
+        """Flights are aged in stream time, regardless of the system time."""
+        for hexident, seconds in (('aaaaaa', 0), ('bbbbbb', 200)):
+            flight = self.Flight(hexident)
+            flight.last_seen = T0 + datetime.timedelta(seconds=seconds)
+            self.current_flights[hexident] = flight
+
+        self.current_flights.clock.observe(T0 + datetime.timedelta(seconds=self.current_flights.MAX_AGE + 100))
+        self.current_flights.prune()
+
+        self.assertEqual(list(self.current_flights.hexidents()), ['bbbbbb'])
+
+
+if __name__ == '__main__':
+    unittest.main()
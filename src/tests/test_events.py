@@ -0,0 +1,78 @@
+import threading
+import unittest
+from unittest.mock import patch
+
+
+class TestEventBus(unittest.TestCase):
+
+    def setUp(self):
+        with patch('os.environ'):
+            from dump1090_postgis import events
+
+        self.events = events
+        self.event_bus = events.EventBus(qsize=10)
+
+    def test_subscribers(self):
+        """Each subscriber receives the events of its topics, in order of publication."""
+        received = {'all': [], 'landings': []}
+        self.event_bus.subscribe('all', lambda *event: received['all'].append(event),
+                                 (self.events.LANDING, self.events.TAKEOFF))
+        self.event_bus.subscribe('landings', lambda *event: received['landings'].append(event),
+                                 (self.events.LANDING,))
+
+        self.event_bus.publish(self.events.TAKEOFF, 'hex1', 1)
+        self.event_bus.publish(self.events.LANDING, 'hex2', 2)
+        self.event_bus.publish('other', 'hex3', 3)
+        statistics = self.event_bus.statistics
+        self.event_bus.close()
+
+        self.assertEqual(received['all'], [(self.events.TAKEOFF, 'hex1', 1), (self.events.LANDING, 'hex2', 2)])
+        self.assertEqual(received['landings'], [(self.events.LANDING, 'hex2', 2)])
+        self.assertEqual(set(statistics), {'all', 'landings'})
+        self.assertEqual(self.event_bus.statistics, {})
+
+    def test_full_queue(self):
+        """Publishing never blocks: Events exceeding the queue of a blocked subscriber are dropped for it only."""
+        blocked, release = threading.Event(), threading.Event()
+        received = []
+
+        def block(*event):
+            blocked.set()
+            release.wait()
+
+        self.event_bus.subscribe('blocked', block, (self.events.LANDING,))
+        self.event_bus.subscribe('fast', lambda *event: received.append(event), (self.events.LANDING,))
+
+        self.event_bus.publish(self.events.LANDING, 0)
+        self.assertTrue(blocked.wait(timeout=5))
+        for i in range(1, 30):
+            self.event_bus.publish(self.events.LANDING, i)
+        statistics = self.event_bus.statistics
+        release.set()
+        self.event_bus.close()
+
+        # The blocked subscriber holds one event and queues ten more
+        self.assertEqual(statistics['blocked']['dropped'], 30 - 11)
+        self.assertEqual(statistics['fast']['dropped'] + len(received), 30)
+
+    def test_errors(self):
+        """A failing subscriber is counted and keeps receiving events; Latency is measured per delivery."""
+        def callback(topic, i):
+            if i == 0:
+                raise ValueError("Failure")
+
+        self.event_bus.subscribe('failing', callback, (self.events.TAKEOFF,))
+        self.event_bus.publish(self.events.TAKEOFF, 0)
+        self.event_bus.publish(self.events.TAKEOFF, 1)
+        subscriber = self.event_bus._subscribers[0]
+        self.event_bus.close()
+        statistics = subscriber.statistics
+
+        self.assertEqual(statistics['delivered'], 2)
+        self.assertEqual(statistics['errors'], 1)
+        self.assertGreaterEqual(statistics['latency_max'], statistics['latency_mean'])
+        self.assertGreaterEqual(statistics['latency_mean'], 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from tests.test_adsb_parser import TESTS_DIR
+
+MSG_A = b"MSG,3,1,1,40757F,1,2019/10/20,11:33:40.311,2019/10/20,11:33:40.311,,5000,,,46.65470,-2.77776,,,0,,0,0"
+MSG_A_LATE = b"MSG,3,1,1,40757F,1,2019/10/20,11:33:40.348,2019/10/20,11:33:40.348,,5000,,,46.65470,-2.77776,,,0,,0,0"
+MSG_B = b"MSG,4,1,1,40757F,1,2019/10/20,11:33:40.311,2019/10/20,11:33:40.311,,,523,38,,,64,,,,,0"
+
+
+class TestMessageDeduplicator(unittest.TestCase):
+
+    def setUp(self):
+        with patch('os.environ'):
+            from dump1090_postgis.fan_in import MessageDeduplicator
+
+        self.MessageDeduplicator = MessageDeduplicator
+
+    def test_key(self):
+        self.assertEqual(self.MessageDeduplicator().key(MSG_A), (b'40757F', b'3', b'2019/10/20', b'11:33:40.311'))
+        self.assertEqual(self.MessageDeduplicator().key(MSG_A.decode()), ('40757F', '3', '2019/10/20', '11:33:40.311'))
+
+    def test_key_record(self):
+        """Decoded records are keyed by their content, regardless of the generation time of their receiver."""
+        with patch('os.environ'):
+            from dump1090_postgis.adsb_parser import AdsbMessage, FileSource
+
+        record = next(iter(AdsbMessage(FileSource(os.path.join(TESTS_DIR, 'adsb_messages_ok.txt')))))
+        later = record._replace(gen_date_time=record.gen_date_time.replace(microsecond=311999),
+                                log_date_time=record.log_date_time.replace(microsecond=999999))
+        deduplicator = self.MessageDeduplicator()
+
+        self.assertEqual(deduplicator.key(later), deduplicator.key(record))
+        self.assertNotEqual(deduplicator.key(record._replace(altitude=-1)), deduplicator.key(record))
+        self.assertEqual(deduplicator.key(record)[:2], (record.hexident, record.transmission_type))
+
+    def test_duplicate(self):
+        deduplicator = self.MessageDeduplicator()
+
+        self.assertFalse(deduplicator.is_duplicate(MSG_A, 0))
+        self.assertTrue(deduplicator.is_duplicate(MSG_A, 1))
+        self.assertFalse(deduplicator.is_duplicate(MSG_B, 1), msg="Other transmission type must not be a duplicate")
+        self.assertFalse(deduplicator.is_duplicate(MSG_A_LATE, 1), msg="Other generation time must not be a duplicate")
+
+    def test_same_source(self):
+        """Messages with the same key from the same source must not be duplicates."""
+        deduplicator = self.MessageDeduplicator()
+
+        self.assertFalse(deduplicator.is_duplicate(MSG_A, 0))
+        self.assertFalse(deduplicator.is_duplicate(MSG_A, 0))
+        self.assertTrue(deduplicator.is_duplicate(MSG_A, 1))
+
+    def test_time_digits(self):
+        deduplicator = self.MessageDeduplicator(time_digits=1)
+
+        self.assertFalse(deduplicator.is_duplicate(MSG_A, 0))
+        self.assertTrue(deduplicator.is_duplicate(MSG_A_LATE, 1))
+
+    @patch('dump1090_postgis.fan_in.time.monotonic')
+    def test_window(self, monotonic):
+        deduplicator = self.MessageDeduplicator(window=2.0)
+
+        monotonic.return_value = 100.0
+        self.assertFalse(deduplicator.is_duplicate(MSG_A, 0))
+        monotonic.return_value = 101.0
+        self.assertFalse(deduplicator.is_duplicate(MSG_B, 0))
+        self.assertTrue(deduplicator.is_duplicate(MSG_A, 1))
+        monotonic.return_value = 102.5
+        self.assertFalse(deduplicator.is_duplicate(MSG_A, 1), msg="Message must be expired after the window")
+        self.assertEqual(len(deduplicator), 2)
+
+    def test_max_size(self):
+        deduplicator = self.MessageDeduplicator(max_size=1)
+
+        deduplicator.is_duplicate(MSG_A, 0)
+        deduplicator.is_duplicate(MSG_B, 0)
+        self.assertEqual(len(deduplicator), 1)
+        self.assertFalse(deduplicator.is_duplicate(MSG_A, 1))
+
+
+class TestMultiSource(unittest.TestCase):
+
+    def setUp(self):
+        with patch('os.environ'):
+            from dump1090_postgis.adsb_parser import FileSource, MessageStream
+            from dump1090_postgis.fan_in import AsyncMultiSource, MultiSource
+
+        self.file_path = os.path.join(TESTS_DIR, 'adsb_message_stream.txt')
+        self.FileSource = FileSource
+        self.MessageStream = MessageStream
+        self.MultiSource = MultiSource
+        self.AsyncMultiSource = AsyncMultiSource
+
+    def test_merge(self):
+        """Merging two receivers of the same messages must yield every message once."""
+        single = list(self.FileSource(self.file_path))
+        multi_source = self.MultiSource([self.FileSource(self.file_path), self.FileSource(self.file_path)])
+        merged = list(multi_source)
+
+        self.assertIsInstance(multi_source, self.MessageStream)
+        self.assertCountEqual(merged, single)
+        statistics = multi_source.statistics
+        self.assertEqual(statistics[0]['received'], len(single))
+        self.assertEqual(statistics[0]['unique'] + statistics[1]['unique'], len(single))
+
+    def test_merge_beast(self):
+        """Records of several Beast receivers are merged without duplicates, although their clocks differ."""
+        with patch('os.environ'):
+            from dump1090_postgis.adsb_parser import AdsbMessage
+            from dump1090_postgis.beast import BeastFileSource
+        from tests.test_beast import IDENTIFICATION, POSITION_EVEN, POSITION_ODD, VELOCITY, beast_frame
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        file_paths = []
+        for index, timestamp in enumerate((12000000, 98765432)):
+            file_paths.append(os.path.join(directory.name, 'receiver{}.bin'.format(index)))
+            with open(file_paths[-1], 'wb') as f:
+                for message in (IDENTIFICATION, POSITION_EVEN, POSITION_ODD, VELOCITY):
+                    f.write(beast_frame(message, timestamp=timestamp))
+
+        multi_source = self.MultiSource([BeastFileSource(file_path) for file_path in file_paths])
+        self.assertTrue(multi_source.YIELDS_RECORDS)
+        records = list(AdsbMessage(multi_source))
+
+        self.assertEqual(sorted(msg.transmission_type for msg in records), [1, 3, 3, 4])
+        self.assertEqual(sum(counters['unique'] for counters in multi_source.statistics), 4)
+        with self.assertRaises(ValueError):
+            self.MultiSource([BeastFileSource(file_paths[0]), self.FileSource(self.file_path)])
+
+    def test_merge_async(self):
+        from dump1090_postgis.adsb_parser import AsyncMessageStream
+
+        single = list(self.FileSource(self.file_path))
+
+        class AsyncListSource(AsyncMessageStream):
+            async def __aiter__(self):
+                for msg in single:
+                    yield msg
+
+            exception = ConnectionError
+
+            async def _initiate_stream(self):
+                pass
+
+        async def merge():
+            return [msg async for msg in self.AsyncMultiSource([AsyncListSource(), AsyncListSource()])]
+
+        self.assertCountEqual(asyncio.run(merge()), single)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,14 @@
+import datetime
+import os
+import tempfile
 import unittest
+from types import SimpleNamespace
 from unittest.mock import patch, Mock, MagicMock
 import sqlalchemy.orm
 
-from dump1090_postgis.airports import Airport, _nte_runway_21
+from dump1090_postgis.airports import RunwayIndex, _nte_runway_21
 from tests import msg3_valid
-from tests.test_adsb_parser import AdsbMessageStub
+from tests.test_adsb_parser import AdsbMessageStub, TESTS_DIR, busiest_aircraft
 from tests.test_models import position_config_0
 
 @unittest.skip("")
@@ -58,6 +62,218 @@ class TestCurrentFlights(unittest.TestCase):
             self.assertTrue(self.current_flights.prune.called_once())
 
 
+class TestPrune(unittest.TestCase):
+    T0 = datetime.datetime(2019, 10, 20, 11, 33, 40, tzinfo=datetime.timezone.utc)
+
+    def setUp(self) -> None:
+        with patch('os.environ', return_value="ENV_VAR"):
+            from dump1090_postgis.clock import StreamClock
+            from dump1090_postgis.flights import CurrentFlights
+            from dump1090_postgis.models import Flight
+
+        self.Flight = Flight
+        self.clock = StreamClock()
+        self.current_flights = CurrentFlights(Mock(spec=sqlalchemy.orm.session.Session), autocommit=False,
+                                              clock=self.clock)
+
+    def flight(self, hexident, seconds):
+        flight = self.Flight(hexident)
+        flight.last_seen = self.T0 + datetime.timedelta(seconds=seconds)
+        self.current_flights[hexident] = flight
+        return flight
+
+    def prune_at(self, seconds):
+        self.clock.observe(self.T0 + datetime.timedelta(seconds=seconds))
+        self.current_flights.prune()
+        return set(self.current_flights.hexidents())
+
+    def test_max_age(self):
+        """Flights are removed once older than MAX_AGE, not earlier, also if seen after their entry was pushed."""
+        max_age = self.current_flights.MAX_AGE
+        flight = self.flight('hex1', 0)
+        self.flight('hex2', 100)
+
+        self.assertEqual(self.prune_at(max_age), {'hex1', 'hex2'})
+        flight.last_seen = self.T0 + datetime.timedelta(seconds=max_age)
+        self.assertEqual(self.prune_at(max_age + 101), {'hex1'})
+        self.assertEqual(self.prune_at(2 * max_age), {'hex1'})
+        self.assertEqual(self.prune_at(2 * max_age + 1), set())
+
+    def test_reappearing(self):
+        """The entry of a removed flight does not remove a new flight of the same aircraft."""
+        max_age = self.current_flights.MAX_AGE
+        self.flight('hex1', 0)
+        self.assertEqual(self.prune_at(max_age + 1), set())
+        self.flight('hex1', max_age + 1)
+        self.flight('hex1', max_age + 2)  # Replaced again, before its first entry is due
+
+        self.assertEqual(self.prune_at(2 * max_age + 2), {'hex1'})
+        self.assertEqual(self.prune_at(2 * max_age + 3), set())
+        self.assertEqual(self.current_flights._expiry, [])
+
+
+class TestReleasePositions(unittest.TestCase):
+
+    def test_release_positions(self):
+        """Released positions leave the flight and its session, the recent positions are kept."""
+        with patch('os.environ', return_value="ENV_VAR"):
+            from dump1090_postgis.models import Flight
+
+        messages, hexident = busiest_aircraft()
+        session = sqlalchemy.orm.Session()
+        with patch.object(Flight, 'POSITION_WINDOW', 2):
+            flight = Flight(hexident)
+        session.add(flight)
+        for msg in messages:
+            if msg.hexident == hexident:
+                flight.update(msg)
+        positions = list(flight.positions)
+        self.assertGreater(len(positions), 2)
+        self.assertTrue(all(position in session for position in positions))
+
+        self.assertEqual(flight.release_positions(), len(positions))
+        self.assertEqual(list(flight.positions), [])
+        self.assertEqual(list(flight.recent_positions), positions[-2:])
+        self.assertFalse(any(position in session for position in positions))
+        self.assertIn(flight, session)
+        self.assertFalse(session.dirty)
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self) -> None:
+        with patch('os.environ', return_value="ENV_VAR"):
+            from dump1090_postgis.adsb_parser import AdsbMessage, AdsbMessageFilter, FileSource
+            from dump1090_postgis.clock import StreamClock
+            from dump1090_postgis.flights import CurrentFlights
+            from dump1090_postgis.snapshot import PoolSnapshot
+
+        self.AdsbMessageFilter = AdsbMessageFilter
+        self.CurrentFlights = CurrentFlights
+        self.StreamClock = StreamClock
+        self.messages = list(AdsbMessage(FileSource(os.path.join(TESTS_DIR, 'adsb_message_stream.txt'))))
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.snapshot = PoolSnapshot(os.path.join(directory.name, 'flights.json.gz'))
+
+    def pool(self, session):
+        clock = self.StreamClock()
+        clock.observe(self.messages[-1].gen_date_time)
+        return self.CurrentFlights(session, adsb_filter=self.AdsbMessageFilter(), autocommit=False, clock=clock,
+                                   snapshot=self.snapshot)
+
+    def test_restore(self):
+        """Flights with a row are saved on close and continue on their rows after a restart, without queries."""
+        current_flights = self.pool(Mock(spec=sqlalchemy.orm.session.Session))
+        self.assertEqual(len(current_flights), 0)
+        current_flights.update_batch(self.messages)
+        flights = sorted(current_flights, key=lambda flight: flight.hexident)
+        self.assertGreater(len(flights), 1)
+        for flight_id, flight in enumerate(flights[1:], 1):  # The first flight was not flushed yet
+            flight.id = flight_id
+        current_flights.close()
+
+        session = Mock(spec=sqlalchemy.orm.session.Session)
+        restored = self.pool(session)
+        self.assertEqual(set(restored.hexidents()), {flight.hexident for flight in flights[1:]})
+        self.assertEqual({flight.hexident for (flight,), _ in session.add.call_args_list}, set(restored.hexidents()))
+        session.query.assert_not_called()
+        for flight in flights[1:]:
+            self.assertEqual(restored[flight.hexident].id, flight.id)
+            self.assertEqual(restored[flight.hexident]._onground, flight._onground)
+            self.assertEqual([position.time for position in restored[flight.hexident].recent_positions],
+                             [position.time for position in flight.recent_positions])
+
+
+class TestReattach(unittest.TestCase):
+    T0 = datetime.datetime(2019, 10, 20, 11, 33, 40, tzinfo=datetime.timezone.utc)
+    GAP = 900
+
+    def setUp(self) -> None:
+        with patch('os.environ', return_value="ENV_VAR"):
+            from dump1090_postgis.adsb_parser import AdsbMessageFilter
+            from dump1090_postgis.clock import StreamClock
+            from dump1090_postgis.flights import CurrentFlights
+            from dump1090_postgis.models import Intention
+
+        self.Intention = Intention
+        self.session = Mock(spec=sqlalchemy.orm.session.Session)
+        self.lookup = self.session.query.return_value.filter.return_value.order_by.return_value.all
+        self.lookup.return_value = []
+        self.current_flights = CurrentFlights(self.session, adsb_filter=AdsbMessageFilter(), autocommit=False,
+                                              clock=StreamClock(), reattach_gap=self.GAP)
+
+    def update(self, seconds, hexident=msg3_valid['hexident']):
+        gen_date_time = self.T0 + datetime.timedelta(seconds=seconds)
+        self.current_flights.update(SimpleNamespace(**dict(msg3_valid, hexident=hexident, gen_date_time=gen_date_time,
+                                                           log_date_time=gen_date_time)))
+        return self.current_flights._flights.get(hexident)
+
+    def remove(self, flight, seconds):
+        """Let the flight age out of the pool, by a message of another aircraft."""
+        self.update(seconds, hexident='other')
+        self.assertNotIn(flight.hexident, self.current_flights.hexidents())
+
+    def test_recent_flight(self):
+        """An aircraft reappearing within the gap continues its flight, without a database lookup."""
+        flight = self.update(0)
+        flight.id = 7
+        self.remove(flight, self.current_flights.MAX_AGE + 1)
+        self.lookup.reset_mock()
+
+        self.assertIs(self.update(self.GAP), flight)
+        self.assertEqual(flight.last_seen, self.T0 + datetime.timedelta(seconds=self.GAP))
+        self.lookup.assert_not_called()
+
+    def test_gap_exceeded(self):
+        flight = self.update(0)
+        flight.id = 7
+        self.remove(flight, self.current_flights.MAX_AGE + 1)
+
+        reappeared = self.update(self.GAP + 1)
+        self.assertIsNot(reappeared, flight)
+        self.assertIsNone(reappeared.id)
+
+    def test_lookup(self):
+        """The aircraft continue their last flights in the database seen within the gap, loaded by a single query."""
+        hexident = msg3_valid['hexident']
+        rows = [SimpleNamespace(id=flight_id, hexident=hexident, callsign='RYR1', first_seen=first_seen,
+                                last_seen=first_seen + datetime.timedelta(seconds=200),
+                                intention=self.Intention.arrival)
+                for flight_id, first_seen in ((41, self.T0 - datetime.timedelta(seconds=850)),
+                                              (42, self.T0 - datetime.timedelta(seconds=600)))]
+        self.lookup.return_value = rows
+
+        flight = self.update(0)
+        self.assertEqual((flight.id, flight.callsign, flight.first_seen, flight.intention),
+                         (42, 'RYR1', rows[1].first_seen, self.Intention.arrival))
+        self.assertEqual(flight.last_seen, self.T0)
+        self.session.add.assert_called_once_with(flight)
+
+        # Further aircraft are not looked up
+        self.assertIsNone(self.update(1, hexident='other').id)
+        self.session.query.assert_called_once()
+
+    def test_lookup_shard(self):
+        """The pool of a shard worker loads only the recent flights of the aircraft of its shard."""
+        with patch('os.environ', return_value="ENV_VAR"):
+            from dump1090_postgis.clock import StreamClock
+            from dump1090_postgis.flights import CurrentFlights
+            from dump1090_postgis.sharding import shard_of
+
+        self.lookup.return_value = [SimpleNamespace(id=flight_id, hexident=hexident, callsign=None,
+                                                    first_seen=self.T0 - datetime.timedelta(seconds=600),
+                                                    last_seen=self.T0 - datetime.timedelta(seconds=400),
+                                                    intention=self.Intention.unknown)
+                                    for flight_id, hexident in enumerate(('4CA7E8', '4CA7E9', '4CA7EA'))]
+        self.current_flights = CurrentFlights(self.session, autocommit=False, clock=StreamClock(),
+                                              reattach_gap=self.GAP, shard=(shard_of('4CA7E9', 3), 3))
+        self.current_flights._load_recent_flights(self.T0)
+
+        self.assertEqual(list(self.current_flights._recent_flights), ['4CA7E9'])
+        self.assertEqual(self.update(0, hexident='4CA7E9').id, 1)
+
+
 class TestLandingAndTakeoffManager(unittest.TestCase):
 
     def setUp(self) -> None:
@@ -78,10 +294,12 @@ class TestLandingAndTakeoffManager(unittest.TestCase):
         self.session_mock.add = Mock()
         self.session_mock.commit = Mock()
 
-        self.airport_mock = Mock(spec=Airport)
-        self.airport_mock.get_runway.return_value = _nte_runway_21
+        self.runways_mock = Mock(spec=RunwayIndex)
+        self.runways_mock.get_runway.return_value = _nte_runway_21
 
-        LandingAndTakeoffManager._airports = [self.airport_mock]
+        self.addCleanup(setattr, LandingAndTakeoffManager, '_runways', LandingAndTakeoffManager._runways)
+        LandingAndTakeoffManager._runways = self.runways_mock
+        self.LandingAndTakeoffManager = LandingAndTakeoffManager
         self.lt_manager = LandingAndTakeoffManager(self.session_mock)
 
     def test_callback(self):
@@ -89,6 +307,27 @@ class TestLandingAndTakeoffManager(unittest.TestCase):
         self.assertTrue(self.lt_manager._LandingAndTakeoffManager__session.add.called)
         self.assertTrue(self.lt_manager._LandingAndTakeoffManager__session.commit.called)
 
+    def test_event_bus(self):
+        """With an event bus, the callback returns at once; Attributed events wait for the owner of the session."""
+        from dump1090_postgis.events import EventBus
+
+        event_bus = EventBus()
+        lt_manager = self.LandingAndTakeoffManager(self.session_mock, event_bus=event_bus)
+        self.flight_mock.interpolated_track = 210.0
+        self.position_mock.xyz = (-1.6, 47.15, 0.0)
+        lt_manager.on_landing_callback(self.position_mock, self.flight_mock)
+        event_bus.close()
+
+        # The subscriber receives a copy of the position and the track at the time of the event
+        point, track = self.runways_mock.get_runway.call_args[0]
+        self.assertEqual((point.x, point.y, track), (-1.6, 47.15, 210.0))
+        self.session_mock.add.assert_not_called()
+        self.assertEqual(lt_manager.add_pending_events(), 1)
+        landing = self.session_mock.add.call_args[0][0]
+        self.assertIsInstance(landing, self.Landings)
+        self.assertEqual(landing.time, self.position_mock.time)
+        self.session_mock.commit.assert_not_called()
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,7 +1,9 @@
+import json
 import unittest
 import datetime
 from unittest.mock import patch, Mock
 import shapely.geometry
+import sqlalchemy.orm
 
 position_config_0 = {
     "id": 1000,
@@ -134,5 +136,65 @@ class TestFlightModel(unittest.TestCase):
             self.assertTrue(warning.called_once())
 
 
+
+class TestPosition(unittest.TestCase):
+
+    def setUp(self):
+        with patch('os.environ'):
+            from dump1090_postgis import models
+
+        self.models = models
+
+    def test_coordinates(self):
+        """Coordinates are kept as floats, the geometry is rendered as EWKT on insert."""
+        position = self.models.Position(time=datetime.datetime.fromtimestamp(0), lon=-1.6, lat=47.15, alt=300.0)
+        self.assertEqual((position.lon, position.lat, position.alt), (-1.6, 47.15, 300.0))
+        self.assertEqual(position.point, shapely.geometry.Point(-1.6, 47.15, 300.0))
+        self.assertIsNone(position.coordinates)
+
+        self.models._render_coordinates(None, None, position)
+        self.assertEqual(position.coordinates, 'SRID=4326;POINT Z (-1.6 47.15 300.0)')
+
+    def test_loaded_geometry(self):
+        """Positions loaded from the database decode their geometry."""
+        from geoalchemy2.shape import from_shape
+
+        position = self.models.Position(coordinates=from_shape(shapely.geometry.Point(-1.6, 47.15, 300.0), srid=4326))
+        self.assertEqual(position.xyz, (-1.6, 47.15, 300.0))
+
+
+class TestFlightState(unittest.TestCase):
+
+    def test_round_trip(self):
+        """A flight restored from its state continues on its row, with its onground status and recent positions."""
+        from sqlalchemy import inspect
+        with patch('os.environ'):
+            from dump1090_postgis.models import Flight
+            from tests.test_adsb_parser import busiest_aircraft
+
+        messages, hexident = busiest_aircraft()
+        flight = Flight(hexident)
+        for msg in messages:
+            if msg.hexident == hexident:
+                flight.update(msg)
+        flight.id = 42
+
+        restored = Flight.from_state(json.loads(json.dumps(flight.get_state())))
+        self.assertTrue(inspect(restored).detached)
+        self.assertEqual(list(restored.positions), [])
+        for attribute in ('id', 'hexident', 'callsign', 'first_seen', 'last_seen', 'intention', '_onground', 'track',
+                          '_last_event', 'interpolated_track'):
+            self.assertEqual(getattr(restored, attribute), getattr(flight, attribute))
+        self.assertEqual([(position.time, position.xyz, position.onground) for position in restored.recent_positions],
+                         [(position.time, position.xyz, position.onground) for position in flight.recent_positions])
+
+        # Added to a session, the flight is updated instead of inserted
+        session = sqlalchemy.orm.Session()
+        session.add(restored)
+        restored.last_seen = messages[-1].gen_date_time
+        self.assertIn(restored, session.dirty)
+        self.assertNotIn(restored, session.new)
+
+
 if __name__ == '__main__':
     unittest.main()
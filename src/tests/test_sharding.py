@@ -0,0 +1,83 @@
+import os
+import unittest
+from unittest.mock import patch
+
+from tests.test_adsb_parser import TESTS_DIR
+
+MESSAGE_STREAM = os.path.join(TESTS_DIR, 'adsb_message_stream.txt')
+
+
+class ShardPoolStub:
+    """Flights pool of a worker process, counting aircraft; Fails if the messages of an aircraft are out of order."""
+
+    def __init__(self):
+        self.last_seen = {}
+
+    def __len__(self):
+        return len(self.last_seen)
+
+    def close(self):
+        pass
+
+    def update_batch(self, batch):
+        for adsb_message in batch:
+            assert adsb_message.log_date_time >= self.last_seen.get(adsb_message.hexident, adsb_message.log_date_time)
+            self.last_seen[adsb_message.hexident] = adsb_message.log_date_time
+
+
+def shard_pool_stub(index, shards):
+    return ShardPoolStub()
+
+
+def failing_pool_stub(index, shards):
+    raise RuntimeError("Database unavailable")
+
+
+# The spawned workers import config to unpickle the messages; They inherit the environment of the test on start
+WORKER_ENVIRONMENT = {'DUMP1090_HOST': 'localhost', 'DUMP1090_PORT': '30003', 'POSTGRES_HOST': 'localhost',
+                      'POSTGRES_PORT': '5432', 'POSTGRES_USER': 'user', 'POSTGRES_PW': 'password',
+                      'POSTGRES_DB': 'adsb'}
+
+
+class TestSharding(unittest.TestCase):
+
+    def setUp(self):
+        with patch('os.environ'):
+            from dump1090_postgis.adsb_parser import AdsbMessage, FileSource
+            from dump1090_postgis.sharding import ShardedFlights, shard_of
+
+        self.ShardedFlights = ShardedFlights
+        self.shard_of = shard_of
+        self.messages = list(AdsbMessage(FileSource(MESSAGE_STREAM)))
+
+    def test_shard_of(self):
+        self.assertEqual(self.shard_of('4CA7E8', 4), 0x4CA7E8 % 4)
+        self.assertEqual(self.shard_of('', 4), 0)
+        shards = {self.shard_of(msg.hexident, 3) for msg in self.messages}
+        self.assertEqual(shards, {0, 1, 2})
+
+    def test_workers(self):
+        """Each aircraft is tracked by exactly one worker, which receives its messages in order."""
+        with patch.dict('os.environ', WORKER_ENVIRONMENT):
+            flights_pool = self.ShardedFlights(3, shard_pool_stub)
+        for start in range(0, len(self.messages), 100):
+            flights_pool.update_batch(self.messages[start:start + 100])
+        flights_pool.update(self.messages[-1])
+        flights_pool.close()
+
+        self.assertEqual(len(flights_pool), len({msg.hexident for msg in self.messages}))
+
+    def test_dead_worker(self):
+        """The router fails loudly instead of blocking when a worker died."""
+        sharded_class = type('ShardedFlights', (self.ShardedFlights,), {'QSIZE': 2, 'PUT_TIMEOUT': 0.1})
+        with patch.dict('os.environ', WORKER_ENVIRONMENT):
+            flights_pool = sharded_class(1, failing_pool_stub)
+        self.addCleanup(flights_pool.close)
+
+        with self.assertRaisesRegex(RuntimeError, 'Shard worker 0 died'):
+            for start in range(0, len(self.messages), 100):
+                flights_pool.update_batch(self.messages[start:start + 100])
+
+
+if __name__ == '__main__':
+    unittest.main()
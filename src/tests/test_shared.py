@@ -1,9 +1,19 @@
 import unittest
 
+import datetime
+import math
 from unittest.mock import Mock
-from shapely.geometry import Point
 
-from dump1090_postgis.shared import angle2compass, interpolate_track
+import numpy as np
+
+from dump1090_postgis.shared import angle2compass, fuse_track, heading_difference, interpolate_track, \
+    interpolate_tracks
+
+T0 = datetime.datetime(2019, 10, 20, 11, 33, 40, tzinfo=datetime.timezone.utc)
+
+
+def position(lon, lat, seconds=0):
+    return Mock(lon=lon, lat=lat, time=T0 + datetime.timedelta(seconds=seconds))
 
 
 class TestFunctions(unittest.TestCase):
@@ -16,10 +26,50 @@ class TestFunctions(unittest.TestCase):
         self.assertAlmostEqual(angle2compass(91), 359, 3)
 
     def test_interpolate_track(self):
-        self.assertAlmostEqual(interpolate_track([Mock(point=Point(0, 0)), Mock(point=Point(-1, 0))]), 270, 3)  # Heading west
-        self.assertAlmostEqual(interpolate_track([Mock(point=Point(0, 0)), Mock(point=Point(0, 1))]), 0, 3)  # Heading north
-        self.assertAlmostEqual(interpolate_track([Mock(point=Point(0, 0)), Mock(point=Point(-1, -1))]), 225, 3)  # Heading southwest
+        self.assertAlmostEqual(interpolate_track([position(0, 0), position(-1, 0)]), 270, 3)  # Heading west
+        self.assertAlmostEqual(interpolate_track([position(0, 0), position(0, 1)]), 0, 3)  # Heading north
+        self.assertAlmostEqual(interpolate_track([position(0, 0), position(-1e-3, -1e-3)]), 225, 3)  # Heading southwest
+        self.assertIsNone(interpolate_track([position(0, 0)]))
+        self.assertIsNone(interpolate_track([position(0, 0), position(0, 0)]))
+
+    def test_interpolate_track_latitude(self):
+        """Longitudes are scaled by cos(latitude), a degree of longitude is shorter than a degree of latitude."""
+        track = interpolate_track([position(0, 60), position(1, 61)])
+        self.assertAlmostEqual(track, 90 - math.degrees(math.atan2(1, math.cos(math.radians(61)))), 3)
+
+    def test_interpolate_track_least_squares(self):
+        """The jitter of positions along a straight track is smoothed out."""
+        jitter = [0.0002, -0.0002, 0.0, 0.0, -0.0002, 0.0002]
+        positions = [position(i * 0.001, dy, i) for i, dy in enumerate(jitter)]
+        self.assertAlmostEqual(interpolate_track(positions), 90, 3)
+        self.assertGreater(heading_difference(interpolate_track(positions[-2:]), 90), 10)
+
+    def test_fuse_track(self):
+        self.assertAlmostEqual(heading_difference(fuse_track(350, 10, 0.5), 0), 0, 3)
+        self.assertAlmostEqual(fuse_track(350, 10, 0.0), 350, 3)
+        self.assertAlmostEqual(interpolate_track([position(0, 0), position(0, 1)], reported_track=20,
+                                                 reported_weight=0.5), 10, 3)
+        self.assertEqual(interpolate_track([position(0, 0)], reported_track=20, reported_weight=0.5), 20)
+
+    def test_heading_difference(self):
+        self.assertAlmostEqual(heading_difference(355, 5), 10, 3)
+        self.assertAlmostEqual(heading_difference(5, 355), 10, 3)
+        self.assertAlmostEqual(heading_difference(30, 210), 180, 3)
+
+    def test_interpolate_tracks(self):
+        """The batch version equals interpolate_track over each window of positions."""
+        rng = np.random.default_rng(0)
+        times = np.round(np.cumsum(rng.uniform(0.5, 2.0, 50)), 3)  # Exact as timedelta
+        lon = -1.6 + np.cumsum(rng.normal(0.001, 0.0005, 50))
+        lat = 47.1 + np.cumsum(rng.normal(0.0005, 0.0005, 50))
+        positions = [position(x, y, t) for t, x, y in zip(times, lon, lat)]
 
+        for window in (2, 4):
+            tracks = interpolate_tracks(times, lon, lat, window=window)
+            self.assertTrue(np.isnan(tracks[:window - 1]).all())
+            for i in range(window - 1, len(positions)):
+                self.assertAlmostEqual(tracks[i], interpolate_track(positions[i - window + 1:i + 1]), 6)
+        self.assertRaises(ValueError, interpolate_tracks, times, lon, lat, 1)
 
 if __name__ == '__main__':
     unittest.main()
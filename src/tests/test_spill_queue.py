@@ -0,0 +1,122 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+
+class TestSpillQueue(unittest.TestCase):
+
+    def setUp(self):
+        with patch('os.environ'):
+            from dump1090_postgis.spill_queue import SpillQueue
+
+        self.SpillQueue = SpillQueue
+        self.spill_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.spill_dir)
+
+    def drain(self, spill_queue) -> list:
+        items = []
+        while True:
+            item = spill_queue.get()
+            if item is self.SpillQueue.CLOSED:
+                return items
+            items.append(item)
+
+    def test_memory(self):
+        spill_queue = self.SpillQueue(maxsize=10, spill_dir=self.spill_dir)
+        for i in range(10):
+            spill_queue.put(i)
+        spill_queue.close()
+
+        self.assertEqual(self.drain(spill_queue), list(range(10)))
+        self.assertEqual(spill_queue.spilled_items, 0)
+        self.assertEqual(os.listdir(self.spill_dir), [])
+
+    def test_spill(self):
+        """Items beyond maxsize are spilled across segments and returned in order, also when put while draining."""
+        spill_queue = self.SpillQueue(maxsize=10, spill_dir=self.spill_dir, segment_size=200)
+        for i in range(100):
+            spill_queue.put(('msg', i))
+
+        self.assertEqual(spill_queue.qsize(), 100)
+        self.assertTrue(spill_queue.spilling)
+        segment_dir, = os.listdir(self.spill_dir)
+        self.assertGreater(len(os.listdir(os.path.join(self.spill_dir, segment_dir))), 1)
+
+        items = [spill_queue.get() for _ in range(50)]
+        for i in range(100, 120):
+            spill_queue.put(('msg', i))  # Appended to disk behind the spilled items
+        spill_queue.close()
+        items += self.drain(spill_queue)
+
+        self.assertEqual(items, [('msg', i) for i in range(120)])
+        self.assertEqual(spill_queue.spilled_items, 110)
+        self.assertGreater(spill_queue.spilled_bytes, 0)
+        self.assertFalse(spill_queue.spilling)
+        self.assertEqual(os.listdir(self.spill_dir), [])
+
+    def test_back_to_memory(self):
+        """Once the consumer caught up, items are kept in memory again."""
+        spill_queue = self.SpillQueue(maxsize=2, spill_dir=self.spill_dir)
+        for i in range(5):
+            spill_queue.put(i)
+        self.assertEqual([spill_queue.get() for _ in range(5)], list(range(5)))
+
+        spill_queue.put(5)
+        self.assertEqual(spill_queue.spilled_items, 3)
+        self.assertEqual(spill_queue.get(), 5)
+
+    def test_cleanup(self):
+        """Cleaning up deletes the remaining segment files and their directory."""
+        spill_queue = self.SpillQueue(maxsize=2, segment_size=200)
+        for i in range(50):
+            spill_queue.put(i)
+        spill_queue.get()
+        segment_dir = spill_queue._segment_dir
+        self.assertGreater(len(os.listdir(segment_dir)), 1)
+
+        spill_queue.cleanup()
+        spill_queue.cleanup()
+
+        self.assertFalse(os.path.exists(segment_dir))
+        self.assertEqual(spill_queue.qsize(), 0)
+        spill_queue.close()
+        self.assertIs(spill_queue.get(), self.SpillQueue.CLOSED)
+
+    def test_shared_spill_dir(self):
+        """Queues spilling into the same directory at the same time keep their segments apart."""
+        spill_queues = [self.SpillQueue(maxsize=2, spill_dir=self.spill_dir, segment_size=200) for _ in range(2)]
+        for i in range(50):
+            for index, spill_queue in enumerate(spill_queues):
+                spill_queue.put((index, i))
+        self.assertEqual(len(os.listdir(self.spill_dir)), 2)
+
+        for index, spill_queue in enumerate(spill_queues):
+            spill_queue.close()
+            self.assertEqual(self.drain(spill_queue), [(index, i) for i in range(50)])
+        self.assertEqual(os.listdir(self.spill_dir), [])
+
+    def test_threads(self):
+        """A slow consumer receives all items of a fast producer in order."""
+        spill_queue = self.SpillQueue(maxsize=100, segment_size=4096)
+
+        def produce():
+            for i in range(20000):
+                spill_queue.put(i)
+            spill_queue.close()
+
+        producer = threading.Thread(target=produce)
+        producer.start()
+        items = self.drain(spill_queue)
+        producer.join()
+
+        self.assertEqual(items, list(range(20000)))
+        self.assertRaises(ValueError, spill_queue.put, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
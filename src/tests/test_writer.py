@@ -0,0 +1,233 @@
+import datetime
+import itertools
+import os
+import time
+import unittest
+from unittest.mock import MagicMock, Mock, patch
+
+import psycopg2
+import sqlalchemy.orm
+from sqlalchemy.exc import OperationalError
+
+from tests.test_adsb_parser import TESTS_DIR
+
+T0 = datetime.datetime(2019, 10, 20, 11, 33, 40, tzinfo=datetime.timezone.utc)
+
+
+class EngineStub:
+    """Engine whose connection records the executed statements by table name, with ids from a sequence counter."""
+
+    def __init__(self, failures: int = 0, copy_failures: int = 0, copy_error: type = psycopg2.OperationalError):
+        self.statements = []  # Tuples (table name or 'nextval', parameters)
+        self.commits = 0
+        self._failures = failures
+        self._copy_failures = copy_failures
+        self._copy_error = copy_error
+        self._sequence = 100
+        self.connection = MagicMock()
+        self.connection.execute.side_effect = self._execute
+        cursor = self.connection.connection.cursor.return_value.__enter__.return_value
+        cursor.copy_expert.side_effect = self._copy
+        self.connection.begin.return_value.__exit__.side_effect = self._end_transaction
+
+    def connect(self):
+        context = MagicMock()
+        context.__enter__.return_value = self.connection
+        return context
+
+    def _execute(self, statement, *multiparams, **params):
+        table = getattr(getattr(statement, 'table', None), 'name', None)
+        if table is None:  # nextval() of the flights sequence
+            result = Mock()
+            result.fetchall.return_value = [(self._sequence + i,) for i in range(1, params['count'] + 1)]
+            self._sequence += params['count']
+            self.statements.append(('nextval', params['count']))
+            return result
+
+        if self._failures:
+            self._failures -= 1
+            raise OperationalError(str(statement), {}, Exception("Connection lost"))
+        self.statements.append((table, multiparams[0]))
+
+    def _copy(self, statement, buffer):
+        """Record COPY statements as rows of text values."""
+        if self._copy_failures:
+            self._copy_failures -= 1
+            raise self._copy_error("COPY failed")
+        table = statement.split()[1]
+        self.statements.append((table, [line.split('\t') for line in buffer.read().splitlines()]))
+
+    def _end_transaction(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.commits += 1
+        return False
+
+
+class TestFlightWriter(unittest.TestCase):
+
+    def setUp(self):
+        with patch('os.environ'):
+            from dump1090_postgis import models
+            from dump1090_postgis.writer import FlightWriter
+
+        self.models = models
+        self.FlightWriter = FlightWriter
+        self.flight = models.Flight('4CA7E8')
+        self.flight.callsign = 'RYR1'
+        self.flight.first_seen = self.flight.last_seen = T0
+
+    def position(self, seconds):
+        return self.models.Position(time=T0 + datetime.timedelta(seconds=seconds), lon=-1.6, lat=47.15,
+                                    alt=float(seconds), onground=False)
+
+    def test_group_commit(self):
+        """Intents submitted within max_latency are committed together, with the reserved flight id."""
+        engine = EngineStub()
+        writer = self.FlightWriter(engine, max_batch=100, max_latency=0.5)
+
+        key = writer.new_flight(self.flight)
+        writer.new_positions(key, [self.position(0), self.position(1)])
+        for seconds in (1, 2):
+            self.flight.last_seen = T0 + datetime.timedelta(seconds=seconds)
+            writer.update_flight(key, self.flight)
+        writer.event(key, self.models.Landings, T0, '21')
+        writer.close_flight(key)
+        writer.close()
+
+        self.assertEqual(engine.commits, 1)
+        tables = dict(engine.statements)
+        inserts, updates = [params for table, params in engine.statements if table == 'flights']
+        self.assertEqual(inserts[0]['id'], 101)
+        self.assertEqual(tables['positions'], [['101', (T0 + datetime.timedelta(seconds=seconds)).isoformat(),
+                                                 'SRID=4326;POINT Z (-1.6 47.15 {!r})'.format(float(seconds)), 'f']
+                                                for seconds in (0, 1)])
+        # Updates of a flight are merged into the latest one
+        self.assertEqual(updates, [{'_id': 101, 'callsign': 'RYR1', 'last_seen': T0 + datetime.timedelta(seconds=2),
+                                    'intention': self.models.Intention.unknown}])
+        self.assertEqual(tables['landings'], [{'flight_id': 101, 'time': T0, 'runway': '21'}])
+        self.assertEqual(writer.statistics['intents'], 6)
+
+    def test_max_batch(self):
+        engine = EngineStub()
+        writer = self.FlightWriter(engine, max_batch=2, max_latency=10)
+        key = writer.new_flight(self.flight)
+        for seconds in range(5):
+            writer.new_positions(key, [self.position(seconds)])
+        writer.close()
+
+        self.assertEqual(engine.commits, 3)
+        positions = [row for table, rows in engine.statements if table == 'positions' for row in rows]
+        self.assertEqual([row[1] for row in positions], [(T0 + datetime.timedelta(seconds=s)).isoformat()
+                                                         for s in range(5)])
+        self.assertEqual({row[0] for row in positions}, {'101'})
+
+    def test_retry(self):
+        """A group failing to commit is retried, its flight ids are only remembered when committed."""
+        engine = EngineStub(failures=1)
+        writer = self.FlightWriter(engine, max_latency=0.1)
+        writer.RETRY_DELAY = 0
+        key = writer.new_flight(self.flight)
+        writer.new_positions(key, [self.position(0)])
+        writer.close()
+
+        self.assertEqual(engine.commits, 1)
+        self.assertEqual([table for table, _ in engine.statements], ['nextval', 'nextval', 'flights', 'positions'])
+        self.assertEqual(engine.statements[-1][1][0][0], '102')  # The id of the failed attempt is skipped
+        self.assertEqual(writer.dropped, 0)
+
+    def test_copy_failure(self):
+        """A COPY failing on a lost connection is retried until the database is back, without dropping intents."""
+        engine = EngineStub(copy_failures=self.FlightWriter.RETRIES + 3)
+        writer = self.FlightWriter(engine, max_latency=0.1)
+        writer.RETRY_DELAY = 0
+        key = writer.new_flight(self.flight)
+        writer.new_positions(key, [self.position(0)])
+        writer.close()
+
+        self.assertEqual(engine.commits, 1)
+        self.assertEqual(writer.dropped, 0)
+
+    def test_data_error(self):
+        """A group failing with a data error is dropped after RETRIES, and so are the later intents of its flight."""
+        engine = EngineStub(copy_failures=self.FlightWriter.RETRIES + 1, copy_error=psycopg2.DataError)
+        writer = self.FlightWriter(engine, max_latency=0.1)
+        writer.RETRY_DELAY = 0
+        key = writer.new_flight(self.flight)
+        writer.new_positions(key, [self.position(0)])
+        while writer.dropped == 0 and writer.commits == 0:
+            time.sleep(0.01)
+        writer.new_positions(key, [self.position(1)])  # The writer thread is still alive
+        writer.close()
+
+        self.assertEqual(writer.dropped, 3)
+        self.assertEqual(engine.commits, 1)
+
+    def test_writer_failure(self):
+        """A writer thread which fails outright keeps draining the queue and counts the intents as dropped."""
+        engine = Mock()
+        engine.connect.side_effect = OperationalError('connect', {}, Exception("Connection refused"))
+        writer = self.FlightWriter(engine, max_latency=0.1)
+        key = writer.new_flight(self.flight)
+        writer.new_positions(key, [self.position(0)])
+        writer.close()
+
+        self.assertEqual(writer.dropped, 2)
+
+    def test_resume_flight(self):
+        """A resumed flight continues on its row: No insert, updates and positions use its id."""
+        engine = EngineStub()
+        writer = self.FlightWriter(engine, max_latency=0.1)
+        key = writer.resume_flight(42)
+        writer.new_positions(key, [self.position(0)])
+        writer.update_flight(key, self.flight)
+        writer.close()
+
+        self.assertEqual([table for table, _ in engine.statements], ['flights', 'positions'])
+        (_, updates), (_, positions) = engine.statements
+        self.assertEqual(updates[0]['_id'], 42)
+        self.assertEqual(positions[0][0], '42')
+        self.assertEqual(writer.flight_id(key), 42)
+
+
+class TestCurrentFlightsWriter(unittest.TestCase):
+
+    def setUp(self):
+        with patch('os.environ'):
+            from dump1090_postgis.adsb_parser import AdsbMessage, AdsbMessageFilter, FileSource
+            from dump1090_postgis.clock import StreamClock
+            from dump1090_postgis.flights import CurrentFlights
+            from dump1090_postgis.writer import FlightWriter
+
+        self.session = Mock(spec=sqlalchemy.orm.session.Session)
+        self.writer = Mock(spec=FlightWriter)
+        self.writer.new_flight.side_effect = itertools.count()
+        self.current_flights = CurrentFlights(self.session, adsb_filter=AdsbMessageFilter(), clock=StreamClock(),
+                                              writer=self.writer)
+        self.messages = AdsbMessage(FileSource(os.path.join(TESTS_DIR, 'adsb_message_stream.txt')))
+
+    def test_intents(self):
+        """The pool submits all flights and positions to the writer and never touches the session."""
+        flights = []
+        for msg in self.messages:
+            new = msg.hexident not in self.current_flights.hexidents()
+            self.current_flights.update(msg)
+            if new and msg.hexident in self.current_flights.hexidents():
+                flights.append(self.current_flights[msg.hexident])
+        self.current_flights.close()
+
+        self.assertEqual(self.writer.new_flight.call_count, len(flights))
+        submitted = {}
+        for (key, positions), _ in self.writer.new_positions.call_args_list:
+            submitted.setdefault(key, []).extend(positions)
+        for flight in flights:
+            # Submitted positions are released, only the recent positions are kept
+            self.assertEqual(list(flight.positions), [])
+            recent = list(flight.recent_positions)
+            self.assertEqual(submitted.get(flight.writer_key, [])[-len(recent):] if recent else [], recent)
+        self.writer.close.assert_called_once()
+        self.session.add.assert_not_called()
+        self.session.commit.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()